@@ -1,17 +1,37 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import atexit
 import base64
+import importlib.machinery
+import math
+import os
+import tempfile
 from io import BytesIO
 import time
-import openpyxl
-from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
-from openpyxl.utils import get_column_letter
 import warnings
 
+from excel_diff import compare_sheets_parallel, diff_frames, default_worker_count
+from excel_diff.alignment import DEFAULT_ALIGNMENT
+from excel_diff.export import MODIFIED_COLOR, STATUS_COLORS, ExportJob
+from excel_diff.formats import DEFAULT_EXPORT_FORMAT, EXPORT_FORMATS, FORMAT_EXTENSIONS, FORMAT_MIME_TYPES, format_available
+from excel_diff.history import diff_versions, version_labels, write_history_excel
+from excel_diff.instrument import Metrics, configure_metrics_log, profile_run, stage
+from excel_diff.parallel import SAFE_START_METHOD
+from excel_diff.prefetch import FAILED, PENDING, SheetPrefetcher, load_sheet_data
+from excel_diff.reader import DEFAULT_ENGINE, SHEET_INFO_SAMPLE_ROWS, calamine_available, read_sheet_info, read_sheet_names
+from excel_diff.result import STATUS_CATEGORIES
+from excel_diff.rules import DEFAULT_RULE, normalize_rule, rule_is_active, rules_key
+from excel_diff.schema import align_columns
+from excel_diff.snapshot import SnapshotStore, content_hash, snapshots_available
+
 # 忽略警告
 warnings.filterwarnings('ignore')
 
+# Streamlit把页面脚本作为没有 __spec__ 的 __main__ 模块执行, forkserver/spawn启动的工作进程
+# 会按 __file__ 重新执行整个页面脚本; 标记为 __main__ 后工作进程不再导入页面 (工作进程只执行 excel_diff 包中的函数)
+__spec__ = importlib.machinery.ModuleSpec('__main__', None)
+
 # 设置页面
 st.set_page_config(
     page_title="Excel对比与标记工具",
@@ -39,24 +59,439 @@ if 'sheet_names2' not in st.session_state:
     st.session_state.sheet_names2 = []
 if 'marked_results' not in st.session_state:
     st.session_state.marked_results = {}
+if 'result_counter' not in st.session_state:
+    st.session_state.result_counter = 0
 if 'sheet_key_columns' not in st.session_state:
     st.session_state.sheet_key_columns = {}
+if 'file_hashes' not in st.session_state:
+    st.session_state.file_hashes = {}
+if 'max_workers' not in st.session_state:
+    st.session_state.max_workers = default_worker_count()
+if 'reader_engine' not in st.session_state:
+    st.session_state.reader_engine = DEFAULT_ENGINE
+if 'read_seconds' not in st.session_state:
+    st.session_state.read_seconds = 0.0
+if 'use_snapshots' not in st.session_state:
+    st.session_state.use_snapshots = snapshots_available()
+if 'incremental' not in st.session_state:
+    st.session_state.incremental = True
+if 'sheet_results' not in st.session_state:
+    st.session_state.sheet_results = {}
+if 'export_job' not in st.session_state:
+    st.session_state.export_job = None
+if 'viewer_rows' not in st.session_state:
+    st.session_state.viewer_rows = None
+if 'alignment' not in st.session_state:
+    st.session_state.alignment = DEFAULT_ALIGNMENT
+if 'sheet_rules' not in st.session_state:
+    st.session_state.sheet_rules = {}
+if 'sheet_mappings' not in st.session_state:
+    st.session_state.sheet_mappings = {}
+if 'normalize_headers' not in st.session_state:
+    st.session_state.normalize_headers = False
+if 'metrics' not in st.session_state:
+    st.session_state.metrics = None
+if 'profile_enabled' not in st.session_state:
+    st.session_state.profile_enabled = False
+if 'profile_data' not in st.session_state:
+    st.session_state.profile_data = None
+if 'export_format' not in st.session_state:
+    st.session_state.export_format = DEFAULT_EXPORT_FORMAT
+if 'prefetch' not in st.session_state:
+    st.session_state.prefetch = True
+if 'compare_mode' not in st.session_state:
+    st.session_state.compare_mode = 'pair'
+if 'version_history' not in st.session_state:
+    st.session_state.version_history = None
+if 'version_history_excel' not in st.session_state:
+    st.session_state.version_history_excel = None
+
+# 设置了环境变量 EXCEL_DIFF_METRICS_LOG 时, 每次对比各阶段的性能记录以JSON行追加写入该文件
+if os.environ.get('EXCEL_DIFF_METRICS_LOG'):
+    configure_metrics_log(os.environ['EXCEL_DIFF_METRICS_LOG'])
+
+# 后台导出时刷新进度的间隔 (秒)
+EXPORT_POLL_SECONDS = 1.0
+
+# 后台预读取时刷新各sheet状态的间隔 (秒)
+PREFETCH_POLL_SECONDS = 1.0
+
+# 预读取状态的显示图标
+PREFETCH_ICONS = {
+    PENDING: "⏳",
+    FAILED: "❌"
+}
+
+# 结果查看器每页可选的行数
+VIEWER_PAGE_SIZES = [50, 100, 200, 500]
+
+# 单元格比较规则的表头
+RULE_LABELS = {
+    'abs_tol': "绝对容差",
+    'rel_tol': "相对容差",
+    'numbers': "数字文本按数值比较",
+    'strip': "忽略首尾空白",
+    'ignore_case': "忽略大小写",
+    'dates': "只比较日期"
+}
 
-# 颜色定义 - 使用aRGB格式 (8位十六进制值)
-UNCHANGED_COLOR = "FFD3D3D3"  # 灰色 - 不变
-ADDED_COLOR = "FF90EE90"     # 浅绿色 - 新增
-DELETED_COLOR = "FFADD8E6"   # 浅蓝色 - 删除
-MODIFIED_COLOR = "FFFFFF00"  # 黄色 - 修改单元格
-HEADER_COLOR = "FFDAE8FC"    # 浅蓝色 - 表头
-
-# 创建边框样式
-thin_border = Border(
-    left=Side(style='thin'),
-    right=Side(style='thin'),
-    top=Side(style='thin'),
-    bottom=Side(style='thin')
+# 没有关键列时的行对齐方式
+ALIGNMENT_LABELS = {
+    'key': "按行号 (默认)",
+    'similarity': "按内容相似度 (行顺序可以不同)",
+    'sequence': "按行顺序 (适合追加、插入为主的表)"
+}
+
+# 导出格式 (Parquet需要pyarrow, 未安装时不显示)
+EXPORT_FORMAT_LABELS = {
+    'xlsx': "带标记的Excel (所有行)",
+    'changes-xlsx': "带标记的Excel (只含变化的行)",
+    'csv': "CSV (变化的行, 原值/新值列)",
+    'parquet': "Parquet (变化的行, 原值/新值列)",
+    'json': "JSON Patch (单元格级别的修改)"
+}
+
+# 对比模式
+COMPARE_MODE_LABELS = {
+    'pair': "两个文件",
+    'versions': "多个版本 (变化历史)"
+}
+
+# 读取引擎选项 (auto: 安装了python-calamine时使用calamine, 否则使用openpyxl/xlrd)
+READER_ENGINE_LABELS = {
+    'auto': "自动",
+    'calamine': "calamine (快速)",
+    'openpyxl': "openpyxl (兼容)"
+}
+st.session_state.reader_engine = st.sidebar.selectbox(
+    "读取引擎",
+    options=list(READER_ENGINE_LABELS),
+    index=list(READER_ENGINE_LABELS).index(st.session_state.reader_engine),
+    format_func=READER_ENGINE_LABELS.get,
+    help="calamine读取速度明显更快; 读取失败时自动回退到openpyxl" if calamine_available() else "未安装python-calamine, 将使用openpyxl读取"
+)
+
+# 本地快照 - 解析过的sheet保存在本地, 再次上传相同内容的文件时不需要重新解析
+SNAPSHOT_STORE = SnapshotStore() if snapshots_available() else None
+st.session_state.use_snapshots = st.sidebar.checkbox(
+    "使用本地快照",
+    value=st.session_state.use_snapshots,
+    disabled=SNAPSHOT_STORE is None,
+    help="解析过的Sheet以列式格式保存在本地, 每天对比同一个基准文件时可以跳过Excel解析" if SNAPSHOT_STORE is not None else "需要安装pyarrow"
+)
+
+# 后台预读取 - 上传后立即在后台解析两个文件的所有sheet, 对比时只等待还没有完成的sheet
+st.session_state.prefetch = st.sidebar.checkbox(
+    "上传后后台读取所有Sheet",
+    value=st.session_state.prefetch,
+    help="选择Sheet和关键列的同时在后台进程中解析文件, 点击对比时大部分Sheet已经读取完成; 文件很大且只对比少数Sheet时可以关闭"
 )
 
+# 性能分析 - 对比时记录cProfile统计, 可以在结果的"性能"中下载
+st.session_state.profile_enabled = st.sidebar.checkbox(
+    "性能分析 (cProfile)",
+    value=st.session_state.profile_enabled,
+    help="记录对比过程的函数级耗时, 可下载后用pstats或snakeviz查看"
+)
+
+# 对比模式 - 多个版本时按顺序逐个对比相邻的版本, 显示每行在哪个版本新增、修改或删除
+st.session_state.compare_mode = st.sidebar.radio(
+    "对比模式",
+    options=list(COMPARE_MODE_LABELS),
+    index=list(COMPARE_MODE_LABELS).index(st.session_state.compare_mode),
+    format_func=COMPARE_MODE_LABELS.get,
+    help="同一份报表每周一个新版本时, 可以一次上传N个版本查看N-1步的变化和每行的变化历史"
+)
+
+# 解析缓存最多保留的sheet数量 (超出后淘汰最久未使用的sheet)
+SHEET_CACHE_MAX_ENTRIES = 32
+
+# 后台预读取器 (服务进程中只有一个, 所有会话共享同一个进程池), 服务器退出时删除临时文件
+@st.cache_resource(show_spinner=False)
+def get_prefetcher():
+    prefetcher = SheetPrefetcher(start_method=SAFE_START_METHOD)
+    atexit.register(prefetcher.close)
+    return prefetcher
+
+PREFETCHER = get_prefetcher()
+
+# 计算上传文件内容的哈希 - 同一个上传文件只计算一次
+def get_file_hash(file):
+    if file.file_id not in st.session_state.file_hashes:
+        st.session_state.file_hashes[file.file_id] = content_hash(file.getvalue())
+    return st.session_state.file_hashes[file.file_id]
+
+# 读取工作簿的sheet名称 (按内容哈希缓存)
+@st.cache_data(max_entries=SHEET_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_sheet_names(file_hash, engine, _file_bytes):
+    return read_sheet_names(BytesIO(_file_bytes), engine=engine)
+
+# 完整解析一个sheet (按内容哈希和sheet名称缓存, 所有会话共享)
+# 已经在后台预读取的sheet等待预读取完成; 否则直接读取, 使用快照时优先读取本地快照, 没有快照时解析后保存
+# 返回 (DataFrame, 列哈希), 是缓存中的同一个对象, 调用方不要原地修改
+@st.cache_resource(max_entries=SHEET_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_sheet(file_hash, sheet_name, engine, use_snapshots, _file_bytes):
+    prefetched = PREFETCHER.result(file_hash, sheet_name, engine)
+    if prefetched is not None:
+        return prefetched
+    return load_sheet_data(_file_bytes, file_hash, sheet_name, engine, SNAPSHOT_STORE if use_snapshots else None)
+
+# 只读取sheet的表头和少量样本行 (列名、行数、列类型)
+@st.cache_data(max_entries=SHEET_CACHE_MAX_ENTRIES * 4, show_spinner=False)
+def load_sheet_info(file_hash, sheet_name, _file_bytes):
+    return read_sheet_info(BytesIO(_file_bytes), sheet_name)
+
+# 上传后开始在后台读取文件的所有sheet (同一个文件只提交一次)
+def start_prefetch(file, sheet_names):
+    if st.session_state.prefetch:
+        PREFETCHER.prefetch(
+            file.getvalue(), get_file_hash(file), sheet_names, st.session_state.reader_engine,
+            SNAPSHOT_STORE if st.session_state.use_snapshots else None
+        )
+
+# 显示文件各sheet的后台读取状态
+def show_prefetch_status(file):
+    status = PREFETCHER.status(get_file_hash(file), st.session_state.reader_engine)
+    if not status:
+        return
+    ready = sum(state not in (PENDING, FAILED) for state in status.values())
+    sheets = " · ".join(f"{PREFETCH_ICONS.get(state, '✅')} {sheet_name}" for sheet_name, state in status.items())
+    st.caption(f"后台读取: {ready}/{len(status)}个Sheet已完成 — {sheets}")
+
+# 显示后台读取状态, 还有未完成的sheet时定时刷新
+def prefetch_status(file):
+    status = PREFETCHER.status(get_file_hash(file), st.session_state.reader_engine)
+    pending = PENDING in status.values()
+    st.fragment(show_prefetch_status, run_every=PREFETCH_POLL_SECONDS if pending else None)(file)
+
+# 编辑一个sheet的单元格比较规则 (每列一行), 只保存有效的规则
+def edit_sheet_rules(sheet_name, columns):
+    rules = st.session_state.sheet_rules.get(sheet_name, {})
+    table = pd.DataFrame(
+        [[normalize_rule(rules.get(col, {}))[name] for name in RULE_LABELS] for col in columns],
+        index=pd.Index(columns, name="列"),
+        columns=list(RULE_LABELS.values())
+    )
+    with st.expander("比较规则 (可选)", expanded=bool(rules)):
+        st.caption("比较前先按规则规范化两边的值: 数值在容差内、只有空白或大小写不同、同一天的日期和时间戳都不算修改")
+        edited = st.data_editor(
+            table,
+            key=f"rules_{sheet_name}",
+            column_config={
+                RULE_LABELS['abs_tol']: st.column_config.NumberColumn(min_value=0.0, format="%g"),
+                RULE_LABELS['rel_tol']: st.column_config.NumberColumn(min_value=0.0, format="%g")
+            }
+        )
+    
+    sheet_rules = {}
+    for col, values in zip(edited.index, edited.itertuples(index=False)):
+        rule = {name: type(DEFAULT_RULE[name])(value) for name, value in zip(RULE_LABELS, values)}
+        if rule_is_active(rule):
+            sheet_rules[col] = rule
+    st.session_state.sheet_rules[sheet_name] = sheet_rules
+
+# 行对齐方式和表头规范化 (两个文件模式和多版本模式共用)
+def edit_compare_options():
+    st.session_state.alignment = st.selectbox(
+        "无关键列时的行对齐方式",
+        options=list(ALIGNMENT_LABELS),
+        index=list(ALIGNMENT_LABELS).index(st.session_state.alignment),
+        format_func=ALIGNMENT_LABELS.get,
+        help="没有选择关键列的Sheet如何配对两个文件中的行: 按内容相似度或按行顺序对齐时, "
+             "只改了部分单元格的行标记为修改, 而不是删除加新增"
+    )
+    st.session_state.normalize_headers = st.checkbox(
+        "按规范化后的表头配对列",
+        value=st.session_state.normalize_headers,
+        help="名称不同的列忽略全角/半角、首尾和连续空白、大小写后再配对, 例如 \"客户 名称\" 与 \"客户名称 \""
+    )
+
+# 多版本对比页面: 上传N个版本, 每个版本只解析一次 (与两个文件模式共用解析缓存和后台读取), 关键列哈希只计算一次
+def show_versions_page():
+    st.subheader("上传多个版本")
+    uploaded_files = st.file_uploader(
+        "选择同一份报表的多个版本 (Excel)",
+        type=["xlsx", "xls"],
+        accept_multiple_files=True,
+        key="versions_uploader"
+    )
+    sort_by_name = st.checkbox("按文件名排序 (否则按上传顺序)", value=True, help="文件名以日期开头时, 按文件名排序即为版本顺序")
+    files = sorted(uploaded_files or [], key=lambda file: file.name) if sort_by_name else list(uploaded_files or [])
+    if len(files) < 2:
+        st.info("请至少上传两个版本")
+        return
+    
+    try:
+        sheet_names = []
+        for file in files:
+            names = load_sheet_names(get_file_hash(file), st.session_state.reader_engine, file.getvalue())
+            start_prefetch(file, names)
+            sheet_names.append(names)
+    except Exception as e:
+        st.error(f"读取Excel文件出错: {str(e)}")
+        return
+    labels = version_labels(files)
+    st.caption(f"版本顺序: {' → '.join(labels)}")
+    
+    common_sheets = [name for name in sheet_names[0] if all(name in names for names in sheet_names[1:])]
+    if not common_sheets:
+        st.warning("所有版本没有共同的Sheet名称")
+        return
+    sheet_name = st.selectbox("选择要对比的Sheet", common_sheets, key="version_sheet")
+    
+    # 所有版本都有的列 (只读取表头)
+    infos = [get_sheet_info(file, sheet_name) for file in files]
+    common_columns = [
+        col for col in (infos[0]['columns'] if infos[0] else [])
+        if all(info is not None and col in info['columns'] for info in infos[1:])
+    ]
+    key_columns = st.multiselect(
+        "选择用于比较的关键列 (建议设置, 变化历史按关键列记录每一行)",
+        common_columns,
+        default=st.session_state.sheet_key_columns.get(sheet_name, []),
+        key=f"version_keys_{sheet_name}"
+    )
+    edit_sheet_rules(sheet_name, common_columns)
+    edit_compare_options()
+    
+    if st.button("开始多版本对比", use_container_width=True, type="primary"):
+        st.session_state.metrics = Metrics()
+        progress = st.progress(0.0, text="准备对比...")
+        
+        # 按顺序读取各版本 (来自解析缓存), 每读出一个版本就与前一个版本对比
+        def versions():
+            for i, (label, file) in enumerate(zip(labels, files)):
+                progress.progress(i / len(files), text=f"正在对比 {i + 1}/{len(files)}: {label}")
+                with stage(st.session_state.metrics, 'read', sheet=sheet_name) as record:
+                    df, key_hashes = load_sheet(
+                        get_file_hash(file), sheet_name, st.session_state.reader_engine, st.session_state.use_snapshots, file.getvalue()
+                    )
+                    record['rows'] = len(df)
+                    record['cells'] = df.size
+                yield label, df, key_hashes
+        
+        try:
+            with st.spinner("正在对比各版本，请稍候..."):
+                history = diff_versions(
+                    versions(), key_columns, st.session_state.alignment, st.session_state.metrics,
+                    st.session_state.sheet_rules.get(sheet_name), st.session_state.normalize_headers
+                )
+            st.session_state.version_history = (sheet_name, history)
+            st.session_state.version_history_excel = None
+            progress.progress(1.0, text=f"已完成 {len(files)}个版本")
+        except Exception as e:
+            st.error(f"多版本对比出错: {str(e)}")
+    
+    if st.session_state.version_history is None:
+        return
+    sheet_name, history = st.session_state.version_history
+    st.divider()
+    st.subheader(f"变化历史: {sheet_name}")
+    st.markdown("**各步骤状态统计:**")
+    st.dataframe(history.step_counts(), use_container_width=True)
+    
+    st.markdown("**每行的变化汇总:**")
+    st.dataframe(history.summary(), use_container_width=True, hide_index=True)
+    
+    st.markdown("**变化记录:**")
+    query = st.text_input("搜索 (关键列中包含的文本)", key="version_query")
+    events = history.events
+    if query:
+        keys = history.history_keys or list(events.columns[:1])
+        found = np.zeros(len(events), dtype=bool)
+        for col in keys:
+            found |= events[col].astype(str).str.contains(query, case=False, regex=False).to_numpy(dtype=bool)
+        events = events[found]
+    st.dataframe(events, use_container_width=True, hide_index=True)
+    
+    # 点击后才生成Excel, 生成的文件保存到下一次对比为止 (页面刷新时不重新生成)
+    if st.session_state.version_history_excel is None:
+        if st.button("生成变化历史 (Excel)", use_container_width=True):
+            output = BytesIO()
+            with st.spinner("正在生成文件..."):
+                write_history_excel({sheet_name: history}, output)
+            st.session_state.version_history_excel = output.getvalue()
+    if st.session_state.version_history_excel is not None:
+        st.download_button(
+            "下载变化历史 (Excel)",
+            data=st.session_state.version_history_excel,
+            file_name=f"变化历史_{sheet_name}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True
+        )
+
+# 获取sheet的表头信息 (列名、行数、列类型)
+def get_sheet_info(file, sheet_name):
+    try:
+        return load_sheet_info(get_file_hash(file), sheet_name, file.getvalue())
+    except Exception as e:
+        st.error(f"读取Sheet '{sheet_name}' 列名出错: {str(e)}")
+    return None
+
+# 使用说明
+st.sidebar.title("使用说明")
+st.sidebar.markdown("""
+1. **上传文件**:
+   - 左侧上传原始Excel文件
+   - 右侧上传要对比的Excel文件
+   - 上传后立即在后台读取所有Sheet (文件下方显示每个Sheet是否已读取完成), 对比时只等待还没有完成的Sheet
+
+2. **选择对比模式**:
+   - **单个Sheet**: 选择要对比的具体Sheet
+   - **所有同名Sheet**: 自动对比两个文件中名称相同的所有Sheet
+
+3. **设置关键列**:
+   - 为每个Sheet单独设置用于比较的关键列
+   - 关键列用于识别相同的行（如ID列）
+   - 关键列有重复值时, 同一关键列值的行按出现顺序逐个配对
+   - 如果不设置关键列，将使用行索引进行比较
+   - 在"比较规则"中可以为每列设置数值容差、忽略空白/大小写、数字文本按数值比较、只比较日期
+   - 没有稳定关键列时, 可以在"无关键列时的行对齐方式"中选择按内容相似度或按行顺序对齐
+
+4. **执行对比**:
+   - 点击"开始对比与标记"按钮
+
+5. **查看结果**:
+   - 分页预览标记后的数据, 可按状态筛选、按关键列搜索
+   - 查看状态统计信息
+   - 查看修改详情
+   - 展开"性能"查看各阶段 (读取、对齐、比较、导出) 的耗时和内存
+
+6. **下载结果**:
+   - 选择导出格式后点击"生成文件", 生成完成后下载
+   - 带标记的Excel可以只包含变化的行; CSV/Parquet (原值/新值列) 和JSON Patch (单元格级别的修改) 只包含变化的行, 适合大型结果和下游程序
+
+**标记说明**:
+- **不变**: 灰色背景 - 行在两个文件中完全相同
+- **新增**: 绿色背景 - 行只存在于新文件中
+- **删除**: 蓝色背景 - 行只存在于原始文件中
+- **修改**: 黄色背景 - 单元格内容被修改
+
+**修改单元格**:
+- 显示格式: "原内容->修改后内容"
+- 背景色: 黄色
+- 示例: "张三->李四"
+
+**注意事项**:
+- 关键列应在两个文件中都存在
+- 对于大型文件，对比可能需要一些时间
+- 确保两个文件有相同的结构
+- 所有同名Sheet模式只对比两个文件中都存在的Sheet
+- 所有同名Sheet模式可设置并行进程数, Sheet较多时可加快对比
+- 开启本地快照后, 再次对比相同内容的文件时不需要重新解析Excel
+- 对比模式选择"多个版本 (变化历史)"时, 可以一次上传同一份报表的多个版本, 查看相邻版本之间的变化和每行的变化历史
+""", unsafe_allow_html=True)
+
+# 页脚 (两个文件模式和多版本模式共用)
+def show_footer():
+    st.divider()
+    st.caption("© 2023 Excel对比与标记工具 | 开发: Streamlit/Xianchen Li | 版本: 6.0")
+
+if st.session_state.compare_mode == 'versions':
+    show_versions_page()
+    show_footer()
+    st.stop()
+
 # 创建两列布局
 col1, col2 = st.columns(2)
 
@@ -73,9 +508,10 @@ with col1:
         st.session_state.file1 = uploaded_file1
         # 获取所有sheet名称
         try:
-            excel_file = pd.ExcelFile(uploaded_file1)
-            st.session_state.sheet_names1 = excel_file.sheet_names
+            st.session_state.sheet_names1 = load_sheet_names(get_file_hash(uploaded_file1), st.session_state.reader_engine, uploaded_file1.getvalue())
             st.success(f"已上传: {uploaded_file1.name} ({len(st.session_state.sheet_names1)}个sheet)")
+            start_prefetch(uploaded_file1, st.session_state.sheet_names1)
+            prefetch_status(uploaded_file1)
         except Exception as e:
             st.error(f"读取Excel文件出错: {str(e)}")
 
@@ -92,240 +528,224 @@ with col2:
         st.session_state.file2 = uploaded_file2
         # 获取所有sheet名称
         try:
-            excel_file = pd.ExcelFile(uploaded_file2)
-            st.session_state.sheet_names2 = excel_file.sheet_names
+            st.session_state.sheet_names2 = load_sheet_names(get_file_hash(uploaded_file2), st.session_state.reader_engine, uploaded_file2.getvalue())
             st.success(f"已上传: {uploaded_file2.name} ({len(st.session_state.sheet_names2)}个sheet)")
+            start_prefetch(uploaded_file2, st.session_state.sheet_names2)
+            prefetch_status(uploaded_file2)
         except Exception as e:
             st.error(f"读取Excel文件出错: {str(e)}")
 
-# Excel文件处理函数
+# Excel文件处理函数 (读取耗时累计到 read_seconds, 同时记录到本次对比的性能记录)
 def read_excel(file, sheet_name=None):
+    start = time.perf_counter()
     try:
-        if sheet_name:
-            return pd.read_excel(file, sheet_name=sheet_name)
-        else:
-            return pd.read_excel(file)
+        with stage(st.session_state.metrics, 'read', sheet=sheet_name) as record:
+            df = load_sheet(get_file_hash(file), sheet_name or 0, st.session_state.reader_engine, st.session_state.use_snapshots, file.getvalue())[0]
+            record['rows'] = len(df)
+            record['cells'] = df.size
+        return df
     except Exception as e:
         st.error(f"读取Excel文件出错: {str(e)}")
         return None
+    finally:
+        st.session_state.read_seconds += time.perf_counter() - start
 
-# 实际对比函数 - 在原始文件基础上标记修改
-def compare_and_mark_changes(df1, df2, key_columns):
-    # 检查是否有数据
-    if df1 is None or df2 is None:
-        return None, {}
-    
-    if df1.empty or df2.empty:
-        return None, {}
-    
-    # 重置索引并添加原始索引列
-    df1 = df1.reset_index(drop=True)
-    df1['__original_index'] = df1.index
-    df2 = df2.reset_index(drop=True)
-    df2['__original_index'] = df2.index
-    
-    # 处理关键列
-    if not key_columns:
-        # 如果没有指定关键列，使用所有列
-        key_columns = list(df1.columns)
-    
-    # 确保关键列在两个数据框中都存在
-    valid_key_columns = [col for col in key_columns if col in df1.columns and col in df2.columns]
-    if not valid_key_columns:
-        # 使用默认索引
-        valid_key_columns = ['__original_index']
-    
-    # 创建合并键
-    df1['__merge_key'] = df1[valid_key_columns].astype(str).apply('|'.join, axis=1)
-    df2['__merge_key'] = df2[valid_key_columns].astype(str).apply('|'.join, axis=1)
-    
-    # 找出新增行
-    added = df2[~df2['__merge_key'].isin(df1['__merge_key'])].copy()
-    
-    # 找出删除行
-    deleted = df1[~df1['__merge_key'].isin(df2['__merge_key'])].copy()
-    
-    # 找出共同行（可能被修改）
-    common_keys = set(df1['__merge_key']) & set(df2['__merge_key'])
-    common_df1 = df1[df1['__merge_key'].isin(common_keys)]
-    common_df2 = df2[df2['__merge_key'].isin(common_keys)]
-    
-    # 创建标记后的数据框 - 基于原始文件
-    marked_df = df1.copy()
-    changes_dict = {}
-    
-    # 添加状态列
-    marked_df['状态'] = '不变'
+# 获取sheet各列预先计算的行哈希 (来自快照, 对比时不需要重新计算关键列的哈希)
+def get_key_hashes(file, sheet_name):
+    try:
+        return load_sheet(get_file_hash(file), sheet_name, st.session_state.reader_engine, st.session_state.use_snapshots, file.getvalue())[1]
+    except Exception:
+        return None
+
+# sheet是否已经在后台读取 (两个文件都已提交, 可能还没有完成)
+def sheet_prefetched(sheet_name):
+    return all(
+        PREFETCHER.submitted(get_file_hash(file), sheet_name, st.session_state.reader_engine)
+        for file in (st.session_state.file1, st.session_state.file2)
+    )
+
+# 编辑一个sheet的列名映射 (原始文件中没有同名列的列 -> 对比文件中的列), 返回两个sheet配对的列 (使用原始文件的列名)
+def edit_sheet_mapping(sheet_name, columns1, columns2):
+    mapping = st.session_state.sheet_mappings.get(sheet_name, {})
+    only1 = [col for col in columns1 if col not in columns2]
+    only2 = [col for col in columns2 if col not in columns1]
+    if only1 and only2:
+        table = pd.DataFrame(
+            {"对比文件列名": [mapping.get(col) if mapping.get(col) in only2 else None for col in only1]},
+            index=pd.Index(only1, name="原始文件列名")
+        )
+        with st.expander("列名映射 (可选)", expanded=bool(mapping)):
+            st.caption("两个文件中名称不同的同一列 (改名的列): 配对后按一列比较, 而不是报告为删除列和新增列")
+            edited = st.data_editor(
+                table,
+                key=f"mapping_{sheet_name}",
+                column_config={"对比文件列名": st.column_config.SelectboxColumn(options=only2)}
+            )
+        mapping = {col: value for col, value in edited["对比文件列名"].items() if pd.notna(value)}
+    else:
+        mapping = {}
+    st.session_state.sheet_mappings[sheet_name] = mapping
     
-    # 标记删除行
-    for idx in deleted.index:
-        marked_df.at[idx, '状态'] = '删除'
+    schema = align_columns(columns1, columns2, mapping, st.session_state.normalize_headers)
+    return [col1 for col1, _ in schema.pairs]
+
+# 显示两个sheet的列结构变化 (删除列、新增列、改名的列)
+def show_schema_changes(schema):
+    if schema is None or not schema.changed:
+        return
+    parts = []
+    if schema.removed:
+        parts.append(f"删除列: {', '.join(str(col) for col in schema.removed)}")
+    if schema.added:
+        parts.append(f"新增列: {', '.join(str(col) for col in schema.added)}")
+    if schema.renamed:
+        parts.append(f"改名: {', '.join(f'“{col1}”->“{col2}”' for col1, col2 in schema.renamed.items())}")
+    st.info(f"列结构变化: {'; '.join(parts)}")
+
+# 显示两个sheet的基本统计信息
+def show_sheet_stats(info1, info2):
+    if info1 is None or info2 is None:
+        return
     
-    # 标记修改行
-    for key in common_keys:
-        row1 = common_df1[common_df1['__merge_key'] == key].iloc[0]
-        row2 = common_df2[common_df2['__merge_key'] == key].iloc[0]
-        idx = row1['__original_index']
-        
-        # 比较所有列
-        cell_changes = {}
-        has_changes = False
-        
-        for col in df1.columns:
-            if col in ['__merge_key', '__original_index', '状态']:
-                continue
-                
-            # 处理NaN值比较
-            val1 = row1[col]
-            val2 = row2[col]
-            
-            if pd.isna(val1) and pd.isna(val2):
-                # 两个都是NaN，视为相同
-                cell_changes[col] = False
-            elif pd.isna(val1) or pd.isna(val2) or val1 != val2:
-                # 值不同
-                has_changes = True
-                cell_changes[col] = True
-                
-                # 创建修改标记字符串
-                old_val = str(val1) if not pd.isna(val1) else "空"
-                new_val = str(val2) if not pd.isna(val2) else "空"
-                marked_df.at[idx, col] = f"{old_val}->{new_val}"
-            else:
-                # 值相同
-                cell_changes[col] = False
-        
-        if has_changes:
-            marked_df.at[idx, '状态'] = '修改'
-            changes_dict[idx] = cell_changes
+    def describe(info):
+        rows = info['row_count'] if info['row_count'] is not None else "未知"
+        return f"{rows}行 × {len(info['columns'])}列"
     
-    # 添加新增行
-    for _, row in added.iterrows():
-        new_row = row.copy()
-        # 从新行中移除内部列
-        if '__merge_key' in new_row:
-            new_row.pop('__merge_key')
-        if '__original_index' in new_row:
-            new_row.pop('__original_index')
-        
-        # 设置状态
-        new_row['状态'] = '新增'
-        
-        # 添加到标记数据框
-        marked_df = pd.concat([marked_df, new_row.to_frame().T], ignore_index=True)
+    st.caption(f"原始文件: {describe(info1)} | 对比文件: {describe(info2)}")
+    with st.expander(f"列类型 (按前{SHEET_INFO_SAMPLE_ROWS}行推断)"):
+        dtype_table = pd.DataFrame({
+            '原始文件': pd.Series(info1['dtypes'], dtype=object),
+            '对比文件': pd.Series(info2['dtypes'], dtype=object)
+        }).fillna("-")
+        st.dataframe(dtype_table, use_container_width=True)
+
+# 显示本次对比读取文件的耗时 (并行模式下在子进程中读取, 不显示)
+def show_read_time():
+    if st.session_state.read_seconds > 0:
+        engine = READER_ENGINE_LABELS[st.session_state.reader_engine]
+        st.caption(f"读取耗时: {st.session_state.read_seconds:.2f}秒 (读取引擎: {engine})")
+
+# 单个sheet对比结果的缓存键 - 两个文件的内容、sheet名称、关键列、比较规则、列配对方式、读取选项和对齐方式都相同时结果不变
+def sheet_result_key(sheet_name, key_columns):
+    return (
+        get_file_hash(st.session_state.file1),
+        get_file_hash(st.session_state.file2),
+        sheet_name,
+        tuple(key_columns),
+        rules_key(st.session_state.sheet_rules.get(sheet_name)),
+        tuple(sorted(st.session_state.sheet_mappings.get(sheet_name, {}).items())),
+        st.session_state.normalize_headers,
+        st.session_state.reader_engine,
+        st.session_state.alignment
+    )
+
+# 取出可以复用的上次对比结果, 没有或输入已变化时返回None
+def cached_sheet_result(sheet_name, key_columns):
+    if not st.session_state.incremental:
+        return None
+    entry = st.session_state.sheet_results.get(sheet_name)
+    if entry is not None and entry[0] == sheet_result_key(sheet_name, key_columns):
+        return entry[1]
+    return None
+
+# 新的sheet对比结果 - 每个新结果带一个递增的版本号, 用作导出文件和结果查看器的缓存键
+# (不使用结果对象的内存地址: 对象被回收后地址可能被新的结果重用)
+def new_sheet_result(diff, key_columns, rules):
+    st.session_state.result_counter += 1
+    return {
+        'diff': diff,
+        'key_columns': key_columns,
+        'rules': rules,
+        'version': st.session_state.result_counter
+    }
+
+# 保存一个sheet的对比结果 - 每个sheet只保留最近一次的结果, 换了文件后清除旧文件的结果
+def save_sheet_result(sheet_name, result):
+    key = sheet_result_key(sheet_name, result['key_columns'])
+    st.session_state.sheet_results = {
+        name: entry for name, entry in st.session_state.sheet_results.items()
+        if entry[0][:2] == key[:2]
+    }
+    st.session_state.sheet_results[sheet_name] = (key, result)
+
+# 当前对比结果的版本 - 各sheet的结果都没有替换 (例如增量对比全部复用) 时版本不变, 可以继续使用已生成的文件
+def results_version():
+    return tuple((sheet_name, result['version']) for sheet_name, result in st.session_state.marked_results.items())
+
+# 显示后台导出的进度, 完成后刷新页面显示下载按钮
+def show_export_progress():
+    job = st.session_state.export_job
+    if job.done:
+        st.rerun()
+    st.progress(job.progress, text=f"正在生成文件... {job.written_rows}/{job.total_rows}行")
+
+# 按状态和关键字筛选结果行 (结果和筛选条件不变时不重新计算)
+# version: 结果的版本号 (与导出缓存相同), 重新对比后即使对象地址被复用也不会命中旧的缓存
+def find_result_rows(sheet_name, version, diff, statuses, query, search_columns):
+    key = (sheet_name, version, tuple(statuses), query, tuple(search_columns))
+    if st.session_state.viewer_rows is None or st.session_state.viewer_rows[0] != key:
+        st.session_state.viewer_rows = (key, diff.find_rows(statuses, query, search_columns))
+    return st.session_state.viewer_rows[1]
+
+# 给一页结果加上与导出文件相同的背景色 (修改行只标出修改的单元格)
+# 对象类型的列 (修改单元格 "原内容->修改后内容" 与原来的数值混在一起) 转为文本, 否则发送到浏览器时Arrow转换失败
+def style_result_page(page, changes):
+    page = page.copy()
+    for col in page.columns[page.dtypes == object]:
+        page[col] = page[col].astype(str).where(page[col].notna(), None)
     
-    # 移除内部列
-    for col in ['__merge_key', '__original_index']:
-        if col in marked_df.columns:
-            marked_df.drop(columns=[col], inplace=True)
+    def background(argb):
+        return f"background-color: #{argb[2:]}"
     
-    # 重新排列列，将状态列放在最前面
-    cols = marked_df.columns.tolist()
-    if '状态' in cols:
-        cols.remove('状态')
-        cols.insert(0, '状态')
-    marked_df = marked_df[cols]
+    def row_style(row):
+        if row['状态'] in STATUS_COLORS:
+            return [background(STATUS_COLORS[row['状态']])] * len(row)
+        row_changes = changes.get(row.name, {})
+        return [background(MODIFIED_COLOR) if row_changes.get(col) else "" for col in row.index]
     
-    return marked_df, changes_dict
+    return page.style.apply(row_style, axis=1)
 
-# 生成带标记的Excel文件
-def generate_marked_excel(marked_results):
-    # 创建一个新的工作簿
-    wb = openpyxl.Workbook()
-    
-    # 删除默认创建的sheet
-    if 'Sheet' in wb.sheetnames:
-        wb.remove(wb['Sheet'])
+# 分页查看一个sheet的对比结果 - 只把当前页的数据发送到浏览器
+def show_result_viewer(sheet_name, version, diff, key_columns):
+    filter_col, search_col, size_col = st.columns([2, 2, 1])
+    with filter_col:
+        statuses = st.multiselect(
+            "按状态筛选",
+            STATUS_CATEGORIES,
+            default=['修改', '新增', '删除'],
+            key=f"viewer_status_{sheet_name}"
+        )
+    with search_col:
+        query = st.text_input(
+            "按关键列搜索" if key_columns else "搜索 (所有列)",
+            key=f"viewer_query_{sheet_name}"
+        )
+    with size_col:
+        page_size = st.selectbox("每页行数", VIEWER_PAGE_SIZES, key="viewer_page_size")
     
-    # 为每个sheet创建标记结果
-    for sheet_name, result in marked_results.items():
-        marked_df = result['marked_df']
-        changes_dict = result['changes_dict']
-        
-        # 创建sheet
-        ws = wb.create_sheet(title=sheet_name[:31])  # 限制sheet名称长度
-        
-        # 写入标题行
-        columns = marked_df.columns.tolist()
-        
-        for col_idx, col in enumerate(columns, 1):
-            cell = ws.cell(row=1, column=col_idx, value=col)
-            cell.fill = PatternFill(start_color=HEADER_COLOR, end_color=HEADER_COLOR, fill_type="solid")
-            cell.font = Font(bold=True)
-            cell.border = thin_border
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-        
-        # 写入数据行
-        for row_idx, (idx, row) in enumerate(marked_df.iterrows(), 2):
-            status = row['状态']  # 获取状态
-            
-            # 写入每列数据
-            for col_idx, col in enumerate(columns, 1):
-                value = row[col]
-                
-                # 处理NaN值
-                if pd.isna(value):
-                    value = ""
-                
-                cell = ws.cell(row=row_idx, column=col_idx, value=value)
-                cell.border = thin_border
-                
-                # 设置行状态背景色
-                if status == '不变':
-                    cell.fill = PatternFill(start_color=UNCHANGED_COLOR, end_color=UNCHANGED_COLOR, fill_type="solid")
-                elif status == '新增':
-                    cell.fill = PatternFill(start_color=ADDED_COLOR, end_color=ADDED_COLOR, fill_type="solid")
-                elif status == '删除':
-                    cell.fill = PatternFill(start_color=DELETED_COLOR, end_color=DELETED_COLOR, fill_type="solid")
-                
-                # 如果是修改行，并且有单元格被修改
-                if status == '修改' and col != '状态':
-                    # 检查这个单元格是否有修改
-                    if idx in changes_dict and col in changes_dict[idx] and changes_dict[idx][col]:
-                        cell.fill = PatternFill(start_color=MODIFIED_COLOR, end_color=MODIFIED_COLOR, fill_type="solid")
-        
-        # 自动调整列宽
-        for col in ws.columns:
-            max_length = 0
-            column_letter = get_column_letter(col[0].column)
-            
-            # 第一行是标题
-            max_length = max(max_length, len(str(col[0].value)))
-            
-            for cell in col[1:]:
-                try:
-                    value = cell.value
-                    if value is None:
-                        continue
-                    if isinstance(value, (int, float)):
-                        value = str(value)
-                    if len(value) > max_length:
-                        max_length = len(value)
-                except:
-                    pass
-            
-            adjusted_width = (max_length + 2) * 1.2
-            ws.column_dimensions[column_letter].width = min(adjusted_width, 50)  # 限制最大列宽
-        
-        # 冻结首行
-        ws.freeze_panes = 'A2'
+    rows = find_result_rows(sheet_name, version, diff, statuses, query.strip(), key_columns)
+    pages = max(1, math.ceil(len(rows) / page_size))
     
-    # 保存到字节流
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+    # 筛选条件改变后行数变少时回到第一页
+    page_key = f"viewer_page_{sheet_name}"
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = 1
+    page = st.number_input(
+        f"页码 (共{pages}页, {len(rows)}行)",
+        min_value=1,
+        max_value=pages,
+        step=1,
+        key=page_key
+    )
     
-    return output
-
-# 获取sheet的列名
-def get_sheet_columns(file, sheet_name):
-    try:
-        df = read_excel(file, sheet_name)
-        if df is not None:
-            return list(df.columns)
-    except Exception as e:
-        st.error(f"读取Sheet '{sheet_name}' 列名出错: {str(e)}")
-    return []
+    page_rows = rows[(page - 1) * page_size:page * page_size]
+    if len(page_rows):
+        st.dataframe(
+            style_result_page(diff.marked_rows(page_rows), diff.changes_for_rows(page_rows)),
+            use_container_width=True
+        )
+    else:
+        st.info("没有符合条件的行")
 
 # 对比选项
 st.divider()
@@ -335,6 +755,19 @@ st.subheader("对比选项")
 col1, col2 = st.columns(2)
 with col1:
     st.session_state.all_sheets = st.checkbox("对比所有同名Sheet", value=False)
+    if st.session_state.all_sheets:
+        st.session_state.max_workers = st.number_input(
+            "并行进程数 (1为不并行)",
+            min_value=1,
+            max_value=default_worker_count(),
+            value=st.session_state.max_workers,
+            step=1
+        )
+    st.session_state.incremental = st.checkbox(
+        "增量对比 (只重新计算输入有变化的Sheet)",
+        value=st.session_state.incremental
+    )
+    edit_compare_options()
 
 with col2:
     if not st.session_state.all_sheets and st.session_state.sheet_names1 and st.session_state.sheet_names2:
@@ -356,11 +789,14 @@ if st.session_state.file1 and st.session_state.file2:
     if not st.session_state.all_sheets and st.session_state.selected_sheet:
         st.subheader(f"关键列设置: {st.session_state.selected_sheet}")
         
-        # 获取两个sheet的列名
-        cols1 = get_sheet_columns(st.session_state.file1, st.session_state.selected_sheet)
-        cols2 = get_sheet_columns(st.session_state.file2, st.session_state.selected_sheet)
+        # 获取两个sheet的列名 (只读取表头)
+        info1 = get_sheet_info(st.session_state.file1, st.session_state.selected_sheet)
+        info2 = get_sheet_info(st.session_state.file2, st.session_state.selected_sheet)
+        cols1 = info1['columns'] if info1 else []
+        cols2 = info2['columns'] if info2 else []
+        show_sheet_stats(info1, info2)
         
-        common_columns = list(set(cols1) & set(cols2))
+        common_columns = edit_sheet_mapping(st.session_state.selected_sheet, cols1, cols2)
         
         if common_columns:
             # 初始化当前sheet的关键列
@@ -377,6 +813,7 @@ if st.session_state.file1 and st.session_state.file2:
             
             # 更新关键列
             st.session_state.sheet_key_columns[st.session_state.selected_sheet] = selected_keys
+            edit_sheet_rules(st.session_state.selected_sheet, common_columns)
         else:
             st.warning("两个Sheet没有共同的列名，无法设置关键列")
     
@@ -387,11 +824,14 @@ if st.session_state.file1 and st.session_state.file2:
         
         if common_sheets:
             for sheet_name in common_sheets:
-                # 获取两个sheet的列名
-                cols1 = get_sheet_columns(st.session_state.file1, sheet_name)
-                cols2 = get_sheet_columns(st.session_state.file2, sheet_name)
+                # 获取两个sheet的列名 (只读取表头)
+                info1 = get_sheet_info(st.session_state.file1, sheet_name)
+                info2 = get_sheet_info(st.session_state.file2, sheet_name)
+                cols1 = info1['columns'] if info1 else []
+                cols2 = info2['columns'] if info2 else []
                 
-                common_columns = list(set(cols1) & set(cols2))
+                st.markdown(f"**Sheet: {sheet_name}**")
+                common_columns = edit_sheet_mapping(sheet_name, cols1, cols2)
                 
                 if common_columns:
                     # 初始化当前sheet的关键列
@@ -399,7 +839,7 @@ if st.session_state.file1 and st.session_state.file2:
                         st.session_state.sheet_key_columns[sheet_name] = []
                     
                     # 创建关键列选择器
-                    st.markdown(f"**Sheet: {sheet_name}**")
+                    show_sheet_stats(info1, info2)
                     selected_keys = st.multiselect(
                         f"选择用于比较的关键列 (可选)",
                         common_columns,
@@ -409,6 +849,7 @@ if st.session_state.file1 and st.session_state.file2:
                     
                     # 更新关键列
                     st.session_state.sheet_key_columns[sheet_name] = selected_keys
+                    edit_sheet_rules(sheet_name, common_columns)
                 else:
                     st.warning(f"Sheet '{sheet_name}' 没有共同的列名，无法设置关键列")
         else:
@@ -417,7 +858,16 @@ if st.session_state.file1 and st.session_state.file2:
 # 对比按钮
 if st.button("开始对比与标记", use_container_width=True, type="primary"):
     if st.session_state.file1 and st.session_state.file2:
-        with st.spinner("正在对比文件并标记差异，请稍候..."):
+        # 每次对比单独记录性能
+        st.session_state.metrics = Metrics()
+        st.session_state.profile_data = None
+        profile_path = None
+        if st.session_state.profile_enabled:
+            fd, profile_path = tempfile.mkstemp(suffix='.prof')
+            os.close(fd)
+        
+        with st.spinner("正在对比文件并标记差异，请稍候..."), profile_run(profile_path):
+            st.session_state.read_seconds = 0.0
             # 获取文件类型
             file1_type = st.session_state.file1.name.split('.')[-1].lower()
             file2_type = st.session_state.file2.name.split('.')[-1].lower()
@@ -435,8 +885,71 @@ if st.button("开始对比与标记", use_container_width=True, type="primary"):
                         st.error("两个文件没有共同的Sheet名称")
                     else:
                         st.session_state.marked_results = {}
+                        progress = st.progress(0.0, text="准备对比...")
                         
+                        # 增量对比: 输入没有变化的sheet直接使用上次的结果, 只计算其余的sheet
+                        pending_sheets = []
                         for sheet_name in common_sheets:
+                            cached = cached_sheet_result(sheet_name, st.session_state.sheet_key_columns.get(sheet_name, []))
+                            if cached is not None:
+                                st.session_state.marked_results[sheet_name] = cached
+                            else:
+                                pending_sheets.append(sheet_name)
+                        reused = len(common_sheets) - len(pending_sheets)
+                        done = reused
+                        
+                        # 有多个sheet且允许多进程时全部用多进程并行对比, 否则在本进程中逐个对比
+                        local_sheets = pending_sheets
+                        parallel_sheets = []
+                        if st.session_state.max_workers > 1 and len(pending_sheets) > 1:
+                            local_sheets = []
+                            parallel_sheets = pending_sheets
+                        
+                        if parallel_sheets:
+                            # 已经在后台读取的sheet取得读取结果 (等待还没有完成的读取) 后传给工作进程, 不再重新解析;
+                            # 其余的sheet在工作进程中读取. 每完成一个sheet就保存结果
+                            sheet_key_columns = {
+                                sheet_name: st.session_state.sheet_key_columns.get(sheet_name, [])
+                                for sheet_name in parallel_sheets
+                            }
+                            sheet_frames = {}
+                            for sheet_name in parallel_sheets:
+                                if sheet_prefetched(sheet_name):
+                                    frames = tuple(
+                                        (read_excel(file, sheet_name), get_key_hashes(file, sheet_name))
+                                        for file in (st.session_state.file1, st.session_state.file2)
+                                    )
+                                    if all(df is not None for df, _ in frames):
+                                        sheet_frames[sheet_name] = frames
+                            results = compare_sheets_parallel(
+                                st.session_state.file1.getvalue(),
+                                st.session_state.file2.getvalue(),
+                                sheet_key_columns,
+                                max_workers=st.session_state.max_workers,
+                                engine=st.session_state.reader_engine,
+                                snapshot_store=SNAPSHOT_STORE if st.session_state.use_snapshots else None,
+                                alignment=st.session_state.alignment,
+                                metrics=st.session_state.metrics,
+                                sheet_rules=st.session_state.sheet_rules,
+                                sheet_mappings=st.session_state.sheet_mappings,
+                                normalize_headers=st.session_state.normalize_headers,
+                                # Streamlit服务器是多线程的, 不能使用fork启动工作进程
+                                start_method=SAFE_START_METHOD,
+                                sheet_frames=sheet_frames
+                            )
+                            for sheet_name, diff, error in results:
+                                done += 1
+                                if error is not None:
+                                    st.error(f"处理Sheet '{sheet_name}' 时出错: {str(error)}")
+                                elif diff is not None:
+                                    st.session_state.marked_results[sheet_name] = new_sheet_result(
+                                        diff, sheet_key_columns[sheet_name], st.session_state.sheet_rules.get(sheet_name)
+                                    )
+                                    save_sheet_result(sheet_name, st.session_state.marked_results[sheet_name])
+                                progress.progress(done / len(common_sheets), text=f"已完成 {done}/{len(common_sheets)}: {sheet_name}")
+                        
+                        for sheet_name in local_sheets:
+                            done += 1
                             try:
                                 # 获取该sheet的关键列
                                 key_columns = st.session_state.sheet_key_columns.get(sheet_name, [])
@@ -446,19 +959,33 @@ if st.button("开始对比与标记", use_container_width=True, type="primary"):
                                 df2 = read_excel(st.session_state.file2, sheet_name)
                                 
                                 # 对比并标记
-                                marked_df, changes_dict = compare_and_mark_changes(df1, df2, key_columns)
+                                key_hashes1 = get_key_hashes(st.session_state.file1, sheet_name)
+                                key_hashes2 = get_key_hashes(st.session_state.file2, sheet_name)
+                                rules = st.session_state.sheet_rules.get(sheet_name)
+                                diff = diff_frames(df1, df2, key_columns, key_hashes1, st.session_state.alignment, st.session_state.metrics, rules,
+                                                   st.session_state.sheet_mappings.get(sheet_name), st.session_state.normalize_headers,
+                                                   key_hashes2)
                                 
-                                if marked_df is not None:
-                                    st.session_state.marked_results[sheet_name] = {
-                                        'marked_df': marked_df,
-                                        'changes_dict': changes_dict,
-                                        'key_columns': key_columns
-                                    }
+                                if diff is not None:
+                                    st.session_state.marked_results[sheet_name] = new_sheet_result(diff, key_columns, rules)
+                                    save_sheet_result(sheet_name, st.session_state.marked_results[sheet_name])
                             except Exception as e:
                                 st.error(f"处理Sheet '{sheet_name}' 时出错: {str(e)}")
+                            progress.progress(done / len(common_sheets), text=f"已完成 {done}/{len(common_sheets)}: {sheet_name}")
+                        
+                        # 按sheet顺序排列结果 (复用的结果先加入)
+                        st.session_state.marked_results = {
+                            sheet_name: st.session_state.marked_results[sheet_name]
+                            for sheet_name in common_sheets
+                            if sheet_name in st.session_state.marked_results
+                        }
+                        progress.progress(1.0, text=f"已完成 {len(common_sheets)}/{len(common_sheets)}")
                         
                         if st.session_state.marked_results:
                             st.success(f"成功对比 {len(st.session_state.marked_results)} 个Sheet!")
+                            if reused:
+                                st.caption(f"增量对比: {reused}个Sheet的输入没有变化, 直接使用了上次的结果")
+                            show_read_time()
                         else:
                             st.warning("没有生成任何对比结果")
                 else:
@@ -468,28 +995,40 @@ if st.button("开始对比与标记", use_container_width=True, type="primary"):
                             # 获取该sheet的关键列
                             key_columns = st.session_state.sheet_key_columns.get(st.session_state.selected_sheet, [])
                             
-                            # 读取两个sheet的数据
-                            df1 = read_excel(st.session_state.file1, st.session_state.selected_sheet)
-                            df2 = read_excel(st.session_state.file2, st.session_state.selected_sheet)
-                            
-                            # 对比并标记
-                            marked_df, changes_dict = compare_and_mark_changes(df1, df2, key_columns)
+                            result = cached_sheet_result(st.session_state.selected_sheet, key_columns)
+                            if result is None:
+                                # 读取两个sheet的数据
+                                df1 = read_excel(st.session_state.file1, st.session_state.selected_sheet)
+                                df2 = read_excel(st.session_state.file2, st.session_state.selected_sheet)
+                                
+                                # 对比并标记
+                                key_hashes1 = get_key_hashes(st.session_state.file1, st.session_state.selected_sheet)
+                                key_hashes2 = get_key_hashes(st.session_state.file2, st.session_state.selected_sheet)
+                                rules = st.session_state.sheet_rules.get(st.session_state.selected_sheet)
+                                diff = diff_frames(df1, df2, key_columns, key_hashes1, st.session_state.alignment, st.session_state.metrics, rules,
+                                                   st.session_state.sheet_mappings.get(st.session_state.selected_sheet),
+                                                   st.session_state.normalize_headers, key_hashes2)
+                                result = new_sheet_result(diff, key_columns, rules)
+                                if diff is not None:
+                                    save_sheet_result(st.session_state.selected_sheet, result)
                             
-                            if marked_df is not None:
+                            if result['diff'] is not None:
                                 st.session_state.marked_results = {
-                                    st.session_state.selected_sheet: {
-                                        'marked_df': marked_df,
-                                        'changes_dict': changes_dict,
-                                        'key_columns': key_columns
-                                    }
+                                    st.session_state.selected_sheet: result
                                 }
                                 st.success(f"成功对比Sheet '{st.session_state.selected_sheet}'!")
+                                show_read_time()
                             else:
                                 st.warning("没有生成对比结果")
                         except Exception as e:
                             st.error(f"处理Sheet '{st.session_state.selected_sheet}' 时出错: {str(e)}")
                     else:
                         st.warning("请选择要对比的Sheet")
+        
+        if profile_path is not None:
+            with open(profile_path, 'rb') as f:
+                st.session_state.profile_data = f.read()
+            os.remove(profile_path)
     else:
         st.warning("请先上传两个Excel文件")
 
@@ -504,7 +1043,7 @@ if st.session_state.marked_results:
     
     if selected_sheet in st.session_state.marked_results:
         result = st.session_state.marked_results[selected_sheet]
-        marked_df = result['marked_df']
+        diff = result['diff']
         key_columns = result.get('key_columns', [])
         
         # 显示关键信息
@@ -515,96 +1054,98 @@ if st.session_state.marked_results:
         else:
             st.info("关键列: 未设置 (使用行索引进行比较)")
         
-        # 显示数据
-        #st.dataframe(marked_df.head(10))
+        if result.get('rules'):
+            st.info(f"比较规则: **{', '.join(str(col) for col in result['rules'])}**")
+        
+        show_schema_changes(diff.schema)
         
         # 显示统计信息
-        status_counts = marked_df['状态'].value_counts()
+        status_counts = diff.status_counts()
         st.markdown("**状态统计:**")
         for status, count in status_counts.items():
             st.write(f"- {status}: {count}行")
         
-        # 显示修改详情
-        #if any(status == '修改' for status in marked_df['状态']):
-            #st.markdown("**修改详情:**")
-            #modified_rows = marked_df[marked_df['状态'] == '修改']
-            #for idx, row in modified_rows.head(3).iterrows():
-                #st.write(f"行 {idx+1}:")
-                #for col in modified_rows.columns:
-                    #if col != '状态' and '->' in str(row[col]):
-                        #st.write(f"  - {col}: {row[col]}")
+        # 关键列有重复值时提示 (重复键的行按出现顺序逐个配对)
+        duplicates1, duplicates2 = diff.duplicate_rows
+        if duplicates1 or duplicates2:
+            st.info(
+                f"关键列有重复值: 原始文件 {duplicates1}行, 对比文件 {duplicates2}行. "
+                "同一关键列值的行按出现顺序逐个配对, 多出来的行标记为删除或新增"
+            )
+        
+        # 分页显示数据
+        st.markdown("**数据预览:**")
+        show_result_viewer(selected_sheet, result['version'], diff, key_columns)
     
     st.divider()
     
     # 下载标记结果
     st.markdown("### 💾 下载对比结果")
     
-    # 生成带标记的Excel文件
-    try:
-        marked_excel = generate_marked_excel(st.session_state.marked_results)
-        
+    # 导出格式 - 除带标记的Excel外, 其他格式只包含有变化的行, 生成更快、文件更小
+    export_formats = [export_format for export_format in EXPORT_FORMATS if format_available(export_format)]
+    st.session_state.export_format = st.selectbox(
+        "导出格式",
+        options=export_formats,
+        index=export_formats.index(st.session_state.export_format),
+        format_func=EXPORT_FORMAT_LABELS.get,
+        help="CSV/Parquet每个变化行一行, 每列分为原值和新值两列; JSON Patch列出每个修改的单元格以及删除、新增的行, "
+             "适合下游程序处理"
+    )
+    export_format = st.session_state.export_format
+    
+    # 生成导出文件 - 只在用户要求时生成, 在后台线程中运行,
+    # 生成的文件按结果版本和格式保存, 浏览结果时不会重新生成
+    job = st.session_state.export_job
+    if job is None or job.version != results_version() or job.export_format != export_format:
+        if st.button("生成文件"):
+            st.session_state.export_job = ExportJob(
+                st.session_state.marked_results, version=results_version(),
+                metrics=st.session_state.metrics, export_format=export_format
+            )
+            st.rerun()
+    elif not job.done:
+        st.fragment(show_export_progress, run_every=EXPORT_POLL_SECONDS)()
+    elif job.error is not None:
+        st.error(f"生成导出文件时出错: {str(job.error)}")
+        st.error("请确保上传的文件格式正确且包含有效数据")
+        if st.button("重新生成文件"):
+            st.session_state.export_job = ExportJob(
+                st.session_state.marked_results, version=results_version(),
+                metrics=st.session_state.metrics, export_format=export_format
+            )
+            st.rerun()
+    else:
         # 创建下载按钮
         file_name = "对比结果_"
         if len(st.session_state.marked_results) == 1:
-            file_name += f"{list(st.session_state.marked_results.keys())[0]}.xlsx"
+            file_name += f"{list(st.session_state.marked_results.keys())[0]}"
         else:
-            file_name += "多Sheet.xlsx"
+            file_name += "多Sheet"
         
         st.download_button(
-            label="下载标记的Excel文件",
-            data=marked_excel,
-            file_name=file_name,
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            label=f"下载{EXPORT_FORMAT_LABELS[export_format]}",
+            data=job.data,
+            file_name=file_name + FORMAT_EXTENSIONS[export_format],
+            mime=FORMAT_MIME_TYPES[export_format]
         )
-    except Exception as e:
-        st.error(f"生成标记的Excel文件时出错: {str(e)}")
-        st.error("请确保上传的文件格式正确且包含有效数据")
-
-# 使用说明
-st.sidebar.title("使用说明")
-st.sidebar.markdown("""
-1. **上传文件**:
-   - 左侧上传原始Excel文件
-   - 右侧上传要对比的Excel文件
-
-2. **选择对比模式**:
-   - **单个Sheet**: 选择要对比的具体Sheet
-   - **所有同名Sheet**: 自动对比两个文件中名称相同的所有Sheet
-
-3. **设置关键列**:
-   - 为每个Sheet单独设置用于比较的关键列
-   - 关键列用于识别相同的行（如ID列）
-   - 如果不设置关键列，将使用行索引进行比较
-
-4. **执行对比**:
-   - 点击"开始对比与标记"按钮
-
-5. **查看结果**:
-   - 预览标记后的数据
-   - 查看状态统计信息
-   - 查看修改详情
-
-6. **下载结果**:
-   - 下载带标记的Excel文件
-
-**标记说明**:
-- **不变**: 灰色背景 - 行在两个文件中完全相同
-- **新增**: 绿色背景 - 行只存在于新文件中
-- **删除**: 蓝色背景 - 行只存在于原始文件中
-- **修改**: 黄色背景 - 单元格内容被修改
-
-**修改单元格**:
-- 显示格式: "原内容->修改后内容"
-- 背景色: 黄色
-- 示例: "张三->李四"
-
-**注意事项**:
-- 关键列应在两个文件中都存在
-- 对于大型文件，对比可能需要一些时间
-- 确保两个文件有相同的结构
-- 所有同名Sheet模式只对比两个文件中都存在的Sheet
-""", unsafe_allow_html=True)
+    
+    # 本次对比 (和导出) 各阶段的耗时、内存和行数
+    if st.session_state.metrics is not None and st.session_state.metrics.records:
+        with st.expander("性能"):
+            metrics = st.session_state.metrics
+            st.caption(f"运行编号: {metrics.run_id} (内存为进程常驻内存, 峰值为进程到该阶段结束时的最高值)")
+            st.markdown("**按阶段汇总:**")
+            st.dataframe(metrics.summary(), hide_index=True)
+            st.markdown("**各Sheet明细:**")
+            st.dataframe(metrics.to_frame(), hide_index=True)
+            if st.session_state.profile_data is not None:
+                st.download_button(
+                    label="下载性能分析数据 (cProfile)",
+                    data=st.session_state.profile_data,
+                    file_name=f"excel_diff_{metrics.run_id}.prof",
+                    mime="application/octet-stream"
+                )
 
 # 添加页脚
-st.divider()
-st.caption("© 2023 Excel对比与标记工具 | 开发: Streamlit/Xianchen Li | 版本: 6.0")
\ No newline at end of file
+show_footer()
\ No newline at end of file
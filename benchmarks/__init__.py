@@ -0,0 +1 @@
+# 性能基准测试 (python -m benchmarks.<脚本名> 运行)
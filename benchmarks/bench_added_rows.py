@@ -0,0 +1,79 @@
+# 新增行数量的回归基准: 对比耗时中新增行带来的部分应随新增行数线性增长
+# 先测没有新增行时的耗时 T(0), 每一档只看增量耗时 T(n) - T(0), 避免固定开销 (原始数据的对齐、比较) 掩盖非线性增长
+# 运行: python -m benchmarks.bench_added_rows
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from excel_diff import compare_and_mark_changes
+
+
+# 每一档新增行数
+DEFAULT_ADDED_ROWS = [10000, 20000, 40000, 80000, 160000]
+
+# 最大档与最小档的每行增量耗时之比超过该值时视为非线性增长 (按平方增长时约为两档行数之比)
+MAX_PER_ROW_RATIO = 3.0
+
+# 构造原始数据和带新增行的对比数据
+def make_frames(base_rows, added_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df1 = pd.DataFrame({
+        'ID': np.arange(base_rows),
+        '名称': rng.choice(['张三', '李四', '王五'], base_rows),
+        '金额': rng.random(base_rows) * 1000,
+        '数量': rng.integers(0, 100, base_rows)
+    })
+    new_rows = pd.DataFrame({
+        'ID': np.arange(base_rows, base_rows + added_rows),
+        '名称': rng.choice(['张三', '李四', '王五'], added_rows),
+        '金额': rng.random(added_rows) * 1000,
+        '数量': rng.integers(0, 100, added_rows)
+    })
+    df2 = pd.concat([df1, new_rows], ignore_index=True)
+    return df1, df2
+
+# 多次运行取最短耗时
+def time_compare(df1, df2, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compare_and_mark_changes(df1, df2, ['ID'])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="新增行数量的回归基准")
+    parser.add_argument("--base-rows", type=int, default=10000, help="原始文件行数")
+    parser.add_argument("--added", type=int, nargs="+", default=DEFAULT_ADDED_ROWS, help="每一档的新增行数")
+    parser.add_argument("--repeat", type=int, default=3, help="每一档重复次数")
+    args = parser.parse_args(argv)
+    
+    df1, df2 = make_frames(args.base_rows, 0)
+    baseline = time_compare(df1, df2, args.repeat)
+    print(f"没有新增行: {baseline:.3f}秒")
+    
+    print(f"{'新增行数':>10} {'耗时(秒)':>10} {'增量(秒)':>10} {'每千行增量(毫秒)':>18}")
+    per_row = []
+    for added_rows in sorted(args.added):
+        df1, df2 = make_frames(args.base_rows, added_rows)
+        elapsed = time_compare(df1, df2, args.repeat)
+        increment = elapsed - baseline
+        per_row.append(increment / added_rows)
+        print(f"{added_rows:>10} {elapsed:>10.3f} {increment:>10.3f} {increment / added_rows * 1e6:>18.2f}")
+    
+    if per_row[0] <= 0:
+        print("最小档的增量耗时在测量误差内, 请增大 --added 的行数", file=sys.stderr)
+        return 2
+    ratio = per_row[-1] / per_row[0]
+    print(f"最大档/最小档每行增量耗时比: {ratio:.2f} (上限 {MAX_PER_ROW_RATIO})")
+    if ratio > MAX_PER_ROW_RATIO:
+        print("新增行的处理耗时不是线性增长", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# 合成测试工作簿生成器
+# 运行: python -m benchmarks.generate 原始.xlsx 对比.xlsx --rows 100000 --columns 10
+import argparse
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+
+# 默认列类型比例
+DEFAULT_DTYPE_MIX = {'int': 3, 'float': 3, 'str': 3, 'date': 1}
+
+# 生成文本列时使用的取值
+TEXT_VALUES = np.array(['张三', '李四', '王五', '赵六', '北京', '上海', '广州', '深圳'])
+
+# 解析列类型比例, 例如 "int:3,float:3,str:3,date:1"
+def parse_dtype_mix(text):
+    dtype_mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition(':')
+        name = name.strip()
+        if name not in DEFAULT_DTYPE_MIX:
+            raise ValueError(f"不支持的列类型: {name}")
+        dtype_mix[name] = float(weight) if weight else 1.0
+    return dtype_mix
+
+# 按比例为每一列分配类型
+def column_types(columns, dtype_mix):
+    names = list(dtype_mix)
+    weights = np.array([dtype_mix[name] for name in names], dtype=float)
+    counts = np.floor(weights / weights.sum() * columns).astype(int)
+    # 余下的列按比例从大到小补齐
+    for i in np.argsort(-weights)[:columns - counts.sum()]:
+        counts[i] += 1
+    return [name for name, count in zip(names, counts) for _ in range(count)]
+
+def _make_column(dtype, rows, rng):
+    if dtype == 'int':
+        return rng.integers(0, 100000, rows)
+    if dtype == 'float':
+        return np.round(rng.random(rows) * 10000, 2)
+    if dtype == 'str':
+        return rng.choice(TEXT_VALUES, rows)
+    return pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D')
+
+# 生成一个带ID列的数据框
+def make_frame(rows, types, rng, first_id=0):
+    data = {'ID': np.arange(first_id, first_id + rows)}
+    for i, dtype in enumerate(types):
+        data[f"列{i + 1}_{dtype}"] = _make_column(dtype, rows, rng)
+    return pd.DataFrame(data)
+
+# 修改一列中的部分值
+def _modify_values(series, positions):
+    values = series.iloc[positions]
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return values + pd.Timedelta(days=1)
+    if pd.api.types.is_integer_dtype(series):
+        return values + 1
+    if pd.api.types.is_float_dtype(series):
+        return values + 0.5
+    return values + '_改'
+
+# 根据原始数据生成对比数据: 删除、修改部分行并追加新增行
+def make_changed_frame(df, types, rng, added_ratio, deleted_ratio, modified_ratio):
+    rows = len(df)
+    changed = df.drop(index=rng.choice(rows, int(rows * deleted_ratio), replace=False)).reset_index(drop=True)
+    
+    data_columns = [col for col in changed.columns if col != 'ID']
+    if data_columns:
+        modified = rng.choice(len(changed), int(len(changed) * modified_ratio), replace=False)
+        target_columns = rng.integers(0, len(data_columns), len(modified))
+        for col_pos, col in enumerate(data_columns):
+            positions = modified[target_columns == col_pos]
+            if len(positions):
+                changed.loc[positions, col] = _modify_values(changed[col], positions).to_numpy()
+    
+    added = make_frame(int(rows * added_ratio), types, rng, first_id=rows)
+    return pd.concat([changed, added], ignore_index=True)
+
+# 生成一对数据框 (原始, 对比)
+def make_frame_pair(rows, columns=10, dtype_mix=None, added_ratio=0.01, deleted_ratio=0.01, modified_ratio=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    types = column_types(columns, dtype_mix or DEFAULT_DTYPE_MIX)
+    df1 = make_frame(rows, types, rng)
+    df2 = make_changed_frame(df1, types, rng, added_ratio, deleted_ratio, modified_ratio)
+    return df1, df2
+
+# 使用只写模式快速写出工作簿
+# frames: {sheet名称: 数据框}
+def write_workbook(path, frames):
+    wb = openpyxl.Workbook(write_only=True)
+    for sheet_name, df in frames.items():
+        ws = wb.create_sheet(title=sheet_name)
+        ws.append(list(df.columns))
+        columns = [df[col].astype(object).where(df[col].notna(), None).tolist() for col in df.columns]
+        for row in zip(*columns):
+            ws.append(row)
+    wb.save(path)
+
+# 生成一对工作簿文件, 每个sheet使用不同的随机种子
+def make_workbook_pair(path1, path2, rows, columns=10, sheets=1, dtype_mix=None,
+                       added_ratio=0.01, deleted_ratio=0.01, modified_ratio=0.05, seed=0):
+    frames1 = {}
+    frames2 = {}
+    for i in range(sheets):
+        sheet_name = f"Sheet{i + 1}"
+        frames1[sheet_name], frames2[sheet_name] = make_frame_pair(
+            rows, columns, dtype_mix, added_ratio, deleted_ratio, modified_ratio, seed + i
+        )
+    write_workbook(path1, frames1)
+    write_workbook(path2, frames2)
+
+def add_generator_arguments(parser):
+    parser.add_argument("--columns", type=int, default=10, help="数据列数 (不含ID列)")
+    parser.add_argument("--sheets", type=int, default=1, help="sheet数量")
+    parser.add_argument("--dtype-mix", type=parse_dtype_mix, default=DEFAULT_DTYPE_MIX,
+                        help="列类型比例, 例如 int:3,float:3,str:3,date:1")
+    parser.add_argument("--added", type=float, default=0.01, help="新增行比例")
+    parser.add_argument("--deleted", type=float, default=0.01, help="删除行比例")
+    parser.add_argument("--modified", type=float, default=0.05, help="修改行比例")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成用于对比测试的一对工作簿")
+    parser.add_argument("original", help="原始文件输出路径")
+    parser.add_argument("compare", help="对比文件输出路径")
+    parser.add_argument("--rows", type=int, default=10000, help="每个sheet的行数")
+    add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+    
+    make_workbook_pair(
+        args.original, args.compare, args.rows,
+        columns=args.columns, sheets=args.sheets, dtype_mix=args.dtype_mix,
+        added_ratio=args.added, deleted_ratio=args.deleted, modified_ratio=args.modified,
+        seed=args.seed
+    )
+
+if __name__ == '__main__':
+    main()
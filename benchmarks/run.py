@@ -0,0 +1,161 @@
+# 对比流程的分阶段基准测试: 读取、对比、导出
+# 按行数逐档生成合成工作簿, 分别记录每个阶段的耗时和峰值内存, 结果写入JSON
+# 运行: python -m benchmarks.run --sizes 10000 100000 1000000 --output benchmark_results.json
+import argparse
+import gc
+import importlib.metadata
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from excel_diff import diff_frames, generate_marked_excel
+from excel_diff.reader import DEFAULT_ENGINE, READER_ENGINES, read_sheet, read_sheet_names
+
+from .generate import add_generator_arguments, make_workbook_pair
+
+
+# 默认的行数档位
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+# 运行一个阶段, 返回 (结果, 耗时秒数)
+def _timed(func):
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+# 运行一个阶段, 返回 (结果, 峰值内存MB)
+# tracemalloc会拖慢运行速度, 所以和计时分开运行
+def _traced(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak / 1024 / 1024
+
+def _measure(stage, rows, func, measure_memory, label=None):
+    result, seconds = _timed(func)
+    record = {'rows': rows, 'stage': stage, 'seconds': round(seconds, 4)}
+    if measure_memory:
+        del result
+        result, peak_mb = _traced(func)
+        record['peak_mb'] = round(peak_mb, 2)
+    print(f"{rows:>10} {label or stage:<18} {seconds:>10.3f}s" + (f" {record['peak_mb']:>10.1f}MB" if measure_memory else ""))
+    return result, record
+
+# 对一对工作簿运行完整流程, 返回各阶段的记录
+# engines: 要比较的读取引擎, 每个引擎单独记录一次读取阶段, 后续阶段使用第一个引擎读出的数据
+def benchmark_pair(path1, path2, rows, key_columns, measure_memory=True, engines=(DEFAULT_ENGINE,)):
+    records = []
+    sheet_names = read_sheet_names(path1)
+    
+    frames = None
+    for engine in engines:
+        def read_all():
+            return {
+                sheet_name: (read_sheet(path1, sheet_name, engine=engine), read_sheet(path2, sheet_name, engine=engine))
+                for sheet_name in sheet_names
+            }
+        engine_frames, record = _measure('read', rows, read_all, measure_memory, label=f"read[{engine}]")
+        record['engine'] = engine
+        records.append(record)
+        if frames is None:
+            frames = engine_frames
+        del engine_frames
+    
+    def compare_all():
+        marked_results = {}
+        for sheet_name, (df1, df2) in frames.items():
+            marked_results[sheet_name] = {'diff': diff_frames(df1, df2, key_columns)}
+        return marked_results
+    marked_results, record = _measure('compare', rows, compare_all, measure_memory)
+    records.append(record)
+    
+    def export_all():
+        return generate_marked_excel(marked_results).getbuffer().nbytes
+    _, record = _measure('export', rows, export_all, measure_memory)
+    records.append(record)
+    
+    cells = sum(len(result['diff']) * len(result['diff'].columns) for result in marked_results.values())
+    for record in records:
+        record['cells'] = cells
+    return records
+
+# 运行环境信息, 便于对比不同版本的结果
+def environment_info():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'openpyxl': openpyxl.__version__,
+        'python-calamine': _package_version('python-calamine')
+    }
+
+# 已安装包的版本, 未安装时为None
+def _package_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对比流程的分阶段基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="每档的行数")
+    add_generator_arguments(parser)
+    parser.add_argument("--engines", nargs="+", choices=READER_ENGINES, default=[DEFAULT_ENGINE], help="要比较的读取引擎")
+    parser.add_argument("--no-memory", action="store_true", help="不统计峰值内存 (只计时)")
+    parser.add_argument("--workdir", help="合成工作簿的存放目录 (默认: 临时目录)")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果JSON文件")
+    args = parser.parse_args(argv)
+    
+    config = {
+        'sizes': args.sizes,
+        'columns': args.columns,
+        'sheets': args.sheets,
+        'dtype_mix': args.dtype_mix,
+        'added_ratio': args.added,
+        'deleted_ratio': args.deleted,
+        'modified_ratio': args.modified,
+        'seed': args.seed,
+        'engines': args.engines
+    }
+    
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for rows in args.sizes:
+            path1 = os.path.join(workdir, f"original_{rows}.xlsx")
+            path2 = os.path.join(workdir, f"compare_{rows}.xlsx")
+            make_workbook_pair(
+                path1, path2, rows,
+                columns=args.columns, sheets=args.sheets, dtype_mix=args.dtype_mix,
+                added_ratio=args.added, deleted_ratio=args.deleted, modified_ratio=args.modified,
+                seed=args.seed
+            )
+            results.extend(benchmark_pair(path1, path2, rows, ['ID'], measure_memory=not args.no_memory, engines=args.engines))
+    
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment_info(),
+        'config': config,
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
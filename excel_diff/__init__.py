@@ -0,0 +1,7 @@
+# Excel对比核心逻辑 (不依赖Streamlit, 可在工作进程和脚本中导入)
+from .compare import compare_and_mark_changes, diff_frames
+from .export import export_results, generate_marked_excel
+from .history import VersionHistory, compare_versions
+from .parallel import compare_sheets_parallel, default_worker_count
+from .pipeline import compare_file_pairs, compare_files, compare_workbooks
+from .result import DiffResult
@@ -0,0 +1,276 @@
+# 无关键列时按内容对齐两个sheet的行
+# similarity: 按内容相似度配对 (不考虑行顺序), 适合行顺序被打乱的sheet
+# sequence: 按行顺序对齐 (patience diff), 适合以追加、插入为主的sheet
+# 两种方式都先配对完全相同的行, 再对剩下的行用分桶 (局部敏感哈希) 找出候选行对,
+# 按相同单元格的比例打分, 从高到低配对, 计算量随行数近似线性增长
+from bisect import bisect_left
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from .fingerprint import _combine_hashes, _key_frames, column_hashes, occurrence_fingerprints
+
+
+# 对齐方式
+ALIGNMENTS = ('key', 'similarity', 'sequence')
+DEFAULT_ALIGNMENT = 'key'
+
+# 两行至少有这个比例的单元格相同才视为同一行 (修改), 否则视为删除和新增
+DEFAULT_MIN_SIMILARITY = 0.5
+
+# 分桶时跳过行数超过这个值的桶 (取值很少的列分出的桶太大, 对找出候选行没有帮助)
+MAX_BUCKET_ROWS = 32
+
+# 各列的逐行哈希矩阵 (行数 × 列数), 类型不同的列按文本比较
+def _hash_matrices(df1, df2, columns):
+    keys1, keys2 = _key_frames(df1, df2, columns)
+    hashes1 = np.column_stack([column_hashes(keys1[col]) for col in keys1.columns])
+    hashes2 = np.column_stack([column_hashes(keys2[col]) for col in keys2.columns])
+    return hashes1, hashes2
+
+# 整行哈希
+def _row_hashes(hashes):
+    return _combine_hashes([hashes[:, i] for i in range(hashes.shape[1])])
+
+# 按出现顺序配对完全相同的行 (第k个相同的行与对方第k个相同的行配对)
+# candidates1/candidates2: 参与配对的行位置
+def _pair_identical(row_hashes1, row_hashes2, candidates1, candidates2):
+    keys1, _ = occurrence_fingerprints(row_hashes1[candidates1])
+    keys2, _ = occurrence_fingerprints(row_hashes2[candidates2])
+    positions = pd.Index(keys2).get_indexer(keys1)
+    matched = positions >= 0
+    return candidates1[matched], candidates2[positions[matched]]
+
+# 每行最多保留的候选行对数量 (按与对方行分到同一个桶的次数从多到少), 限制取值重复较多时候选行对的数量
+MAX_ROW_CANDIDATES = 16
+
+# 用分桶找出可能相似的候选行对, 返回编码后的行对 (行位置1 × 行数2 + 行位置2), 已去重
+# 每个分桶键为一列或相邻两列的哈希, 加上分组编号 (只在同一组内配对)
+def _bucket_candidates(hashes1, hashes2, rows1, rows2, groups1, groups2):
+    columns = hashes1.shape[1]
+    bands = [[i] for i in range(columns)] + [[i, i + 1] for i in range(columns - 1)]
+    hashes1 = hashes1[rows1]
+    hashes2 = hashes2[rows2]
+    width = np.int64(len(hashes2) and rows2.max() + 1)
+    pairs = []
+    for band in bands:
+        key1 = _combine_hashes([hashes1[:, i] for i in band] + [groups1])
+        key2 = _combine_hashes([hashes2[:, i] for i in band] + [groups2])
+        left = pd.DataFrame({'key': key1, 'row1': rows1})
+        right = pd.DataFrame({'key': key2, 'row2': rows2})
+        # 跳过太大的桶
+        left = left[left.groupby('key')['key'].transform('size') <= MAX_BUCKET_ROWS]
+        right = right[right.groupby('key')['key'].transform('size') <= MAX_BUCKET_ROWS]
+        merged = left.merge(right, on='key')
+        # 每行在一个分桶方式中只有一个键, 同一分桶方式内的行对不会重复
+        pairs.append(merged['row1'].to_numpy(np.int64) * width + merged['row2'].to_numpy(np.int64))
+    if not pairs:
+        return np.empty(0, dtype=np.int64)
+    
+    # 统计各行对分到同一个桶的次数 (原地排序, 不复制所有行对), 每行只保留次数最多的候选行对
+    pairs = np.concatenate(pairs)
+    pairs.sort()
+    starts = np.flatnonzero(np.r_[True, pairs[1:] != pairs[:-1]])
+    hits = np.diff(np.r_[starts, len(pairs)])
+    pairs = pairs[starts]
+    pair_rows1 = pairs // width
+    order = np.lexsort((pairs, -hits, pair_rows1))
+    pair_rows1 = pair_rows1[order]
+    starts = np.flatnonzero(np.r_[True, pair_rows1[1:] != pair_rows1[:-1]])
+    ranks = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    return np.sort(pairs[order[ranks < MAX_ROW_CANDIDATES]])
+
+# 对候选行对打分并贪心配对 (相同单元格比例从高到低, 每行只配对一次)
+# 按轮次配对: 每轮接受在两边都是对应行的第一个的候选行对, 再去掉涉及已配对行的候选行对,
+# 结果与逐个检查的贪心配对相同
+def _greedy_match(hashes1, hashes2, rows1, rows2, min_similarity):
+    scores = np.zeros(len(rows1))
+    for i in range(hashes1.shape[1]):
+        scores += hashes1[rows1, i] == hashes2[rows2, i]
+    scores /= hashes1.shape[1]
+    keep = scores >= min_similarity
+    order = np.lexsort((rows2[keep], rows1[keep], -scores[keep]))
+    rows1 = rows1[keep][order]
+    rows2 = rows2[keep][order]
+    
+    used1 = np.zeros(len(hashes1), dtype=bool)
+    used2 = np.zeros(len(hashes2), dtype=bool)
+    matched1 = [np.empty(0, dtype=np.int64)]
+    matched2 = [np.empty(0, dtype=np.int64)]
+    while len(rows1):
+        first1 = np.zeros(len(rows1), dtype=bool)
+        first1[np.unique(rows1, return_index=True)[1]] = True
+        first2 = np.zeros(len(rows2), dtype=bool)
+        first2[np.unique(rows2, return_index=True)[1]] = True
+        accepted = first1 & first2
+        matched1.append(rows1[accepted])
+        matched2.append(rows2[accepted])
+        used1[rows1[accepted]] = True
+        used2[rows2[accepted]] = True
+        remaining = ~used1[rows1] & ~used2[rows2]
+        rows1 = rows1[remaining]
+        rows2 = rows2[remaining]
+    return np.concatenate(matched1).astype(np.int64), np.concatenate(matched2).astype(np.int64)
+
+# 剩下的行中按相似度配对, groups为每行所属的分组 (只在同一组内配对)
+# 同一组内还会按组内顺序逐行配对作为候选 (所有列取值都很少时分桶找不到候选)
+def _match_remaining(hashes1, hashes2, rows1, rows2, groups1, groups2, min_similarity):
+    if not len(rows1) or not len(rows2):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    width = np.int64(rows2.max() + 1)
+    candidates = [_bucket_candidates(hashes1, hashes2, rows1, rows2, groups1, groups2)]
+    
+    # 组内按顺序配对的候选 (第k个对第k个)
+    order1 = pd.Series(groups1).groupby(groups1).cumcount().to_numpy().astype(np.uint64)
+    order2 = pd.Series(groups2).groupby(groups2).cumcount().to_numpy().astype(np.uint64)
+    positions = pd.Index(_combine_hashes([groups2, order2])).get_indexer(_combine_hashes([groups1, order1]))
+    matched = positions >= 0
+    candidates.append(rows1[matched].astype(np.int64) * width + rows2[positions[matched]])
+    
+    candidates = np.unique(np.concatenate(candidates))
+    return _greedy_match(hashes1, hashes2, candidates // width, candidates % width, min_similarity)
+
+# 最长递增子序列 (patience sorting), 返回子序列元素在输入中的位置
+def _longest_increasing(values):
+    tails = []
+    tail_positions = []
+    previous = [-1] * len(values)
+    for pos, value in enumerate(values):
+        i = bisect_left(tails, value)
+        if i == len(tails):
+            tails.append(value)
+            tail_positions.append(pos)
+        else:
+            tails[i] = value
+            tail_positions[i] = pos
+        previous[pos] = tail_positions[i - 1] if i else -1
+    result = []
+    pos = tail_positions[-1] if tail_positions else -1
+    while pos >= 0:
+        result.append(pos)
+        pos = previous[pos]
+    return result[::-1]
+
+# 相同前缀的长度
+def _common_prefix(h1, h2):
+    n = min(len(h1), len(h2))
+    if isinstance(h1, list):
+        i = 0
+        while i < n and h1[i] == h2[i]:
+            i += 1
+        return i
+    different = np.flatnonzero(h1[:n] != h2[:n])
+    return int(different[0]) if len(different) else n
+
+# 区域内两边都只出现一次且相同的行 (锚点), 返回 (行位置1列表, 行位置2列表), 按行位置1排序
+# h1/h2: 区域内的行哈希, 小区域为列表 (用字典计算), 大区域为数组 (用pandas计算)
+def _region_anchors(h1, h2, a0, b0):
+    if isinstance(h1, list):
+        counts1 = Counter(h1)
+        counts2 = Counter(h2)
+        positions2 = {h: i for i, h in enumerate(h2) if counts2[h] == 1}
+        anchors = [(a0 + i, b0 + positions2[h]) for i, h in enumerate(h1) if counts1[h] == 1 and h in positions2]
+        return [a for a, _ in anchors], [b for _, b in anchors]
+    h1 = pd.Series(h1)
+    h2 = pd.Series(h2)
+    unique1 = h1[~h1.duplicated(keep=False)]
+    unique2 = h2[~h2.duplicated(keep=False)]
+    positions = pd.Index(unique2.to_numpy()).get_indexer(unique1.to_numpy())
+    matched = positions >= 0
+    anchors1 = unique1.index.to_numpy()[matched] + a0
+    anchors2 = unique2.index.to_numpy()[positions[matched]] + b0
+    return anchors1.tolist(), anchors2.tolist()
+
+# 两边行数之和不超过这个值的区域用Python列表和字典对齐 (逐个区域创建数组的开销远大于计算本身)
+SMALL_REGION_ROWS = 64
+
+# patience diff: 找出按顺序对齐的相同行, 返回 (行位置1, 行位置2), 两者都递增
+def _patience_pairs(row_hashes1, row_hashes2):
+    list1 = row_hashes1.tolist()
+    list2 = row_hashes2.tolist()
+    # 对齐的行段 (起始位置1, 起始位置2, 行数), 最后一次展开
+    runs = []
+    regions = [(0, len(list1), 0, len(list2))]
+    while regions:
+        a0, a1, b0, b1 = regions.pop()
+        if a1 - a0 + b1 - b0 <= SMALL_REGION_ROWS:
+            h1, h2 = list1[a0:a1], list2[b0:b1]
+        else:
+            h1, h2 = row_hashes1[a0:a1], row_hashes2[b0:b1]
+        
+        # 相同的前缀和后缀直接对齐
+        prefix = _common_prefix(h1, h2)
+        suffix = _common_prefix(h1[prefix:][::-1], h2[prefix:][::-1])
+        runs.append((a0, b0, prefix))
+        runs.append((a1 - suffix, b1 - suffix, suffix))
+        h1 = h1[prefix:len(h1) - suffix]
+        h2 = h2[prefix:len(h2) - suffix]
+        a0 += prefix
+        b0 += prefix
+        a1 -= suffix
+        b1 -= suffix
+        if a0 >= a1 or b0 >= b1:
+            continue
+        
+        # 以两边都只出现一次的行为锚点, 取位置递增的最长锚点序列
+        anchors1, anchors2 = _region_anchors(h1, h2, a0, b0)
+        if not anchors1:
+            continue
+        chain = _longest_increasing(anchors2)
+        anchors1 = [anchors1[i] for i in chain]
+        anchors2 = [anchors2[i] for i in chain]
+        runs.extend((a, b, 1) for a, b in zip(anchors1, anchors2))
+        
+        # 锚点之间的区域继续对齐
+        for region in zip([a0] + [a + 1 for a in anchors1], anchors1 + [a1], [b0] + [b + 1 for b in anchors2], anchors2 + [b1]):
+            if region[0] < region[1] and region[2] < region[3]:
+                regions.append(region)
+    
+    if not runs:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    starts1, starts2, lengths = (np.array(values, dtype=np.int64) for values in zip(*runs))
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rows1 = np.repeat(starts1, lengths) + offsets
+    rows2 = np.repeat(starts2, lengths) + offsets
+    order = np.argsort(rows1)
+    return rows1[order], rows2[order]
+
+# 按内容对齐两个数据框的行, 返回配对的行位置 (行位置1, 行位置2), 按行位置1排序
+# columns: 参与比较的共同列; alignment: 'similarity' 或 'sequence'
+def align_rows(df1, df2, columns, alignment, min_similarity=DEFAULT_MIN_SIMILARITY):
+    if alignment not in ('similarity', 'sequence'):
+        raise ValueError(f"不支持的对齐方式: {alignment}")
+    if not columns:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    
+    hashes1, hashes2 = _hash_matrices(df1, df2, columns)
+    row_hashes1 = _row_hashes(hashes1)
+    row_hashes2 = _row_hashes(hashes2)
+    all1 = np.arange(len(df1))
+    all2 = np.arange(len(df2))
+    
+    if alignment == 'sequence':
+        # 按顺序对齐相同的行, 剩下的行只在相邻两个对齐行之间的区域内配对
+        exact1, exact2 = _patience_pairs(row_hashes1, row_hashes2)
+    else:
+        exact1, exact2 = _pair_identical(row_hashes1, row_hashes2, all1, all2)
+    
+    unmatched1 = np.ones(len(df1), dtype=bool)
+    unmatched1[exact1] = False
+    unmatched2 = np.ones(len(df2), dtype=bool)
+    unmatched2[exact2] = False
+    rest1 = all1[unmatched1]
+    rest2 = all2[unmatched2]
+    if alignment == 'sequence':
+        groups1 = np.searchsorted(exact1, rest1).astype(np.uint64)
+        groups2 = np.searchsorted(exact2, rest2).astype(np.uint64)
+    else:
+        groups1 = np.zeros(len(rest1), dtype=np.uint64)
+        groups2 = np.zeros(len(rest2), dtype=np.uint64)
+    similar1, similar2 = _match_remaining(hashes1, hashes2, rest1, rest2, groups1, groups2, min_similarity)
+    
+    rows1 = np.concatenate([exact1, similar1])
+    rows2 = np.concatenate([exact2, similar2])
+    order = np.argsort(rows1, kind='stable')
+    return rows1[order], rows2[order]
@@ -0,0 +1,304 @@
+import argparse
+import os
+import sys
+
+from .alignment import ALIGNMENTS, DEFAULT_ALIGNMENT
+from .formats import DEFAULT_EXPORT_FORMAT, EXPORT_FORMATS, FORMAT_EXTENSIONS
+from .history import compare_versions, write_history_excel
+from .instrument import Metrics, configure_metrics_log, profile_run, stage
+from .out_of_core import DEFAULT_MEMORY_BUDGET_MB
+from .pipeline import compare_file_pairs, match_file_pairs
+from .reader import DEFAULT_ENGINE, READER_ENGINES
+from .rules import DEFAULT_RULE, normalize_rule
+from .snapshot import DEFAULT_MAX_AGE_DAYS, DEFAULT_MAX_SIZE_MB, SnapshotStore
+
+
+# 解析关键列参数
+# "ID,名称" 对所有sheet生效, "Sheet1=ID,名称" 只对Sheet1生效
+def parse_key_options(key_options):
+    default_key_columns = []
+    sheet_key_columns = {}
+    for option in key_options or []:
+        sheet_name, sep, columns = option.rpartition('=')
+        key_columns = [col.strip() for col in columns.split(',') if col.strip()]
+        if sep:
+            sheet_key_columns[sheet_name] = key_columns
+        else:
+            default_key_columns = key_columns
+    return default_key_columns, sheet_key_columns
+
+# 解析比较规则参数, 返回 (所有sheet的规则, {sheet名称: 规则})
+# "金额:abs_tol=0.01" 对所有sheet生效, "Sheet1=名称:strip,ignore_case" 只对Sheet1生效, 列名为 * 时对所有列生效
+# 不带值的选项为开关 (strip, ignore_case, numbers, dates), abs_tol / rel_tol 需要指定数值
+def parse_rule_options(rule_options):
+    default_rules = {}
+    sheet_rules = {}
+    for option in rule_options or []:
+        target, sep, settings = option.partition(':')
+        if not sep or not settings:
+            raise ValueError(f"比较规则格式应为 [SHEET=]列名:选项, 实际为: {option}")
+        sheet_name, sep, col = target.rpartition('=')
+        rules = sheet_rules.setdefault(sheet_name, {}) if sep else default_rules
+        
+        rule = dict(rules.get(col, {}))
+        for setting in settings.split(','):
+            name, has_value, value = setting.strip().partition('=')
+            if name not in DEFAULT_RULE:
+                raise ValueError(f"不支持的比较规则选项: {name}")
+            if isinstance(DEFAULT_RULE[name], bool):
+                rule[name] = True
+            elif not has_value:
+                raise ValueError(f"比较规则选项 {name} 需要指定数值, 例如 {name}=0.01")
+            else:
+                try:
+                    rule[name] = float(value)
+                except ValueError:
+                    raise ValueError(f"比较规则选项 {name} 的值应为数值, 实际为: {value}")
+        rules[col] = normalize_rule(rule)
+    
+    # sheet单独的规则在所有sheet的规则基础上覆盖
+    sheet_rules = {sheet_name: {**default_rules, **rules} for sheet_name, rules in sheet_rules.items()}
+    return default_rules, sheet_rules
+
+# 解析列名映射参数, 返回 (所有sheet的映射, {sheet名称: 映射}), 映射为 {原始文件列名: 对比文件列名}
+# "客户名:客户名称" 对所有sheet生效, "Sheet1=客户名:客户名称" 只对Sheet1生效
+def parse_mapping_options(mapping_options):
+    default_mapping = {}
+    sheet_mappings = {}
+    for option in mapping_options or []:
+        target, sep, new_col = option.rpartition(':')
+        sheet_name, has_sheet, old_col = target.rpartition('=')
+        if not sep or not old_col.strip() or not new_col.strip():
+            raise ValueError(f"列名映射格式应为 [SHEET=]原列名:新列名, 实际为: {option}")
+        mapping = sheet_mappings.setdefault(sheet_name, {}) if has_sheet else default_mapping
+        mapping[old_col.strip()] = new_col.strip()
+    
+    # sheet单独的映射在所有sheet的映射基础上覆盖
+    sheet_mappings = {sheet_name: {**default_mapping, **mapping} for sheet_name, mapping in sheet_mappings.items()}
+    return default_mapping, sheet_mappings
+
+# 确定要对比的文件对 [(原始文件, 对比文件, 输出文件)]
+# 目录模式下输出文件的扩展名由导出格式决定
+def build_pairs(path1, path2, output, export_format=DEFAULT_EXPORT_FORMAT):
+    if os.path.isdir(path1) and os.path.isdir(path2):
+        os.makedirs(output, exist_ok=True)
+        extension = FORMAT_EXTENSIONS[export_format]
+        return [
+            (file1, file2, os.path.join(output, f"对比结果_{os.path.splitext(os.path.basename(file1))[0]}{extension}"))
+            for file1, file2 in match_file_pairs(path1, path2)
+        ]
+    if os.path.isdir(path1) or os.path.isdir(path2):
+        raise ValueError("两个路径必须同为文件或同为目录")
+    return [(path1, path2, output)]
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m excel_diff",
+        description="对比两个Excel文件 (或两个目录中的同名文件) 并输出带标记的结果"
+    )
+    parser.add_argument("original", help="原始文件或目录")
+    parser.add_argument("compare", help="对比文件或目录")
+    parser.add_argument(
+        "versions", nargs="*", metavar="MORE",
+        help="更多版本: 给出三个或更多文件时按顺序逐个对比相邻的版本, 输出每行的变化历史"
+    )
+    parser.add_argument("-o", "--output", required=True, help="输出文件 (目录模式下为输出目录)")
+    parser.add_argument(
+        "--history", action="store_true",
+        help="多版本对比 (只有两个文件时也输出变化历史): 输出Excel中每个sheet有变化历史和各步骤统计两个工作表"
+    )
+    parser.add_argument(
+        "-k", "--key", action="append", metavar="[SHEET=]COL1,COL2",
+        help="关键列, 可重复; 不带 SHEET= 时对所有sheet生效"
+    )
+    parser.add_argument(
+        "-r", "--rule", action="append", metavar="[SHEET=]COL:OPT[,OPT]",
+        help="单元格比较规则, 可重复; 选项: abs_tol=数值, rel_tol=数值, numbers (数字文本按数值比较), "
+             "strip (忽略首尾空白), ignore_case (忽略大小写), dates (只比较日期); 列名为 * 时对所有列生效"
+    )
+    parser.add_argument(
+        "-m", "--map", action="append", metavar="[SHEET=]OLD:NEW",
+        help="列名映射, 可重复: 原始文件的列OLD与对比文件的列NEW对比 (改名的列), 不带 SHEET= 时对所有sheet生效"
+    )
+    parser.add_argument(
+        "--normalize-headers", action="store_true",
+        help="名称不同的列按规范化后的表头配对 (忽略全角/半角、首尾和连续空白、大小写)"
+    )
+    parser.add_argument("-s", "--sheet", action="append", help="只对比指定的sheet, 可重复")
+    parser.add_argument(
+        "-f", "--format", choices=EXPORT_FORMATS, default=DEFAULT_EXPORT_FORMAT,
+        help="输出格式: xlsx带标记的Excel (所有行), changes-xlsx只含变化行的Excel, "
+             "csv/parquet变化的行 (每列分为原值和新值两列), json单元格级别的修改列表 (JSON Patch) (默认: xlsx)"
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int,
+        help="并行处理文件对的进程数 (默认: CPU核数)"
+    )
+    parser.add_argument(
+        "--engine", choices=READER_ENGINES, default=DEFAULT_ENGINE,
+        help="读取引擎: auto优先使用calamine, 不可用时使用openpyxl (默认: auto)"
+    )
+    parser.add_argument(
+        "--align", choices=ALIGNMENTS, default=DEFAULT_ALIGNMENT,
+        help="没有关键列时的行对齐方式: key按行号和所有列, similarity按内容相似度 (行顺序可以不同), "
+             "sequence按行顺序 (适合追加、插入为主的表) (默认: key)"
+    )
+    parser.add_argument(
+        "--out-of-core", action="store_true",
+        help="分块对比超出内存的大文件 (中间数据写入磁盘临时文件)"
+    )
+    parser.add_argument(
+        "--memory-budget", type=int, default=DEFAULT_MEMORY_BUDGET_MB, metavar="MB",
+        help=f"分块对比时每个进程的内存预算 (默认: {DEFAULT_MEMORY_BUDGET_MB}MB)"
+    )
+    parser.add_argument("--spill-dir", help="分块对比的临时文件目录 (默认: 系统临时目录)")
+    parser.add_argument(
+        "--snapshot-dir",
+        help="快照目录: 解析过的sheet保存在这里, 再次对比同一文件时不需要重新解析 (默认: 不使用快照)"
+    )
+    parser.add_argument(
+        "--snapshot-max-size", type=int, default=DEFAULT_MAX_SIZE_MB, metavar="MB",
+        help=f"快照总大小上限, 超出时删除最久未使用的快照 (默认: {DEFAULT_MAX_SIZE_MB}MB)"
+    )
+    parser.add_argument(
+        "--snapshot-max-age", type=int, default=DEFAULT_MAX_AGE_DAYS, metavar="DAYS",
+        help=f"快照保留天数 (默认: {DEFAULT_MAX_AGE_DAYS}天)"
+    )
+    parser.add_argument(
+        "--metrics-log", metavar="FILE",
+        help="把每个文件对各阶段 (打开、读取、对齐、比较、导出) 的耗时、内存和行数以JSON行追加写入该文件"
+    )
+    parser.add_argument(
+        "--profile", metavar="FILE",
+        help="对整次运行做性能分析: .html 使用pyinstrument生成报告, 其他扩展名写入cProfile统计 "
+             "(多进程时只包含主进程, 建议配合 -j 1)"
+    )
+    return parser
+
+# 多版本对比: 按顺序逐个对比相邻的版本, 把变化历史写入输出的Excel文件
+def run_history(args, paths, default_key_columns, sheet_key_columns, default_rules, sheet_rules,
+                default_mapping, sheet_mappings, snapshot_store):
+    if any(os.path.isdir(path) for path in paths):
+        print("错误: 多版本对比只支持文件, 不支持目录", file=sys.stderr)
+        return 2
+    
+    metrics = Metrics() if args.metrics_log else None
+    try:
+        with profile_run(args.profile), stage(metrics, 'total') as record:
+            record.update({'files': [str(path) for path in paths], 'output': str(args.output)})
+            histories = compare_versions(
+                paths,
+                sheet_key_columns=sheet_key_columns,
+                default_key_columns=default_key_columns,
+                sheets=args.sheet,
+                engine=args.engine,
+                snapshot_store=snapshot_store,
+                alignment=args.align,
+                metrics=metrics,
+                sheet_rules=sheet_rules,
+                default_rules=default_rules,
+                normalize_headers=args.normalize_headers,
+                sheet_mappings=sheet_mappings,
+                default_mapping=default_mapping
+            )
+            if histories:
+                with stage(metrics, 'export'):
+                    write_history_excel(histories, args.output)
+    except ImportError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+    except Exception as e:
+        print(f"失败: {' -> '.join(paths)}: {e}", file=sys.stderr)
+        return 1
+    
+    if not histories:
+        print(f"跳过: {' -> '.join(paths)}: 所有版本中没有共同的Sheet")
+        return 1
+    for sheet_name, history in histories.items():
+        print(f"{sheet_name}: {len(history.events)}条变化记录")
+    print(f"完成: {len(paths)}个版本 -> {args.output} ({len(histories)}个Sheet)")
+    return 0
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.out_of_core and args.align != 'key':
+        parser.error("--out-of-core 只支持 --align key")
+    if args.out_of_core and args.format not in ('xlsx', 'changes-xlsx'):
+        parser.error("--out-of-core 只支持 --format xlsx 或 changes-xlsx")
+    history = args.history or bool(args.versions)
+    if history and args.out_of_core:
+        parser.error("多版本对比不支持 --out-of-core")
+    # 多版本对比按顺序逐个版本对比, 只输出变化历史Excel
+    if history and args.format != 'xlsx':
+        parser.error("多版本对比只支持 --format xlsx")
+    if history and args.workers not in (None, 1):
+        parser.error("多版本对比按顺序处理, 不支持 -j/--workers")
+    default_key_columns, sheet_key_columns = parse_key_options(args.key)
+    try:
+        default_rules, sheet_rules = parse_rule_options(args.rule)
+        default_mapping, sheet_mappings = parse_mapping_options(args.map)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    snapshot_store = None
+    if args.snapshot_dir:
+        try:
+            snapshot_store = SnapshotStore(args.snapshot_dir, args.snapshot_max_size, args.snapshot_max_age)
+        except ImportError as e:
+            print(f"错误: {e}", file=sys.stderr)
+            return 2
+    
+    if args.metrics_log:
+        configure_metrics_log(args.metrics_log)
+    
+    if history:
+        return run_history(args, [args.original, args.compare] + args.versions, default_key_columns, sheet_key_columns,
+                           default_rules, sheet_rules, default_mapping, sheet_mappings, snapshot_store)
+    
+    try:
+        pairs = build_pairs(args.original, args.compare, args.output, args.format)
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+    
+    if not pairs:
+        print("没有找到可对比的同名Excel文件", file=sys.stderr)
+        return 1
+    
+    failed = 0
+    try:
+        with profile_run(args.profile):
+            results = compare_file_pairs(
+                pairs,
+                max_workers=args.workers,
+                sheet_key_columns=sheet_key_columns,
+                default_key_columns=default_key_columns,
+                sheets=args.sheet,
+                out_of_core=args.out_of_core,
+                memory_budget_mb=args.memory_budget,
+                spill_dir=args.spill_dir,
+                engine=args.engine,
+                snapshot_store=snapshot_store,
+                alignment=args.align,
+                default_rules=default_rules,
+                sheet_rules=sheet_rules,
+                default_mapping=default_mapping,
+                sheet_mappings=sheet_mappings,
+                normalize_headers=args.normalize_headers,
+                export_format=args.format,
+                instrument=bool(args.metrics_log)
+            )
+            for path1, path2, output_path, sheet_count, error in results:
+                if error is not None:
+                    failed += 1
+                    print(f"失败: {path1} vs {path2}: {error}", file=sys.stderr)
+                elif sheet_count == 0:
+                    print(f"跳过: {path1} vs {path2}: 没有生成任何对比结果")
+                else:
+                    print(f"完成: {path1} vs {path2} -> {output_path} ({sheet_count}个Sheet)")
+    except ImportError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+    
+    return 1 if failed else 0
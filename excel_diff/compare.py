@@ -0,0 +1,256 @@
+import numpy as np
+import pandas as pd
+
+from .alignment import ALIGNMENTS, DEFAULT_ALIGNMENT, align_rows
+from .fingerprint import occurrence_fingerprints, row_fingerprints
+from .instrument import stage
+from .rules import column_rule, normalize_values, within_tolerance
+from .result import ADDED, DELETED, MODIFIED, UNCHANGED, DiffResult
+from .schema import align_columns
+
+
+# 整块比较时每次处理的单元格数 (限制临时数组占用的内存)
+BLOCK_CELLS = 4000000
+
+
+# NaN感知的逐列比较 - 返回每行该列是否被修改的布尔数组
+# rule: 该列的比较规则 (见 rules 模块), 比较前先规范化两边的值, 在数值容差内的不算修改
+def _cells_changed(values1, values2, rule=None):
+    if rule is not None:
+        values1 = normalize_values(values1, rule)
+        values2 = normalize_values(values2, rule)
+        return _cells_changed(values1, values2) & ~within_tolerance(values1, values2, rule)
+    
+    na1 = pd.isna(values1)
+    na2 = pd.isna(values2)
+    changed = na1 ^ na2
+    
+    # 只在两边都有值的位置比较实际内容
+    both = ~(na1 | na2)
+    if both.any():
+        v1 = values1[both]
+        v2 = values2[both]
+        try:
+            ne = np.asarray(v1 != v2, dtype=bool)
+            if ne.shape != v1.shape:
+                raise TypeError
+        except (TypeError, ValueError):
+            # 类型不兼容(如日期和数字)时退回到按对象比较
+            ne = np.asarray(v1.astype(object) != v2.astype(object), dtype=bool)
+        changed[both] = ne
+    
+    return changed
+
+# 可以整块比较的列类型: 两边类型相同的数值、布尔和日期列 (numpy类型)
+def _block_dtype(dtype1, dtype2):
+    return isinstance(dtype1, np.dtype) and dtype1 == dtype2 and dtype1.kind in 'iufbM'
+
+# 行位置是否就是 0, 1, ..., n-1 (两边行顺序相同时不需要按行位置取值)
+def _identity(rows, n):
+    return len(rows) == n and bool((rows == np.arange(n)).all())
+
+# 按二维数组整块比较同一类型的多列, 返回转置的修改掩码 (列数 × 配对行数)
+# 与逐列比较的结果相同: 两边都是NaN (NaT) 不算修改
+# 数据按列存储 (每列连续), 按列分批比较, 每批在连续的内存中按行位置取值
+def _block_changed(df1, df2, columns, rows1, rows2):
+    values1 = np.ascontiguousarray(df1[columns].to_numpy().T)
+    values2 = np.ascontiguousarray(df2[columns].to_numpy().T)
+    identity1 = _identity(rows1, values1.shape[1])
+    identity2 = _identity(rows2, values2.shape[1])
+    changed = np.empty((len(columns), len(rows1)), dtype=bool)
+    step = max(1, BLOCK_CELLS // max(1, len(rows1)))
+    for start in range(0, len(columns), step):
+        v1 = values1[start:start + step]
+        v2 = values2[start:start + step]
+        if not identity1:
+            v1 = v1.take(rows1, axis=1)
+        if not identity2:
+            v2 = v2.take(rows2, axis=1)
+        block = v1 != v2
+        if v1.dtype.kind == 'f':
+            block &= ~(np.isnan(v1) & np.isnan(v2))
+        elif v1.dtype.kind == 'M':
+            block &= ~(np.isnat(v1) & np.isnat(v2))
+        changed[start:start + step] = block
+    return changed
+
+# 转换为位置索引 (已经是从0开始的位置索引时不复制)
+def _positional(df):
+    index = df.index
+    if isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1:
+        return df
+    return df.reset_index(drop=True)
+
+# 关键列数据 - 使用 '__original_index' (行号) 作为关键列时加上行号列
+def _key_data(df, key_columns):
+    keys = df[[col for col in key_columns if col != '__original_index']]
+    if '__original_index' in key_columns:
+        keys = keys.assign(__original_index=np.arange(len(df)))
+    return keys
+
+# 两个数据框中都存在的关键列
+# 没有指定关键列时使用所有列加行号, 指定的关键列都不存在时只使用行号
+def _valid_key_columns(df1, df2, key_columns):
+    if not key_columns:
+        key_columns = list(df1.columns) + ['__original_index']
+    
+    # 确保关键列在两个数据框中都存在
+    valid_key_columns = [
+        col for col in key_columns
+        if col == '__original_index' or (col in df1.columns and col in df2.columns)
+    ]
+    if not [col for col in valid_key_columns if col != '__original_index']:
+        # 使用默认索引
+        valid_key_columns = ['__original_index']
+    return valid_key_columns
+
+# 按关键列指纹对齐两个数据框
+# 返回 (配对的行位置1, 行位置2, 删除行掩码, 新增行掩码, (原始文件重复键行数, 对比文件重复键行数))
+def _align_by_keys(df1, df2, key_columns, key_hashes1, key_hashes2=None):
+    # 计算关键列的行指纹 (uint64哈希), 代替逐行拼接的字符串合并键
+    hashes1, hashes2 = row_fingerprints(
+        _key_data(df1, key_columns), _key_data(df2, key_columns), key_columns, key_hashes1, key_hashes2
+    )
+    
+    # 重复键: 同一关键列值的第k行与对比文件中的第k行配对
+    hashes1, duplicates1 = occurrence_fingerprints(hashes1)
+    hashes2, duplicates2 = occurrence_fingerprints(hashes2)
+    keys1 = pd.Index(hashes1)
+    keys2 = pd.Index(hashes2)
+    
+    # 按指纹一次性对齐两个数据框
+    positions = keys2.get_indexer(keys1)
+    matched = positions >= 0
+    rows1 = np.flatnonzero(matched)
+    rows2 = positions[matched]
+    
+    # 删除行为在对比文件中没有配对的行, 新增行为在原始文件中没有配对的行
+    # (重复键多出来的行也算删除或新增)
+    added = np.ones(len(df2), dtype=bool)
+    added[rows2] = False
+    return rows1, rows2, ~matched, added, (duplicates1, duplicates2)
+
+# 按内容对齐两个数据框 (见 alignment 模块), 返回值与 _align_by_keys 相同
+# 没有配对的行都视为删除或新增, 没有关键列所以重复键行数为0
+def _align_by_content(df1, df2, alignment):
+    columns = [col for col in df1.columns if col in df2.columns and col not in ['__original_index', '状态']]
+    rows1, rows2 = align_rows(df1, df2, columns, alignment)
+    deleted = np.ones(len(df1), dtype=bool)
+    deleted[rows1] = False
+    added = np.ones(len(df2), dtype=bool)
+    added[rows2] = False
+    return rows1, rows2, deleted, added, (0, 0)
+
+# 对比两个数据框, 返回紧凑的对比结果 (DiffResult), 没有数据时返回None
+# key_hashes1: 原始文件预先计算的列哈希 {列名: uint64数组}, 用于跳过关键列的哈希计算
+# alignment: 没有指定有效关键列时的行对齐方式 (见 alignment 模块):
+#   'key' 按行号和所有列对齐, 'similarity' 按内容相似度对齐, 'sequence' 按行顺序对齐
+# metrics: 性能记录 (见 instrument 模块, 可选), 分别记录对齐行和比较单元格两个阶段
+# rules: 单元格比较规则 {列名: 规则} (见 rules 模块), 列名为 '*' 的规则对其他所有列生效
+# column_mapping / normalize_headers: 列配对方式 (见 schema 模块), 配对的列在结果中使用原始文件的列名
+# key_hashes2: 对比文件预先计算的列哈希 (按对比文件中的列名), 与key_hashes1相同
+def diff_frames(df1, df2, key_columns, key_hashes1=None, alignment=DEFAULT_ALIGNMENT, metrics=None, rules=None,
+                column_mapping=None, normalize_headers=False, key_hashes2=None):
+    if alignment not in ALIGNMENTS:
+        raise ValueError(f"不支持的对齐方式: {alignment}")
+    
+    # 检查是否有数据
+    if df1 is None or df2 is None:
+        return None
+    
+    if df1.empty or df2.empty:
+        return None
+    
+    # 按行位置对比 (原始文件的数据不复制, 结果中直接引用)
+    df1 = _positional(df1)
+    df2 = _positional(df2)
+    
+    # 配对两个文件的列, 对比文件中配对的列改用原始文件的列名 (浅复制, 不复制数据)
+    with stage(metrics, 'schema', cells=len(df1.columns) + len(df2.columns)):
+        schema = align_columns(df1.columns, df2.columns, column_mapping, normalize_headers)
+        rename = schema.rename_map(df1.columns)
+        if rename:
+            df2 = df2.copy(deep=False)
+            df2.columns = [rename.get(col, col) for col in df2.columns]
+            if key_hashes2:
+                key_hashes2 = {rename.get(col, col): hashes for col, hashes in key_hashes2.items()}
+    
+    with stage(metrics, 'align', rows=len(df1) + len(df2)):
+        # 没有指定有效关键列时按内容对齐
+        if alignment != 'key' and not [col for col in key_columns or [] if col in df1.columns and col in df2.columns]:
+            rows1, rows2, deleted, added_rows, duplicate_rows = _align_by_content(df1, df2, alignment)
+        else:
+            rows1, rows2, deleted, added_rows, duplicate_rows = _align_by_keys(
+                df1, df2, _valid_key_columns(df1, df2, key_columns), key_hashes1, key_hashes2
+            )
+        added = df2[added_rows]
+    
+    # 行状态
+    status_codes = np.full(len(df1) + len(added), UNCHANGED, dtype=np.int8)
+    status_codes[:len(df1)][deleted] = DELETED
+    status_codes[len(df1):] = ADDED
+    
+    # 需要比较的列 (只比较两个文件都有的列)
+    compare_columns = [col for col in df1.columns if col not in ['__original_index', '状态']]
+    
+    # 计算整个修改掩码: 类型相同的数值、布尔、日期列按类型合并为二维数组整块比较,
+    # 其余的列 (文本、混合类型、有比较规则的列) 逐列比较
+    with stage(metrics, 'cells', rows=len(rows1), cells=len(rows1) * len(compare_columns)):
+        # 按列存储, 逐列写入和按列查找修改位置时访问连续内存
+        change_mask = np.zeros((len(rows1), len(compare_columns)), dtype=bool, order='F')
+        blocks = {}
+        dtypes1 = dict(zip(df1.columns, df1.dtypes))
+        dtypes2 = dict(zip(df2.columns, df2.dtypes))
+        for col_pos, col in enumerate(compare_columns):
+            if col not in dtypes2:
+                continue
+            rule = column_rule(rules, col)
+            if rule is None and _block_dtype(dtypes1[col], dtypes2[col]):
+                blocks.setdefault(dtypes1[col], []).append(col_pos)
+                continue
+            values1 = df1[col].to_numpy()[rows1]
+            values2 = df2[col].to_numpy()[rows2]
+            change_mask[:, col_pos] = _cells_changed(values1, values2, rule)
+        for positions in blocks.values():
+            columns = [compare_columns[col_pos] for col_pos in positions]
+            change_mask.T[positions] = _block_changed(df1, df2, columns, rows1, rows2)
+        
+        # 修改单元格的位置 (按列排列), 只为有修改的列保存修改单元格的新值 (保留原始类型),
+        # 这部分的耗时只与修改的单元格数量有关
+        cell_cols, cell_rows = np.nonzero(change_mask.T)
+        bounds = np.flatnonzero(np.diff(cell_cols)) + 1
+        new_values = {}
+        for start, stop in zip([0] + bounds.tolist(), bounds.tolist() + [len(cell_cols)]):
+            if start == stop:
+                continue
+            changed = cell_rows[start:stop]
+            col = compare_columns[cell_cols[start]]
+            new_values[col] = df2[col].take(rows2[changed]).set_axis(rows1[changed])
+    
+    # 标记修改行
+    modified = change_mask.any(axis=1)
+    status_codes[rows1[modified]] = MODIFIED
+    
+    return DiffResult(
+        rows1=df1,
+        added=added.reset_index(drop=True),
+        status_codes=status_codes,
+        compare_columns=compare_columns,
+        modified_rows=rows1[modified],
+        mask_bits=np.packbits(change_mask[modified], axis=1),
+        new_values=new_values,
+        duplicate_rows=duplicate_rows,
+        schema=schema,
+        added_rows=np.flatnonzero(added_rows)
+    )
+
+# 实际对比函数 - 在原始文件基础上标记修改
+# 返回 (marked_df, changes_dict): 修改单元格改写为 "原内容->修改后内容", changes_dict记录修改行每列是否修改
+# key_hashes1: 原始文件预先计算的列哈希 {列名: uint64数组}, 用于跳过关键列的哈希计算
+def compare_and_mark_changes(df1, df2, key_columns, key_hashes1=None, alignment=DEFAULT_ALIGNMENT, rules=None,
+                             column_mapping=None, normalize_headers=False):
+    result = diff_frames(df1, df2, key_columns, key_hashes1, alignment, rules=rules,
+                         column_mapping=column_mapping, normalize_headers=normalize_headers)
+    if result is None:
+        return None, {}
+    return result.marked_frame(), result.changes_dict()
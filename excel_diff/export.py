@@ -0,0 +1,350 @@
+import threading
+from io import BytesIO
+
+import openpyxl
+import pandas as pd
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill, Font, Border, Side, Alignment, NamedStyle
+from openpyxl.utils import get_column_letter
+
+from .formats import CHANGED_STATUSES, CHANGES_WRITERS, DEFAULT_EXPORT_FORMAT, EXPORT_FORMATS, changed_row_count
+from .instrument import stage
+
+
+# 颜色定义 - 使用aRGB格式 (8位十六进制值)
+UNCHANGED_COLOR = "FFD3D3D3"  # 灰色 - 不变
+ADDED_COLOR = "FF90EE90"     # 浅绿色 - 新增
+DELETED_COLOR = "FFADD8E6"   # 浅蓝色 - 删除
+MODIFIED_COLOR = "FFFFFF00"  # 黄色 - 修改单元格
+HEADER_COLOR = "FFDAE8FC"    # 浅蓝色 - 表头
+
+# 创建边框样式
+thin_border = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin')
+)
+
+# 导出时每次处理的行数 (流式写入时内存只与这个值有关)
+EXPORT_CHUNK_ROWS = 10000
+
+# 各行状态对应的填充色
+STATUS_COLORS = {
+    '不变': UNCHANGED_COLOR,
+    '新增': ADDED_COLOR,
+    '删除': DELETED_COLOR,
+}
+
+# 创建导出用的样式 - 每种填充/字体/边框只创建一次, 所有单元格共用
+def _build_export_styles():
+    styles = {
+        'header': NamedStyle(
+            name='diff_header',
+            fill=PatternFill(start_color=HEADER_COLOR, end_color=HEADER_COLOR, fill_type="solid"),
+            font=Font(bold=True),
+            border=thin_border,
+            alignment=Alignment(horizontal='center', vertical='center')
+        ),
+        'plain': NamedStyle(name='diff_plain', border=thin_border),
+        'modified': NamedStyle(
+            name='diff_modified',
+            fill=PatternFill(start_color=MODIFIED_COLOR, end_color=MODIFIED_COLOR, fill_type="solid"),
+            border=thin_border
+        ),
+    }
+    for status, color in STATUS_COLORS.items():
+        styles[status] = NamedStyle(
+            name=f"diff_{status}",
+            fill=PatternFill(start_color=color, end_color=color, fill_type="solid"),
+            border=thin_border
+        )
+    return styles
+
+# 单元格使用的样式名
+def _cell_style_key(status, col, row_changes):
+    if status in STATUS_COLORS:
+        return status
+    # 如果是修改行，并且这个单元格被修改
+    if status == '修改' and col != '状态' and row_changes and row_changes.get(col):
+        return 'modified'
+    return 'plain'
+
+# 列中文本和数字内容的最大长度 (其他类型如日期不参与列宽计算)
+def column_text_length(series):
+    values = series.dropna()
+    if values.empty or pd.api.types.is_datetime64_any_dtype(values):
+        return 0
+    if values.dtype == object:
+        values = values[values.map(lambda v: isinstance(v, (str, int, float)))]
+        if values.empty:
+            return 0
+    return int(values.astype(str).str.len().max())
+
+# 根据内容长度计算列宽
+def _width_from_length(max_length):
+    adjusted_width = (max_length + 2) * 1.2
+    return min(adjusted_width, 50)  # 限制最大列宽
+
+# 根据列数据计算列宽 (与逐个单元格计算的结果相同, 但不需要再遍历工作表)
+def _column_width(header, series):
+    return _width_from_length(max(len(str(header)), column_text_length(series)))
+
+# 将一列转换为写入Excel的值列表 (NaN写为空字符串)
+def _export_values(series):
+    return series.astype(object).where(series.notna(), "").tolist()
+
+# 按块流式写入一个sheet
+# chunks: 依次产出 (数据块, changes_dict), 内存只与块大小有关
+# on_rows: 每写完一块调用一次, 参数为这一块的行数 (用于报告进度)
+def _write_sheet_chunks(ws, columns, widths, chunks, styles, on_rows=None):
+    # 写入前确定列宽和冻结首行 (只写模式下必须在写入数据前设置)
+    for col_idx, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = width
+    ws.freeze_panes = 'A2'
+    
+    # 写入标题行
+    header = []
+    for col in columns:
+        cell = WriteOnlyCell(ws)
+        cell.style = styles['header'].name
+        cell.value = col
+        header.append(cell)
+    ws.append(header)
+    
+    # 分块写入数据行
+    for chunk, changes_dict in chunks:
+        column_values = [_export_values(chunk[col]) for col in columns]
+        statuses = chunk['状态'].tolist()
+        
+        for row_pos, (idx, status) in enumerate(zip(chunk.index, statuses)):
+            row_changes = changes_dict.get(idx) if status == '修改' else None
+            row = []
+            for col, values in zip(columns, column_values):
+                # 先设置样式再赋值, 日期值才能保留日期格式
+                cell = WriteOnlyCell(ws)
+                cell.style = styles[_cell_style_key(status, col, row_changes)].name
+                cell.value = values[row_pos]
+                row.append(cell)
+            ws.append(row)
+        
+        if on_rows is not None:
+            on_rows(len(chunk))
+
+# 流式写入一个sheet - 按列数组分块写入, 内存不随行数增长
+def _write_sheet_streaming(ws, marked_df, changes_dict, styles, on_rows=None):
+    columns = marked_df.columns.tolist()
+    widths = [_column_width(col, marked_df[col]) for col in columns]
+    chunks = (
+        (marked_df.iloc[start:start + EXPORT_CHUNK_ROWS], changes_dict)
+        for start in range(0, len(marked_df), EXPORT_CHUNK_ROWS)
+    )
+    _write_sheet_chunks(ws, columns, widths, chunks, styles, on_rows)
+
+# 普通模式写入一个sheet
+def _write_sheet(ws, marked_df, changes_dict, styles):
+    columns = marked_df.columns.tolist()
+    
+    # 写入标题行
+    for col_idx, col in enumerate(columns, 1):
+        cell = ws.cell(row=1, column=col_idx)
+        cell.style = styles['header'].name
+        cell.value = col
+    
+    # 写入数据行
+    column_values = [_export_values(marked_df[col]) for col in columns]
+    statuses = marked_df['状态'].tolist()
+    for row_pos, (idx, status) in enumerate(zip(marked_df.index, statuses)):
+        row_changes = changes_dict.get(idx) if status == '修改' else None
+        for col_idx, (col, values) in enumerate(zip(columns, column_values), 1):
+            cell = ws.cell(row=row_pos + 2, column=col_idx)
+            cell.style = styles[_cell_style_key(status, col, row_changes)].name
+            cell.value = values[row_pos]
+    
+    # 自动调整列宽
+    for col_idx, col in enumerate(columns, 1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = _column_width(col, marked_df[col])
+    
+    # 冻结首行
+    ws.freeze_panes = 'A2'
+
+# 写入一个紧凑对比结果 (DiffResult) - 按块生成显示文本, 不需要整个带标记的数据框
+# changes_only=True 时只写入有变化的行 (跳过不变的行)
+def _write_diff_result(ws, diff, write_only, styles, on_rows=None, changes_only=False):
+    if changes_only:
+        rows = diff.find_rows(statuses=CHANGED_STATUSES)
+        chunks = (
+            (diff.marked_rows(chunk), diff.changes_for_rows(chunk))
+            for chunk in (rows[start:start + EXPORT_CHUNK_ROWS] for start in range(0, len(rows), EXPORT_CHUNK_ROWS))
+        )
+    else:
+        rows = None
+        chunks = diff.iter_chunks(EXPORT_CHUNK_ROWS)
+    
+    if not write_only:
+        if rows is None:
+            _write_sheet(ws, diff.marked_frame(), diff.changes_dict(), styles)
+        else:
+            _write_sheet(ws, diff.marked_rows(rows), diff.changes_for_rows(rows), styles)
+        if on_rows is not None:
+            on_rows(len(diff) if rows is None else len(rows))
+        return
+    widths = [
+        _width_from_length(max(len(str(col)), diff.column_lengths.get(col, 0)))
+        for col in diff.columns
+    ]
+    _write_sheet_chunks(ws, diff.columns, widths, chunks, styles, on_rows)
+
+# 结果的总行数 (用于计算导出进度), changes_only=True 时只计算有变化的行
+def _result_rows(result, changes_only=False):
+    if 'diff' in result:
+        return changed_row_count(result['diff']) if changes_only else len(result['diff'])
+    if changes_only:
+        return int((result['marked_df']['状态'] != '不变').sum())
+    return len(result['marked_df'])
+
+# 生成带标记的Excel文件
+# marked_results: {sheet名称: 结果}, 结果为 {'diff': DiffResult} 或 {'marked_df': ..., 'changes_dict': ...}
+# write_only=True 时使用openpyxl只写模式流式导出, 适合大型结果
+# 指定output (文件路径或类文件对象) 时直接写入, 否则返回字节流
+# progress: 进度回调 progress(已写入行数, 总行数), 每写完一块调用一次
+# metrics: 性能记录 (见 instrument 模块, 可选), 每个sheet记录一次写入, 最后记录一次保存
+# changes_only=True 时只写入有变化的行 (修改、删除、新增), 跳过不变的行
+def generate_marked_excel(marked_results, write_only=True, output=None, progress=None, metrics=None, changes_only=False):
+    # 创建一个新的工作簿
+    wb = openpyxl.Workbook(write_only=write_only)
+    
+    # 删除默认创建的sheet
+    if 'Sheet' in wb.sheetnames:
+        wb.remove(wb['Sheet'])
+    
+    # 注册共用样式
+    styles = _build_export_styles()
+    for style in styles.values():
+        wb.add_named_style(style)
+    
+    # 进度统计
+    total_rows = sum(_result_rows(result, changes_only) for result in marked_results.values())
+    written = [0]
+    def on_rows(rows):
+        written[0] += rows
+        if progress is not None:
+            progress(written[0], total_rows)
+    
+    # 为每个sheet创建标记结果
+    for sheet_name, result in marked_results.items():
+        # 创建sheet
+        ws = wb.create_sheet(title=sheet_name[:31])  # 限制sheet名称长度
+        columns = result['diff'].columns if 'diff' in result else result['marked_df'].columns
+        rows = _result_rows(result, changes_only)
+        
+        with stage(metrics, 'export', sheet=sheet_name, rows=rows, cells=rows * len(columns)):
+            if 'diff' in result:
+                _write_diff_result(ws, result['diff'], write_only, styles, on_rows, changes_only)
+            else:
+                marked_df = result['marked_df']
+                if changes_only:
+                    marked_df = marked_df[marked_df['状态'] != '不变']
+                if write_only:
+                    _write_sheet_streaming(ws, marked_df, result['changes_dict'], styles, on_rows)
+                else:
+                    _write_sheet(ws, marked_df, result['changes_dict'], styles)
+                    on_rows(rows)
+    
+    with stage(metrics, 'save', rows=written[0]):
+        if output is not None:
+            wb.save(output)
+        else:
+            # 保存到字节流
+            output = BytesIO()
+            wb.save(output)
+            output.seek(0)
+    
+    return output
+
+# 将分块对比的结果流式写入Excel (不需要把整个结果放进内存)
+# chunked_results: {sheet名称: 分块结果}, 分块结果提供 columns, column_lengths 和 iter_chunks()
+# changes_only=True 时只写入有变化的行
+def generate_marked_excel_from_chunks(chunked_results, output, changes_only=False):
+    wb = openpyxl.Workbook(write_only=True)
+    
+    styles = _build_export_styles()
+    for style in styles.values():
+        wb.add_named_style(style)
+    
+    for sheet_name, result in chunked_results.items():
+        ws = wb.create_sheet(title=sheet_name[:31])  # 限制sheet名称长度
+        widths = [
+            _width_from_length(max(len(str(col)), result.column_lengths.get(col, 0)))
+            for col in result.columns
+        ]
+        chunks = result.iter_chunks()
+        if changes_only:
+            chunks = ((chunk[chunk['状态'] != '不变'], changes_dict) for chunk, changes_dict in chunks)
+        _write_sheet_chunks(ws, result.columns, widths, chunks, styles)
+    
+    wb.save(output)
+    return output
+
+# 按格式导出对比结果 (格式见 formats 模块)
+# xlsx / changes-xlsx 生成带标记的Excel, 其他格式只导出有变化的行, 不生成Excel工作簿
+# 指定output (文件路径或类文件对象) 时直接写入, 否则返回字节流
+def export_results(marked_results, export_format=DEFAULT_EXPORT_FORMAT, output=None, progress=None, metrics=None):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {export_format}")
+    if export_format in ('xlsx', 'changes-xlsx'):
+        return generate_marked_excel(
+            marked_results, output=output, progress=progress, metrics=metrics,
+            changes_only=export_format == 'changes-xlsx'
+        )
+    
+    writer = CHANGES_WRITERS[export_format]
+    if output is None:
+        output = BytesIO()
+        writer(marked_results, output, progress, metrics)
+        output.seek(0)
+        return output
+    if hasattr(output, 'write'):
+        return writer(marked_results, output, progress, metrics)
+    with open(output, 'wb') as f:
+        writer(marked_results, f, progress, metrics)
+    return output
+
+# 后台导出任务 - 在线程中按指定格式导出, 页面可以随时查询进度
+# version: 调用方用来判断导出结果是否仍然对应当前的对比结果
+# metrics: 性能记录 (可选), 导出的各阶段记录在其中
+class ExportJob:
+    def __init__(self, marked_results, version=None, metrics=None, export_format=DEFAULT_EXPORT_FORMAT):
+        self.version = version
+        self.metrics = metrics
+        self.export_format = export_format
+        changes_only = export_format != 'xlsx'
+        self.total_rows = sum(_result_rows(result, changes_only) for result in marked_results.values())
+        self.written_rows = 0
+        self.data = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run, args=(marked_results,), daemon=True)
+        self._thread.start()
+    
+    def _run(self, marked_results):
+        try:
+            self.data = export_results(
+                marked_results, self.export_format, progress=self._on_progress, metrics=self.metrics
+            ).getvalue()
+        except Exception as e:
+            self.error = e
+    
+    def _on_progress(self, written_rows, total_rows):
+        self.written_rows = written_rows
+    
+    # 是否已经结束 (成功或出错)
+    @property
+    def done(self):
+        return not self._thread.is_alive()
+    
+    # 已完成的比例 (0~1)
+    @property
+    def progress(self):
+        if self.done:
+            return 1.0
+        return self.written_rows / self.total_rows if self.total_rows else 0.0
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+
+# 关键列的比较形式
+# 两个文件中类型相同的列直接使用原始值, 类型不同的列按文本比较 (与原来的字符串合并键一致)
+def _key_frames(df1, df2, key_columns):
+    parts1 = {}
+    parts2 = {}
+    for i, col in enumerate(key_columns):
+        s1 = df1[col]
+        s2 = df2[col]
+        if s1.dtype != s2.dtype:
+            s1 = s1.astype(str)
+            s2 = s2.astype(str)
+        parts1[i] = s1.to_numpy()
+        parts2[i] = s2.to_numpy()
+    return pd.DataFrame(parts1), pd.DataFrame(parts2)
+
+# 一列的逐行哈希 (uint64), 可以预先计算后保存 (见 snapshot 模块)
+def column_hashes(series):
+    return pd.util.hash_pandas_object(series, index=False).to_numpy()
+
+# 把多列的哈希合并为一个uint64指纹 (与pandas对整个数据框哈希时的合并方式相同)
+def _combine_hashes(hash_arrays):
+    mult = np.uint64(1000003)
+    out = np.full(len(hash_arrays[0]), 0x345678, dtype=np.uint64)
+    for i, hashes in enumerate(hash_arrays):
+        inverse_i = len(hash_arrays) - i
+        out ^= hashes
+        out *= mult
+        mult += np.uint64(82520 + inverse_i + inverse_i)
+    out += np.uint64(97531)
+    return out
+
+# 逐行哈希关键列, 按列计算后合并为一个uint64指纹
+# known_hashes: {列位置: 预先计算的列哈希}, 这些列不再重新计算
+def _hash_rows(key_frame, known_hashes=None):
+    known_hashes = known_hashes or {}
+    return _combine_hashes([
+        known_hashes[col] if col in known_hashes else column_hashes(key_frame[col])
+        for col in key_frame.columns
+    ])
+
+# 可以直接使用的预计算列哈希 - 只有两个文件中类型相同的列按原始值哈希
+# key_hashes: df 的预计算列哈希, other: 另一个文件的数据框
+def _usable_hashes(df, other, key_columns, key_hashes):
+    if not key_hashes:
+        return {}
+    return {
+        i: key_hashes[col]
+        for i, col in enumerate(key_columns)
+        if col in key_hashes and df[col].dtype == other[col].dtype and len(key_hashes[col]) == len(df)
+    }
+
+# 检查两组关键列的值是否完全相同 (NaN与NaN视为相同)
+def _keys_equal(keys1, keys2):
+    equal = np.ones(len(keys1), dtype=bool)
+    for col in keys1.columns:
+        values1 = keys1[col].to_numpy()
+        values2 = keys2[col].to_numpy()
+        if values1.dtype == object or values2.dtype == object:
+            # 文本列按字符串形式比较, 与哈希时的处理方式一致
+            values1 = values1.astype(str)
+            values2 = values2.astype(str)
+        same = values1 == values2
+        same |= pd.isna(values1) & pd.isna(values2)
+        equal &= same
+    return equal
+
+# 同一个文件中指纹相同的行, 关键列的值是否也相同 (每行与同一指纹第一次出现的行比较)
+# 等价于不同指纹的数量等于不同关键列值的数量; first: 每行是否是其指纹第一次出现的行
+def _hashes_consistent(keys, hashes, first):
+    if first.all():
+        return True
+    codes = pd.factorize(hashes)[0]
+    repeated = np.flatnonzero(~first)
+    first_rows = np.flatnonzero(first)[codes[repeated]]
+    return bool(_keys_equal(keys.iloc[repeated], keys.iloc[first_rows]).all())
+
+# 精确的行编号 - 只在出现哈希冲突时使用
+def _exact_codes(keys1, keys2):
+    combined = pd.concat([keys1, keys2], ignore_index=True)
+    for col in combined.columns:
+        if combined[col].dtype == object:
+            combined[col] = combined[col].astype(str)
+    codes = combined.groupby(list(combined.columns), dropna=False, sort=False).ngroup().to_numpy()
+    return codes[:len(keys1)].astype(np.uint64), codes[len(keys1):].astype(np.uint64)
+
+# 在重复的行指纹中加入出现次序 (第几次出现), 使重复键的行按出现顺序逐个配对
+# 第一次出现的行指纹不变; 返回 (新指纹, 重复行数 - 即不是第一次出现的行数)
+def occurrence_fingerprints(hashes):
+    if pd.Index(hashes).is_unique:
+        return hashes, 0
+    occurrence = pd.Series(hashes).groupby(hashes, sort=False).cumcount().to_numpy()
+    repeated = occurrence > 0
+    hashes = hashes.copy()
+    hashes[repeated] = _combine_hashes([hashes[repeated], occurrence[repeated].astype(np.uint64)])
+    return hashes, int(np.count_nonzero(repeated))
+
+# 计算两个数据框关键列的行指纹
+# key_hashes1 / key_hashes2: 两个文件预先计算的列哈希 {列名: uint64数组} (可选, 例如从快照中读出)
+# 返回 (指纹1, 指纹2), 指纹相同表示关键列的值相同
+def row_fingerprints(df1, df2, key_columns, key_hashes1=None, key_hashes2=None):
+    keys1, keys2 = _key_frames(df1, df2, key_columns)
+    hashes1 = _hash_rows(keys1, _usable_hashes(df1, df2, key_columns, key_hashes1))
+    hashes2 = _hash_rows(keys2, _usable_hashes(df2, df1, key_columns, key_hashes2))
+    
+    # 只对指纹相同的行核对原始值 (每个指纹取第一次出现的行)
+    first1 = ~pd.Series(hashes1).duplicated().to_numpy()
+    first2 = ~pd.Series(hashes2).duplicated().to_numpy()
+    
+    # 同一个文件中不同的关键列值得到了相同的指纹 (会被当成重复键), 改用精确编号
+    if not _hashes_consistent(keys1, hashes1, first1) or not _hashes_consistent(keys2, hashes2, first2):
+        return _exact_codes(keys1, keys2)
+    
+    rows1 = np.flatnonzero(first1)
+    rows2 = np.flatnonzero(first2)
+    positions = pd.Index(hashes2[rows2]).get_indexer(hashes1[rows1])
+    matched = positions >= 0
+    rows1 = rows1[matched]
+    rows2 = rows2[positions[matched]]
+    
+    if len(rows1) and not _keys_equal(keys1.iloc[rows1], keys2.iloc[rows2]).all():
+        # 不同的关键列值得到了相同的指纹, 改用精确编号
+        return _exact_codes(keys1, keys2)
+    
+    return hashes1, hashes2
@@ -0,0 +1,298 @@
+# 紧凑的导出格式
+# 只导出有变化的行 (修改、删除、新增), 不生成openpyxl工作簿, 按块直接写入输出流, 适合大型对比结果和下游程序:
+# csv / parquet: 每个变化行一行, 每列分为 "列名(原)" 和 "列名(新)" 两列
+# json: 单元格级别的修改列表 (JSON Patch, RFC 6902)
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+
+from .instrument import stage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+
+# 导出格式
+# xlsx: 带标记的Excel (所有行); changes-xlsx: 只包含变化行的带标记Excel
+EXPORT_FORMATS = ('xlsx', 'changes-xlsx', 'csv', 'parquet', 'json')
+DEFAULT_EXPORT_FORMAT = 'xlsx'
+
+# 各格式的扩展名和MIME类型
+FORMAT_EXTENSIONS = {
+    'xlsx': '.xlsx',
+    'changes-xlsx': '.xlsx',
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'json': '.json'
+}
+FORMAT_MIME_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'changes-xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'json': 'application/json-patch+json'
+}
+
+# 有变化的行状态
+CHANGED_STATUSES = ['修改', '删除', '新增']
+
+# 每次处理的行数
+CHANGES_CHUNK_ROWS = 10000
+
+# 是否可以导出Parquet (需要pyarrow)
+def parquet_available():
+    return pa is not None
+
+# 一个格式是否可用
+def format_available(export_format):
+    return export_format != 'parquet' or parquet_available()
+
+# 有变化的行数 (用于计算导出进度)
+def changed_row_count(diff):
+    return len(diff.find_rows(statuses=CHANGED_STATUSES))
+
+# 各sheet的对比结果 (只支持紧凑对比结果 DiffResult)
+def _diff_results(marked_results):
+    for sheet_name, result in marked_results.items():
+        if 'diff' not in result:
+            raise ValueError(f"Sheet '{sheet_name}' 的对比结果不支持导出为紧凑格式")
+        yield sheet_name, result['diff'], result.get('key_columns') or []
+
+# 依次产出一个sheet中有变化的行位置 (升序, 每块最多 CHANGES_CHUNK_ROWS 行)
+def _changed_row_chunks(diff, statuses=CHANGED_STATUSES):
+    rows = diff.find_rows(statuses=statuses)
+    for start in range(0, len(rows), CHANGES_CHUNK_ROWS):
+        yield rows[start:start + CHANGES_CHUNK_ROWS]
+
+# 按sheet和块依次产出 (sheet名称, 对比结果, 关键列, 行位置), 每写完一块报告进度, 每个sheet记录一次导出阶段
+def _iter_changed_rows(marked_results, progress=None, metrics=None):
+    results = list(_diff_results(marked_results))
+    total_rows = sum(changed_row_count(diff) for _, diff, _ in results)
+    written = 0
+    for sheet_name, diff, key_columns in results:
+        rows = changed_row_count(diff)
+        with stage(metrics, 'export', sheet=sheet_name, rows=rows, cells=rows * (len(diff.columns) - 1)):
+            for chunk in _changed_row_chunks(diff):
+                yield sheet_name, diff, key_columns, chunk
+                written += len(chunk)
+                if progress is not None:
+                    progress(written, total_rows)
+
+# 原值/新值列的列名
+def _old_column(col):
+    return f"{col}(原)"
+
+def _new_column(col):
+    return f"{col}(新)"
+
+# 所有sheet的输出列 (按出现顺序合并, 不含状态)
+def _data_columns(marked_results):
+    columns = []
+    for _, diff, _ in _diff_results(marked_results):
+        columns += [col for col in diff.columns[1:] if col not in columns]
+    return columns
+
+# 一列数据的类型: integer / number / datetime / string
+# 所有sheet中这一列的原值、新值和新增行都是同一类数值或日期时保留类型, 否则按文本导出
+def _column_kinds(marked_results, columns):
+    dtypes = {col: [] for col in columns}
+    for _, diff, _ in _diff_results(marked_results):
+        for col in diff.columns[1:]:
+            if col in diff.rows1.columns:
+                dtypes[col].append(diff.rows1[col].dtype)
+            if len(diff.added) and col in diff.added.columns:
+                dtypes[col].append(diff.added[col].dtype)
+            if col in diff.new_values:
+                dtypes[col].append(diff.new_values[col].dtype)
+    
+    kinds = {}
+    for col, col_dtypes in dtypes.items():
+        dtype_kinds = {dtype.kind for dtype in col_dtypes}
+        if dtype_kinds and dtype_kinds <= set('iu'):
+            kinds[col] = 'integer'
+        elif dtype_kinds and dtype_kinds <= set('iuf'):
+            kinds[col] = 'number'
+        elif dtype_kinds == {'M'}:
+            kinds[col] = 'datetime'
+        else:
+            kinds[col] = 'string'
+    return kinds
+
+# 按类型转换一列 (空值保留为空)
+def _typed_column(series, kind):
+    if kind == 'integer':
+        return series.astype('Int64')
+    if kind == 'number':
+        return series.astype(float)
+    if kind == 'datetime':
+        return pd.to_datetime(series)
+    return series.map(str, na_action='ignore').astype(object).where(series.notna(), None)
+
+# 一块变化行的表格: sheet, 状态, 原始行号 (原始文件中的数据行位置, 新增行为空), 每列的原值和新值
+def _changes_frame(sheet_name, diff, rows, columns, kinds):
+    old, new = diff.old_new_rows(rows)
+    row_numbers = pd.array(rows, dtype='Int64')
+    row_numbers[rows >= len(diff.rows1)] = pd.NA
+    frame = {
+        'sheet': pd.Series(sheet_name, index=range(len(rows)), dtype=object),
+        '状态': pd.Series(np.asarray(diff.status[rows], dtype=object)),
+        '原始行号': row_numbers
+    }
+    for col in columns:
+        for name, values in ((_old_column(col), old), (_new_column(col), new)):
+            if col in values.columns:
+                frame[name] = _typed_column(values[col].reset_index(drop=True), kinds[col])
+            else:
+                frame[name] = _typed_column(pd.Series(np.nan, index=range(len(rows)), dtype=object), kinds[col])
+    return pd.DataFrame(frame)
+
+# 导出变化行为CSV (UTF-8带BOM, 可以直接用Excel打开), output为二进制输出流
+def write_changes_csv(marked_results, output, progress=None, metrics=None):
+    columns = _data_columns(marked_results)
+    kinds = _column_kinds(marked_results, columns)
+    
+    output.write(b'\xef\xbb\xbf')
+    header = ['sheet', '状态', '原始行号'] + [name for col in columns for name in (_old_column(col), _new_column(col))]
+    output.write((pd.DataFrame(columns=header).to_csv(index=False)).encode('utf-8'))
+    for sheet_name, diff, _, rows in _iter_changed_rows(marked_results, progress, metrics):
+        frame = _changes_frame(sheet_name, diff, rows, columns, kinds)
+        output.write(frame.to_csv(index=False, header=False).encode('utf-8'))
+    return output
+
+# 各类型列在Arrow中的类型
+def _arrow_type(kind):
+    return {
+        'integer': pa.int64(),
+        'number': pa.float64(),
+        'datetime': pa.timestamp('ns'),
+        'string': pa.string()
+    }[kind]
+
+# 导出变化行为Parquet (需要pyarrow), 每块写为一个行组, output为二进制输出流
+def write_changes_parquet(marked_results, output, progress=None, metrics=None):
+    if not parquet_available():
+        raise ImportError("导出Parquet需要安装pyarrow")
+    columns = _data_columns(marked_results)
+    kinds = _column_kinds(marked_results, columns)
+    
+    fields = [pa.field('sheet', pa.string()), pa.field('状态', pa.string()), pa.field('原始行号', pa.int64())]
+    for col in columns:
+        fields += [
+            pa.field(_old_column(col), _arrow_type(kinds[col])),
+            pa.field(_new_column(col), _arrow_type(kinds[col]))
+        ]
+    schema = pa.schema(fields)
+    
+    with pa.parquet.ParquetWriter(output, schema) as writer:
+        for sheet_name, diff, _, rows in _iter_changed_rows(marked_results, progress, metrics):
+            frame = _changes_frame(sheet_name, diff, rows, columns, kinds)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+    return output
+
+# 转换为JSON值: 空值为null, 日期时间为ISO格式文本, numpy数值转换为Python数值
+def _json_value(value):
+    if isinstance(value, (str, bool, int)):
+        return value
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, float):
+        return value
+    return str(value)
+
+# JSON Pointer中的一段 (转义 ~ 和 /)
+def _pointer(value):
+    return str(value).replace('~', '~0').replace('/', '~1')
+
+# 数据框每行的 {列名: 值}
+def _row_records(frame):
+    if not len(frame.columns):
+        # 没有列 (没有关键列) 时 to_dict 不产出任何行
+        return [{} for _ in range(len(frame))]
+    return [{str(col): _json_value(value) for col, value in record.items()} for record in frame.to_dict('records')]
+
+# 依次产出一个sheet的修改操作
+# 把原始文件的sheet看作行对象的数组 (/sheet名称/行位置/列名), 按顺序应用这些操作即得到对比文件的内容:
+# 先逐个替换修改的单元格, 再从后往前删除行, 最后在末尾添加新增行. 每个操作额外包含关键列的值 (key) 和原值 (old)
+def _patch_operations(sheet_name, diff, key_columns):
+    sheet = _pointer(sheet_name)
+    n1 = len(diff.rows1)
+    key_columns = [col for col in key_columns if col in diff.rows1.columns]
+    
+    for rows in _changed_row_chunks(diff, ['修改']):
+        keys = dict(zip(rows.tolist(), _row_records(diff.rows1[key_columns].take(rows))))
+        for row, col, old_value, new_value in diff.cell_changes(rows):
+            yield {
+                'op': 'replace',
+                'path': f"/{sheet}/{row}/{_pointer(col)}",
+                'value': _json_value(new_value),
+                'old': _json_value(old_value),
+                'key': keys[row]
+            }
+    
+    # 从后往前删除, 前面的行位置不受影响
+    deleted = diff.find_rows(statuses=['删除'])[::-1]
+    for start in range(0, len(deleted), CHANGES_CHUNK_ROWS):
+        rows = deleted[start:start + CHANGES_CHUNK_ROWS]
+        old = diff.rows1.take(rows)
+        for row, record, key in zip(rows.tolist(), _row_records(old), _row_records(old[key_columns])):
+            yield {
+                'op': 'remove',
+                'path': f"/{sheet}/{row}",
+                'old': record,
+                'key': key
+            }
+    
+    added_key_columns = [col for col in key_columns if col in diff.added.columns]
+    for rows in _changed_row_chunks(diff, ['新增']):
+        new = diff.added.take(rows - n1)
+        for record, key in zip(_row_records(new), _row_records(new[added_key_columns])):
+            yield {
+                'op': 'add',
+                'path': f"/{sheet}/-",
+                'value': record,
+                'key': key
+            }
+
+# 导出单元格级别的修改列表 (JSON Patch数组), output为二进制输出流
+# 修改的单元格为 replace, 删除的行为 remove, 新增的行为 add
+def write_json_patch(marked_results, output, progress=None, metrics=None):
+    results = list(_diff_results(marked_results))
+    total_rows = sum(changed_row_count(diff) for _, diff, _ in results)
+    written = 0
+    first = True
+    
+    output.write(b'[')
+    for sheet_name, diff, key_columns in results:
+        rows = changed_row_count(diff)
+        with stage(metrics, 'export', sheet=sheet_name, rows=rows, cells=diff.changed_cell_count()):
+            lines = []
+            for operation in _patch_operations(sheet_name, diff, key_columns):
+                lines.append(json.dumps(operation, ensure_ascii=False))
+                if len(lines) == CHANGES_CHUNK_ROWS:
+                    output.write((('\n' if first else ',\n') + ',\n'.join(lines)).encode('utf-8'))
+                    first = False
+                    lines = []
+            if lines:
+                output.write((('\n' if first else ',\n') + ',\n'.join(lines)).encode('utf-8'))
+                first = False
+        written += rows
+        if progress is not None:
+            progress(written, total_rows)
+    output.write(b'\n]\n')
+    return output
+
+# 各紧凑格式的导出函数
+CHANGES_WRITERS = {
+    'csv': write_changes_csv,
+    'parquet': write_changes_parquet,
+    'json': write_json_patch
+}
@@ -0,0 +1,225 @@
+# 多版本对比
+# 同一份报表的N个版本按顺序逐个对比相邻的两个版本, 每个版本只解析一次, 关键列的列哈希也只计算一次,
+# 在与前一个版本和后一个版本的两次对比中复用, 总耗时随版本数线性增长.
+# 结果包含每一步的对比结果 (DiffResult), 以及按关键列记录每行在哪个版本新增、修改或删除的变化历史.
+import os
+
+import numpy as np
+import pandas as pd
+
+from .alignment import DEFAULT_ALIGNMENT
+from .compare import diff_frames
+from .fingerprint import column_hashes
+from .instrument import sheet_scope, stage
+from .reader import DEFAULT_ENGINE, open_workbook
+from .result import ADDED, DELETED, MODIFIED
+from .snapshot import content_hash, parse_sheet
+
+
+# 没有关键列时变化历史中记录行号使用的列名
+ROW_NUMBER_COLUMN = '行号'
+
+# 变化历史的固定列
+HISTORY_COLUMNS = ['版本', '状态', '修改列']
+
+# 变化历史中记录的状态
+HISTORY_STATUSES = {MODIFIED: '修改', DELETED: '删除', ADDED: '新增'}
+
+# 一个版本的关键列哈希: 已有的 (如从快照中读出) 直接使用, 其余的关键列计算一次
+# 没有指定关键列时按所有列对齐, 所有列都需要哈希
+def _version_hashes(df, key_columns, known_hashes=None):
+    hashes = dict(known_hashes or {})
+    for col in key_columns or df.columns:
+        if col in df.columns and col not in hashes:
+            hashes[col] = column_hashes(df[col])
+    return hashes
+
+# 变化历史中的关键列 (按第一个版本的列顺序), 没有可用的关键列时为空列表 (记录行号)
+def _history_keys(df, key_columns):
+    return [col for col in key_columns or [] if col in df.columns]
+
+# 一步对比中所有变化行的记录, label: 这一步中较新的版本
+# 没有关键列时, 修改行和删除行记录在前一个版本中的行号, 新增行记录在这个版本中的行号
+def _step_events(diff, history_keys, label):
+    status = np.asarray(diff.status.codes)
+    n1 = len(diff.rows1)
+    
+    # 修改行: 每行修改了哪些列
+    mask = diff.changed_mask()
+    columns = np.asarray(diff.compare_columns, dtype=object)
+    changed_columns = [', '.join(str(col) for col in columns[row_mask]) for row_mask in mask]
+    
+    deleted = np.flatnonzero(status[:n1] == DELETED)
+    parts = [
+        (diff.rows1, diff.modified_rows, diff.modified_rows, MODIFIED, changed_columns),
+        (diff.rows1, deleted, deleted, DELETED, [''] * len(deleted)),
+        (diff.added, np.arange(len(diff.added)), diff.added_rows, ADDED, [''] * len(diff.added))
+    ]
+    
+    frames = []
+    for frame, rows, row_numbers, code, changes in parts:
+        if not len(rows):
+            continue
+        if history_keys:
+            events = frame[[col for col in history_keys if col in frame.columns]].take(rows).reset_index(drop=True)
+        else:
+            events = pd.DataFrame({ROW_NUMBER_COLUMN: row_numbers + 1})
+        events['版本'] = label
+        events['状态'] = HISTORY_STATUSES[code]
+        events['修改列'] = changes
+        frames.append(events)
+    return frames
+
+# 一个sheet的多版本对比结果
+# labels: 各版本的名称 (按版本顺序); diffs: 相邻两个版本的对比结果, diffs[i] 为 labels[i] -> labels[i + 1]
+# (没有数据的一步为None); history_keys: 变化历史使用的关键列 (为空时记录行号)
+# events: 变化历史, 每个变化行一条记录: 关键列 (或行号) + 版本 (变化出现的版本) + 状态 + 修改列
+class VersionHistory:
+    def __init__(self, labels, diffs, history_keys, events):
+        self.labels = labels
+        self.diffs = diffs
+        self.history_keys = history_keys
+        self.events = events
+    
+    # 每一步的各状态行数, 行为 "前一版本 -> 后一版本", 列为状态
+    def step_counts(self):
+        rows = {}
+        for i, diff in enumerate(self.diffs):
+            counts = diff.status_counts() if diff is not None else pd.Series(dtype=int)
+            rows[f"{self.labels[i]} -> {self.labels[i + 1]}"] = counts
+        return pd.DataFrame(rows).T.reindex(columns=['不变', '修改', '删除', '新增']).fillna(0).astype(int)
+    
+    # 每个关键列值 (或行号) 的变化汇总: 新增、修改、删除的次数, 第一次和最后一次变化的版本及最后的状态
+    def summary(self):
+        keys = self.history_keys or [ROW_NUMBER_COLUMN]
+        counts = {status: self.events['状态'] == status for status in ('新增', '修改', '删除')}
+        return self.events.assign(**counts).groupby(keys, dropna=False, sort=False).agg(
+            新增=('新增', 'sum'),
+            修改=('修改', 'sum'),
+            删除=('删除', 'sum'),
+            首次变化=('版本', 'first'),
+            最后变化=('版本', 'last'),
+            最后状态=('状态', 'last')
+        ).reset_index()
+
+# 逐个对比一组版本 (同一个sheet)
+# versions: 按版本顺序的 (名称, 数据框, 预先计算的列哈希或None), 可以是生成器 (读取一个版本对比一步)
+# 其余参数与 diff_frames 相同; 每个版本的关键列哈希只计算一次, 同时用于与前后两个版本的对比
+# column_mapping: {前一个版本的列名: 后一个版本的列名}, 每一步都使用 (只对两边都有对应列的那一步生效)
+def diff_versions(versions, key_columns, alignment=DEFAULT_ALIGNMENT, metrics=None, rules=None, normalize_headers=False,
+                  column_mapping=None):
+    labels = []
+    diffs = []
+    frames = []
+    history_keys = None
+    previous = None
+    for label, df, known_hashes in versions:
+        hashes = _version_hashes(df, key_columns, known_hashes)
+        if previous is None:
+            history_keys = _history_keys(df, key_columns)
+        else:
+            previous_df, previous_hashes = previous
+            diff = diff_frames(
+                previous_df, df, key_columns, previous_hashes, alignment, metrics, rules,
+                column_mapping, normalize_headers, hashes
+            )
+            diffs.append(diff)
+            if diff is not None:
+                with stage(metrics, 'history', rows=len(diff)):
+                    frames.extend(_step_events(diff, history_keys, label))
+        labels.append(label)
+        previous = (df, hashes)
+    
+    if len(labels) < 2:
+        raise ValueError("多版本对比至少需要两个版本")
+    
+    keys = history_keys or [ROW_NUMBER_COLUMN]
+    events = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=keys + HISTORY_COLUMNS)
+    return VersionHistory(labels, diffs, history_keys, events.reindex(columns=keys + HISTORY_COLUMNS))
+
+# 版本名称: 文件名 (不含扩展名), 重复时加上序号
+def version_labels(sources):
+    labels = []
+    for i, source in enumerate(sources):
+        name = source if isinstance(source, (str, os.PathLike)) else getattr(source, 'name', None)
+        label = os.path.splitext(os.path.basename(str(name)))[0] if name else f"版本{i + 1}"
+        if label in labels:
+            label = f"{label}({i + 1})"
+        labels.append(label)
+    return labels
+
+# 对比同一份报表的多个版本 (文件路径或类文件对象, 按版本顺序), 每个工作簿只打开和解析一次
+# 对比所有版本中都有的sheet; sheet_key_columns / sheet_rules / sheet_mappings 等参数与 compare_workbooks 相同
+# labels: 各版本的名称 (默认使用文件名)
+# 返回 {sheet名称: VersionHistory}
+def compare_versions(sources, sheet_key_columns=None, default_key_columns=None, sheets=None, engine=DEFAULT_ENGINE,
+                     snapshot_store=None, alignment=DEFAULT_ALIGNMENT, metrics=None, sheet_rules=None, default_rules=None,
+                     normalize_headers=False, labels=None, sheet_mappings=None, default_mapping=None):
+    sources = list(sources)
+    if len(sources) < 2:
+        raise ValueError("多版本对比至少需要两个版本")
+    labels = list(labels) if labels is not None else version_labels(sources)
+    sheet_key_columns = sheet_key_columns or {}
+    sheet_rules = sheet_rules or {}
+    sheet_mappings = sheet_mappings or {}
+    
+    hashes = [content_hash(source) if snapshot_store is not None else None for source in sources]
+    
+    with stage(metrics, 'open'):
+        workbooks = [open_workbook(source, engine) for source in sources]
+    try:
+        # 所有版本中都有的sheet (按第一个版本中的顺序)
+        common_sheets = [
+            sheet_name for sheet_name in workbooks[0].sheet_names
+            if all(sheet_name in workbook.sheet_names for workbook in workbooks[1:])
+        ]
+        if sheets:
+            common_sheets = [sheet_name for sheet_name in common_sheets if sheet_name in sheets]
+        
+        histories = {}
+        for sheet_name in common_sheets:
+            # 按顺序读取各版本, 每个版本读出后立即与前一个版本对比
+            def versions():
+                for label, workbook, file_hash in zip(labels, workbooks, hashes):
+                    with stage(metrics, 'read') as record:
+                        df, key_hashes = parse_sheet(workbook, sheet_name, snapshot_store, file_hash)
+                        record['rows'] = len(df)
+                        record['cells'] = df.size
+                    yield label, df, key_hashes
+            
+            with sheet_scope(metrics, sheet_name):
+                histories[sheet_name] = diff_versions(
+                    versions(),
+                    sheet_key_columns.get(sheet_name, default_key_columns or []),
+                    alignment, metrics,
+                    sheet_rules.get(sheet_name, default_rules),
+                    normalize_headers,
+                    sheet_mappings.get(sheet_name, default_mapping)
+                )
+    finally:
+        for workbook in workbooks:
+            workbook.close()
+    
+    return histories
+
+# 把多版本对比结果写入Excel: 每个sheet一个 "变化历史" 工作表, 另有一个各步骤状态统计的工作表
+# output: 文件路径或类文件对象
+def write_history_excel(histories, output):
+    used = set()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, history in histories.items():
+            history.events.to_excel(writer, sheet_name=_history_sheet_name(sheet_name, '历史', used), index=False)
+            history.step_counts().rename_axis('版本').to_excel(writer, sheet_name=_history_sheet_name(sheet_name, '统计', used))
+
+# 输出工作表名称 (Excel工作表名称最长31个字符, 不区分大小写)
+# 截断后与已有的工作表重名时在后缀前加上序号, used: 已使用的名称 (小写), 会加入新的名称
+def _history_sheet_name(sheet_name, suffix, used):
+    index = 1
+    tag = suffix
+    while True:
+        name = f"{str(sheet_name)[:31 - len(tag) - 1]}_{tag}"
+        if name.lower() not in used:
+            used.add(name.lower())
+            return name
+        index += 1
+        tag = f"{index}_{suffix}"
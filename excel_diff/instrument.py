@@ -0,0 +1,175 @@
+# 分阶段的性能记录
+# 每个阶段 (打开文件、读取sheet、对齐行、比较单元格、导出) 记录耗时、内存 (RSS) 和行数/单元格数,
+# 每条记录以一行JSON写入 'excel_diff.metrics' 日志, 可以转发到监控系统; 也可以对整次运行做性能分析
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Windows没有resource模块, 不记录峰值内存
+    resource = None
+
+
+# 性能记录使用的日志名称
+METRICS_LOGGER = 'excel_diff.metrics'
+
+logger = logging.getLogger(METRICS_LOGGER)
+
+# 当前进程的常驻内存 (MB), 无法获取时返回None
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+# 当前进程到目前为止的峰值常驻内存 (MB), 无法获取时返回None
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux上单位为KB, macOS上为字节
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+# 一次运行 (一次对比或一次导出) 的性能记录
+# run_id: 运行编号, 写入每条记录, 便于在日志中把同一次运行的记录放在一起
+# log: 是否把每条记录写入日志 (工作进程中为False, 由主进程汇总后写入)
+class Metrics:
+    def __init__(self, run_id=None, log=True):
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.log = log
+        self.records = []
+        self._local = threading.local()
+    
+    # 之后记录的阶段都属于这个sheet (每个线程单独记录)
+    @contextmanager
+    def sheet(self, sheet_name):
+        previous = getattr(self._local, 'sheet', None)
+        self._local.sheet = sheet_name
+        try:
+            yield
+        finally:
+            self._local.sheet = previous
+    
+    # 记录一个阶段, 产出记录 (dict), 调用方可以在阶段中填入 rows / cells
+    # 峰值内存是进程到阶段结束时的峰值, peak_rss_growth_mb 是这个阶段把峰值提高了多少
+    @contextmanager
+    def stage(self, name, sheet=None, rows=None, cells=None):
+        record = {
+            'run_id': self.run_id,
+            'sheet': sheet if sheet is not None else getattr(self._local, 'sheet', None),
+            'stage': name,
+            'rows': rows,
+            'cells': cells
+        }
+        peak_before = _peak_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            peak = _peak_rss_mb()
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            record['rss_mb'] = _round(_rss_mb())
+            record['peak_rss_mb'] = _round(peak)
+            record['peak_rss_growth_mb'] = _round(peak - peak_before) if peak is not None else None
+            record['pid'] = os.getpid()
+            record['time'] = datetime.now().isoformat(timespec='seconds')
+            self.add(record)
+    
+    # 加入一条记录 (例如工作进程返回的记录)
+    def add(self, record):
+        record['run_id'] = self.run_id
+        self.records.append(record)
+        if self.log:
+            logger.info(json.dumps(record, ensure_ascii=False, default=str))
+    
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+    
+    # 所有记录 (每个阶段一行)
+    # 后台导出线程可能同时在追加记录, 先复制一份列表
+    def to_frame(self):
+        return pd.DataFrame(list(self.records), columns=[
+            'sheet', 'stage', 'seconds', 'rows', 'cells', 'rss_mb', 'peak_rss_mb', 'peak_rss_growth_mb', 'pid'
+        ])
+    
+    # 按阶段汇总: 总耗时、总行数/单元格数、最高峰值内存
+    def summary(self):
+        frame = self.to_frame()
+        if frame.empty:
+            return frame
+        return frame.groupby('stage', sort=False).agg(
+            seconds=('seconds', 'sum'),
+            rows=('rows', 'sum'),
+            cells=('cells', 'sum'),
+            peak_rss_mb=('peak_rss_mb', 'max')
+        ).reset_index()
+
+# 记录一个阶段, metrics为None时不记录 (产出空记录)
+def stage(metrics, name, sheet=None, rows=None, cells=None):
+    if metrics is None:
+        return nullcontext({})
+    return metrics.stage(name, sheet, rows, cells)
+
+# 之后记录的阶段都属于这个sheet, metrics为None时不做任何事
+def sheet_scope(metrics, sheet_name):
+    if metrics is None:
+        return nullcontext()
+    return metrics.sheet(sheet_name)
+
+# 把性能记录 (每条一行JSON) 追加写入文件, 同一个文件只添加一次
+def configure_metrics_log(path):
+    path = os.path.abspath(path)
+    for handler in logger.handlers:
+        if getattr(handler, 'baseFilename', None) == path:
+            return
+    handler = logging.FileHandler(path, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+# 对一段代码做性能分析, 结束后写入path (为None时不分析)
+# .html 使用pyinstrument生成报告 (需要安装pyinstrument), 其他扩展名写入cProfile统计 (可用pstats/snakeviz查看)
+@contextmanager
+def profile_run(path):
+    if path is None:
+        yield
+        return
+    
+    if path.endswith('.html'):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("生成HTML性能分析报告需要安装pyinstrument")
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+        return
+    
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
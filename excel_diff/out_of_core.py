@@ -0,0 +1,309 @@
+# 超出内存的大型sheet分块对比
+# 两个sheet按块流式读取, 按关键列哈希分区写入磁盘临时文件, 再逐个分区对比,
+# 最后按原始行号顺序流式输出标记结果. 峰值内存由内存预算决定, 与sheet大小无关.
+import math
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from .compare import compare_and_mark_changes
+from .export import column_text_length
+from .fingerprint import occurrence_fingerprints, row_fingerprints
+from .schema import align_columns
+
+
+# 默认内存预算 (MB)
+DEFAULT_MEMORY_BUDGET_MB = 512
+
+# 估算内存时每个单元格占用的字节数 (pandas对象列的典型开销)
+BYTES_PER_CELL = 100
+
+# 对比一个分区时相对于原始数据的内存放大倍数 (两个数据框、对齐副本和标记结果)
+DIFF_MEMORY_FACTOR = 6
+
+# 工作表没有记录尺寸信息时使用的分区数
+DEFAULT_PARTITIONS = 64
+
+# 无关键列时按行号对齐使用的内部列
+ROW_NUMBER_COLUMN = '__row_number'
+
+
+# 与pandas一致的表头命名: 空表头为 "Unnamed: n", 重复的列名加 ".1" ".2" 后缀
+def _header_names(values):
+    names = []
+    counts = {}
+    for i, value in enumerate(values):
+        name = f"Unnamed: {i}" if value is None else value
+        if name in counts:
+            counts[name] += 1
+            name = f"{name}.{counts[name]}"
+        else:
+            counts[name] = 0
+        names.append(name)
+    return names
+
+# 以只读模式打开的sheet, 可以按块读出数据行
+class _SheetStream:
+    def __init__(self, source, sheet_name):
+        self._wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        ws = self._wb[sheet_name]
+        self.estimated_rows = max(ws.max_row - 1, 0) if ws.max_row else None
+        self._rows = ws.iter_rows(values_only=True)
+        self.header = _header_names(next(self._rows, ()))
+    
+    # 依次产出带 '__row_id' 列 (从0开始的数据行号) 的数据块, 读完后关闭文件
+    def chunks(self, chunk_rows):
+        width = len(self.header)
+        try:
+            buffer = []
+            row_id = 0
+            for values in self._rows:
+                # 跳过空行 (与pandas读取时一致)
+                if all(value is None for value in values):
+                    continue
+                buffer.append(tuple(values[:width]) + (None,) * (width - len(values)))
+                if len(buffer) >= chunk_rows:
+                    yield _records_to_frame(buffer, self.header, row_id)
+                    row_id += len(buffer)
+                    buffer = []
+            if buffer:
+                yield _records_to_frame(buffer, self.header, row_id)
+        finally:
+            self.close()
+    
+    def close(self):
+        self._wb.close()
+
+def _records_to_frame(records, header, first_row_id):
+    frame = pd.DataFrame.from_records(records, columns=header)
+    frame['__row_id'] = np.arange(first_row_id, first_row_id + len(records))
+    return frame
+
+# 一个关键列值的规范文本: 空值为 "", 整数值的浮点数按整数写 (1000.0 -> "1000"), 其他值为 str(值)
+def _value_text(value):
+    if value is None or value is pd.NaT:
+        return ''
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+# 一列关键列值的规范文本
+# pandas按每个数据块分别推断类型: 有空单元格的块中整数列读出为float64, 没有的块为int64,
+# 直接转为文本时同一个值会得到 "1000.0" 和 "1000" 两种形式, 分到不同的分区而无法配对
+def _key_text(series):
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return series.astype(str).to_numpy(dtype=object)
+    return np.array([_value_text(value) for value in series.astype(object)], dtype=object)
+
+# 关键列的规范文本列名 (行号列不变)
+def _key_text_columns(key_columns):
+    return [col if col == ROW_NUMBER_COLUMN else f"__key_{i}" for i, col in enumerate(key_columns)]
+
+# 给数据块加上关键列的规范文本列, 分区和配对都使用这些列, 原来的关键列只作为普通列比较和输出
+def _with_key_text(chunk, key_columns):
+    for col, text_col in zip(key_columns, _key_text_columns(key_columns)):
+        if col != ROW_NUMBER_COLUMN:
+            chunk[text_col] = _key_text(chunk[col])
+    return chunk
+
+# 计算每行所属的分区 - 关键列相同的行一定在同一分区
+def _partition_ids(chunk, key_columns, partitions):
+    if ROW_NUMBER_COLUMN in key_columns:
+        # 按行号对齐时, 同一行号的行在同一分区
+        return chunk['__row_id'].to_numpy() % partitions
+    hashes = pd.util.hash_pandas_object(chunk[_key_text_columns(key_columns)], index=False).to_numpy()
+    return hashes % np.uint64(partitions)
+
+# 追加一个数据块到临时文件
+def _spill(path, obj):
+    with open(path, 'ab') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+# 删除临时文件
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+# 依次读出临时文件中的所有数据块
+def _load_spilled(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+# 把一个sheet的数据按分区写入临时文件
+def _spill_partitions(chunks, key_columns, partitions, work_dir, prefix):
+    for chunk in chunks:
+        chunk = _with_key_text(chunk, key_columns)
+        part_ids = _partition_ids(chunk, key_columns, partitions)
+        for part in np.unique(part_ids):
+            _spill(os.path.join(work_dir, f"{prefix}_{part}.pkl"), chunk[part_ids == part])
+
+# 读出一个分区的全部行
+def _load_partition(work_dir, prefix, part, header):
+    frames = list(_load_spilled(os.path.join(work_dir, f"{prefix}_{part}.pkl")))
+    if not frames:
+        return pd.DataFrame(columns=header + ['__row_id'])
+    return pd.concat(frames, ignore_index=True).infer_objects()
+
+# 分块对比的结果 - 标记后的数据保存在临时目录中, 按原始行顺序分块读出
+# 使用完后需要调用 close() (或使用with语句) 删除临时文件
+# schema: 列配对结果 (见 schema 模块)
+class OutOfCoreResult:
+    def __init__(self, work_dir, columns, column_lengths, status_counts, buckets, schema=None):
+        self.work_dir = work_dir
+        self.columns = columns
+        self.column_lengths = column_lengths
+        self.status_counts = status_counts
+        self.schema = schema
+        self._buckets = buckets
+    
+    # 按原始文件行顺序产出 (数据块, changes_dict), 新增行在最后
+    def iter_chunks(self):
+        for prefix in ('rows1', 'rows2'):
+            for bucket in sorted(self._buckets[prefix]):
+                frames = []
+                changes_dict = {}
+                for frame, changes in _load_spilled(os.path.join(self.work_dir, f"{prefix}_{bucket}.pkl")):
+                    frames.append(frame)
+                    changes_dict.update(changes)
+                yield pd.concat(frames).sort_index(), changes_dict
+    
+    def close(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+# 对比一个分区, 返回 (原始文件行的标记结果, 新增行的标记结果, changes_dict)
+# 两个结果都以原始文件中的行号为索引; 按关键列的规范文本列配对 (见 _with_key_text)
+def _diff_partition(df1, df2, key_columns, columns, rules=None):
+    ids1 = df1.pop('__row_id').to_numpy()
+    ids2 = df2.pop('__row_id').to_numpy()
+    if ROW_NUMBER_COLUMN in key_columns:
+        df1[ROW_NUMBER_COLUMN] = ids1
+        df2[ROW_NUMBER_COLUMN] = ids2
+    match_keys = _key_text_columns(key_columns)
+    
+    if df1.empty or df2.empty:
+        # 分区中只有一边有数据: 全部为删除或新增
+        marked1 = df1.assign(状态='删除')
+        marked2 = df2.assign(状态='新增')
+        changes_dict = {}
+    else:
+        marked_df, local_changes = compare_and_mark_changes(df1, df2, match_keys, rules=rules)
+        marked1 = marked_df.iloc[:len(df1)]
+        marked2 = marked_df.iloc[len(df1):]
+        
+        # 新增行按对比文件中的顺序追加在最后, 用同样的指纹 (重复键加上出现次序) 找出它们的行号
+        # 关键列相同的行在同一分区, 并且按原始顺序读出, 出现次序与整表对比一致
+        hashes1, hashes2 = row_fingerprints(df1, df2, match_keys)
+        hashes1, _ = occurrence_fingerprints(hashes1)
+        hashes2, _ = occurrence_fingerprints(hashes2)
+        ids2 = ids2[~pd.Index(hashes2).isin(hashes1)]
+        
+        changes_dict = {
+            int(ids1[idx]): {col: changed for col, changed in changes.items() if col in columns}
+            for idx, changes in local_changes.items()
+        }
+    
+    marked1 = marked1.reindex(columns=columns).set_axis(ids1, axis=0)
+    marked2 = marked2.reindex(columns=columns).set_axis(ids2, axis=0)
+    return marked1, marked2, changes_dict
+
+# 按行号区间把标记结果写入临时文件, 输出时每个区间单独读出排序
+def _spill_ranges(marked, changes_dict, rows_per_range, work_dir, prefix, buckets):
+    if marked.empty:
+        return
+    range_ids = marked.index.to_numpy() // rows_per_range
+    for bucket in np.unique(range_ids):
+        part = marked[range_ids == bucket]
+        part_changes = {idx: changes_dict[idx] for idx in part.index if idx in changes_dict}
+        _spill(os.path.join(work_dir, f"{prefix}_{bucket}.pkl"), (part, part_changes))
+        buckets[prefix].add(int(bucket))
+
+# 分块对比两个文件中的同名sheet
+# memory_budget_mb: 峰值内存预算 (MB), 决定读取块大小和分区数量
+# spill_dir: 临时文件目录 (默认使用系统临时目录)
+# rules: 单元格比较规则 {列名: 规则} (见 rules 模块, 可选)
+# column_mapping / normalize_headers: 列配对方式 (见 schema 模块), 配对的列在结果中使用原始文件的列名
+def compare_sheet_out_of_core(file1, file2, sheet_name, key_columns, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, spill_dir=None,
+                              rules=None, column_mapping=None, normalize_headers=False):
+    budget_bytes = memory_budget_mb * 1024 * 1024
+    work_dir = tempfile.mkdtemp(prefix='excel_diff_', dir=spill_dir)
+    
+    try:
+        stream1 = _SheetStream(file1, sheet_name)
+        stream2 = _SheetStream(file2, sheet_name)
+        header1 = stream1.header
+        
+        # 配对两个文件的列, 对比文件中配对的列改用原始文件的列名 (读出的数据块使用改名后的表头)
+        schema = align_columns(header1, stream2.header, column_mapping, normalize_headers)
+        rename = schema.rename_map(header1)
+        stream2.header = [rename.get(col, col) for col in stream2.header]
+        header2 = stream2.header
+        
+        # 确定关键列 (规则与整表对比相同):
+        # 未指定时使用所有共同列加行号, 指定的关键列都不存在时只使用行号
+        if key_columns:
+            compare_keys = [col for col in key_columns if col in header1 and col in header2] or [ROW_NUMBER_COLUMN]
+        else:
+            compare_keys = [col for col in header1 if col in header2] + [ROW_NUMBER_COLUMN]
+        
+        # 确定块大小和分区数量, 让每个分区在对比时不超过内存预算
+        width = max(len(header1), len(header2), 1)
+        chunk_rows = max(1000, budget_bytes // (width * BYTES_PER_CELL * DIFF_MEMORY_FACTOR))
+        if stream1.estimated_rows is not None and stream2.estimated_rows is not None:
+            estimated_bytes = (stream1.estimated_rows + stream2.estimated_rows) * width * BYTES_PER_CELL * DIFF_MEMORY_FACTOR
+            partitions = max(1, math.ceil(estimated_bytes / budget_bytes))
+        else:
+            partitions = DEFAULT_PARTITIONS
+        
+        # 流式读取两个sheet并按分区写入磁盘
+        _spill_partitions(stream1.chunks(chunk_rows), compare_keys, partitions, work_dir, 'part1')
+        _spill_partitions(stream2.chunks(chunk_rows), compare_keys, partitions, work_dir, 'part2')
+        
+        # 输出列: 状态 + 原始文件的列 + 只在对比文件中出现的列
+        columns = ['状态'] + header1 + [col for col in header2 if col not in header1]
+        column_lengths = {col: 0 for col in columns}
+        status_counts = {}
+        buckets = {'rows1': set(), 'rows2': set()}
+        
+        # 逐个分区对比
+        for part in range(partitions):
+            df1 = _load_partition(work_dir, 'part1', part, header1)
+            df2 = _load_partition(work_dir, 'part2', part, header2)
+            if df1.empty and df2.empty:
+                continue
+            
+            marked1, marked2, changes_dict = _diff_partition(df1, df2, compare_keys, columns, rules)
+            for marked in (marked1, marked2):
+                for col in columns:
+                    column_lengths[col] = max(column_lengths[col], column_text_length(marked[col]))
+                for status, count in marked['状态'].value_counts().items():
+                    status_counts[status] = status_counts.get(status, 0) + int(count)
+            
+            _spill_ranges(marked1, changes_dict, chunk_rows, work_dir, 'rows1', buckets)
+            _spill_ranges(marked2, {}, chunk_rows, work_dir, 'rows2', buckets)
+            _remove(os.path.join(work_dir, f"part1_{part}.pkl"))
+            _remove(os.path.join(work_dir, f"part2_{part}.pkl"))
+    except Exception:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    
+    return OutOfCoreResult(work_dir, columns, column_lengths, status_counts, buckets, schema)
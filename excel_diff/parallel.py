@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+
+from .alignment import DEFAULT_ALIGNMENT
+from .compare import diff_frames
+from .instrument import Metrics, sheet_scope, stage
+from .reader import DEFAULT_ENGINE, open_workbook
+from .snapshot import content_hash, parse_sheet
+
+
+# 工作进程中打开的两个工作簿 (每个进程只打开一次)
+_worker_files = {}
+
+# 工作进程初始化 - 文件内容只向每个进程传递一次, 而不是每个sheet传一次
+# 所有sheet都已经读取时文件内容为None, 不打开工作簿
+def _init_worker(file1_bytes, file2_bytes, engine, snapshot_store, alignment, normalize_headers):
+    _worker_files['snapshot_store'] = snapshot_store
+    _worker_files['alignment'] = alignment
+    _worker_files['normalize_headers'] = normalize_headers
+    if file1_bytes is None:
+        return
+    _worker_files['file1'] = open_workbook(BytesIO(file1_bytes), engine)
+    _worker_files['file2'] = open_workbook(BytesIO(file2_bytes), engine)
+    if snapshot_store is not None:
+        _worker_files['hash1'] = content_hash(file1_bytes)
+        _worker_files['hash2'] = content_hash(file2_bytes)
+
+# 在工作进程中读取并对比一个sheet, 返回 (DiffResult, 性能记录)
+# run_id不为None时记录各阶段的性能, 记录返回给主进程汇总
+# frames: 主进程中已经读取的 ((数据框1, 列哈希1), (数据框2, 列哈希2)), 为None时在工作进程中解析
+def _compare_sheet_task(sheet_name, key_columns, rules, column_mapping, run_id, frames=None):
+    metrics = Metrics(run_id, log=False) if run_id is not None else None
+    store = _worker_files['snapshot_store']
+    with sheet_scope(metrics, sheet_name):
+        if frames is not None:
+            (df1, key_hashes1), (df2, key_hashes2) = frames
+        else:
+            with stage(metrics, 'read') as record:
+                df1, key_hashes1 = parse_sheet(_worker_files['file1'], sheet_name, store, _worker_files.get('hash1'))
+                df2, key_hashes2 = parse_sheet(_worker_files['file2'], sheet_name, store, _worker_files.get('hash2'))
+                record['rows'] = len(df1) + len(df2)
+                record['cells'] = df1.size + df2.size
+        diff = diff_frames(df1, df2, key_columns, key_hashes1, _worker_files['alignment'], metrics, rules,
+                           column_mapping, _worker_files['normalize_headers'], key_hashes2)
+    return diff, metrics.records if metrics is not None else []
+
+# 默认并行进程数
+def default_worker_count():
+    return os.cpu_count() or 1
+
+# 多线程进程 (如Streamlit服务器) 中使用的进程启动方式
+# fork只复制调用线程, 其他线程持有的锁 (日志、内存分配、导入锁等) 在子进程中永远不会释放, 可能死锁;
+# forkserver由一个单线程的服务进程fork出工作进程, 第一次启动时需要多花一点时间导入模块; 不支持时使用spawn
+SAFE_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# 进程启动方式, start_method: fork / forkserver / spawn
+# 默认 (命令行, 单线程) 在支持的平台上使用fork: 子进程直接继承已导入的模块, 启动最快;
+# 多线程的调用方应传入 SAFE_START_METHOD. 工作进程中执行的都是本包中的函数, 不依赖 __main__ 模块
+# forkserver的服务进程预先导入本包 (及pandas等依赖), 之后fork出的工作进程不需要再导入
+def _pool_context(start_method=None):
+    if start_method is None and 'fork' in multiprocessing.get_all_start_methods():
+        start_method = 'fork'
+    if start_method is None:
+        return None
+    context = multiprocessing.get_context(start_method)
+    if start_method == 'forkserver':
+        context.set_forkserver_preload(['excel_diff.parallel', 'excel_diff.prefetch'])
+    return context
+
+# 并行对比多个sheet
+# sheet_key_columns: {sheet名称: 关键列列表}
+# snapshot_store: 快照存储 (可选), 读取sheet时优先使用快照
+# alignment: 没有指定关键列的sheet的行对齐方式 (见 alignment 模块)
+# metrics: 性能记录 (见 instrument 模块, 可选), 工作进程中各阶段的记录汇总到这里
+# sheet_rules: {sheet名称: 单元格比较规则} (见 rules 模块, 可选)
+# sheet_mappings: {sheet名称: {原始文件列名: 对比文件列名}}; normalize_headers: 按规范化后的表头配对列 (见 schema 模块)
+# start_method: 工作进程的启动方式 (见 _pool_context), 在多线程的进程中调用时传入 SAFE_START_METHOD
+# sheet_frames: {sheet名称: ((数据框1, 列哈希1), (数据框2, 列哈希2))} 已经读取的sheet (可选, 如后台预读取的结果),
+#               数据直接传给工作进程对比, 不在工作进程中重新解析
+# 每完成一个sheet就产出 (sheet名称, DiffResult, 错误), 顺序按完成先后 (没有数据的sheet结果为None)
+def compare_sheets_parallel(file1_bytes, file2_bytes, sheet_key_columns, max_workers=None, engine=DEFAULT_ENGINE,
+                            snapshot_store=None, alignment=DEFAULT_ALIGNMENT, metrics=None, sheet_rules=None,
+                            sheet_mappings=None, normalize_headers=False, start_method=None, sheet_frames=None):
+    if not sheet_key_columns:
+        return
+    
+    sheet_rules = sheet_rules or {}
+    sheet_mappings = sheet_mappings or {}
+    sheet_frames = sheet_frames or {}
+    if all(sheet_name in sheet_frames for sheet_name in sheet_key_columns):
+        file1_bytes = file2_bytes = None
+    workers = min(max_workers or default_worker_count(), len(sheet_key_columns))
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=_pool_context(start_method),
+        initializer=_init_worker,
+        initargs=(file1_bytes, file2_bytes, engine, snapshot_store, alignment, normalize_headers)
+    ) as pool:
+        futures = {
+            pool.submit(
+                _compare_sheet_task, sheet_name, key_columns, sheet_rules.get(sheet_name), sheet_mappings.get(sheet_name),
+                metrics.run_id if metrics is not None else None, sheet_frames.get(sheet_name)
+            ): sheet_name
+            for sheet_name, key_columns in sheet_key_columns.items()
+        }
+        
+        for future in as_completed(futures):
+            sheet_name = futures[future]
+            try:
+                diff, records = future.result()
+            except Exception as e:
+                yield sheet_name, None, e
+                continue
+            if metrics is not None:
+                metrics.extend(records)
+            yield sheet_name, diff, None
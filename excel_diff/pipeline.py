@@ -0,0 +1,180 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .alignment import DEFAULT_ALIGNMENT
+from .compare import diff_frames
+from .export import export_results, generate_marked_excel_from_chunks
+from .formats import DEFAULT_EXPORT_FORMAT
+from .instrument import Metrics, sheet_scope, stage
+from .out_of_core import DEFAULT_MEMORY_BUDGET_MB, compare_sheet_out_of_core
+from .parallel import _pool_context, default_worker_count
+from .reader import DEFAULT_ENGINE, open_workbook
+from .snapshot import content_hash, parse_sheet
+
+
+# 可对比的Excel文件扩展名
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+# 两个工作簿中需要对比的sheet (按原始文件中的顺序)
+def _common_sheets(sheet_names1, sheet_names2, sheets=None):
+    sheet_names2 = set(sheet_names2)
+    common_sheets = [name for name in sheet_names1 if name in sheet_names2]
+    if sheets:
+        common_sheets = [name for name in common_sheets if name in sheets]
+    return common_sheets
+
+# 对比两个工作簿中的所有同名sheet
+# file1/file2: 文件路径或类文件对象
+# sheet_key_columns: {sheet名称: 关键列列表}, 未列出的sheet使用default_key_columns
+# sheets: 只对比这些sheet (为空时对比所有同名sheet)
+# snapshot_store: 快照存储 (可选), 已解析过的文件直接读取快照
+# alignment: 没有指定关键列的sheet的行对齐方式 (见 alignment 模块)
+# metrics: 性能记录 (见 instrument 模块, 可选)
+# sheet_rules: {sheet名称: 单元格比较规则} (见 rules 模块), 未列出的sheet使用default_rules
+# sheet_mappings: {sheet名称: {原始文件列名: 对比文件列名}}, 未列出的sheet使用default_mapping
+# normalize_headers: 名称不同的列按规范化后的表头配对 (见 schema 模块)
+# 返回与页面相同结构的 marked_results
+def compare_workbooks(file1, file2, sheet_key_columns=None, default_key_columns=None, sheets=None, engine=DEFAULT_ENGINE,
+                      snapshot_store=None, alignment=DEFAULT_ALIGNMENT, metrics=None, sheet_rules=None, default_rules=None,
+                      sheet_mappings=None, default_mapping=None, normalize_headers=False):
+    sheet_key_columns = sheet_key_columns or {}
+    sheet_rules = sheet_rules or {}
+    sheet_mappings = sheet_mappings or {}
+    marked_results = {}
+    hash1 = content_hash(file1) if snapshot_store is not None else None
+    hash2 = content_hash(file2) if snapshot_store is not None else None
+    
+    with stage(metrics, 'open'):
+        excel_file1 = open_workbook(file1, engine)
+        excel_file2 = open_workbook(file2, engine)
+    
+    with excel_file1, excel_file2:
+        for sheet_name in _common_sheets(excel_file1.sheet_names, excel_file2.sheet_names, sheets):
+            key_columns = sheet_key_columns.get(sheet_name, default_key_columns or [])
+            rules = sheet_rules.get(sheet_name, default_rules)
+            with sheet_scope(metrics, sheet_name):
+                with stage(metrics, 'read') as record:
+                    df1, key_hashes1 = parse_sheet(excel_file1, sheet_name, snapshot_store, hash1)
+                    df2, key_hashes2 = parse_sheet(excel_file2, sheet_name, snapshot_store, hash2)
+                    record['rows'] = len(df1) + len(df2)
+                    record['cells'] = df1.size + df2.size
+                
+                diff = diff_frames(df1, df2, key_columns, key_hashes1, alignment, metrics, rules,
+                                   sheet_mappings.get(sheet_name, default_mapping), normalize_headers, key_hashes2)
+            if diff is not None:
+                marked_results[sheet_name] = {
+                    'diff': diff,
+                    'key_columns': key_columns,
+                    'rules': rules
+                }
+    
+    return marked_results
+
+# 分块对比两个工作簿 (适合超出内存的大文件), 结果直接流式写入输出文件
+def _compare_files_out_of_core(path1, path2, output_path, sheet_key_columns=None, default_key_columns=None,
+                               sheets=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, spill_dir=None,
+                               engine=DEFAULT_ENGINE, snapshot_store=None, alignment=DEFAULT_ALIGNMENT, metrics=None,
+                               sheet_rules=None, default_rules=None, sheet_mappings=None, default_mapping=None,
+                               normalize_headers=False, export_format=DEFAULT_EXPORT_FORMAT):
+    # 分块对比使用openpyxl只读模式逐行读取, 读取引擎只用于获取sheet名称, 不使用快照
+    # 各分区单独对比, 只能按关键列 (或行号) 对齐; 分块结果只保存显示文本, 只能导出为Excel
+    if alignment != 'key':
+        raise ValueError("分块对比不支持按内容对齐")
+    if export_format not in ('xlsx', 'changes-xlsx'):
+        raise ValueError(f"分块对比不支持导出为 {export_format}")
+    sheet_key_columns = sheet_key_columns or {}
+    sheet_rules = sheet_rules or {}
+    sheet_mappings = sheet_mappings or {}
+    with open_workbook(path1, engine) as excel_file1, open_workbook(path2, engine) as excel_file2:
+        common_sheets = _common_sheets(excel_file1.sheet_names, excel_file2.sheet_names, sheets)
+    
+    chunked_results = {}
+    try:
+        for sheet_name in common_sheets:
+            key_columns = sheet_key_columns.get(sheet_name, default_key_columns or [])
+            with stage(metrics, 'out_of_core', sheet=sheet_name) as record:
+                chunked_results[sheet_name] = compare_sheet_out_of_core(
+                    path1, path2, sheet_name, key_columns,
+                    memory_budget_mb=memory_budget_mb,
+                    spill_dir=spill_dir,
+                    rules=sheet_rules.get(sheet_name, default_rules),
+                    column_mapping=sheet_mappings.get(sheet_name, default_mapping),
+                    normalize_headers=normalize_headers
+                )
+                record['rows'] = sum(chunked_results[sheet_name].status_counts.values())
+                record['cells'] = record['rows'] * len(chunked_results[sheet_name].columns)
+        if chunked_results:
+            with stage(metrics, 'export'):
+                generate_marked_excel_from_chunks(chunked_results, output_path, changes_only=export_format == 'changes-xlsx')
+    finally:
+        for result in chunked_results.values():
+            result.close()
+    
+    return len(chunked_results)
+
+# 对比两个工作簿文件并写出带标记的结果文件, 返回对比的sheet数量
+# out_of_core=True 时分块对比, 峰值内存不超过 memory_budget_mb
+# instrument=True 时记录各阶段的性能并写入 'excel_diff.metrics' 日志 (见 instrument 模块),
+# 最后一条 'total' 记录包含两个输入文件和输出文件的路径
+# export_format: 输出格式 (见 formats 模块), 默认为带标记的Excel
+def compare_files(path1, path2, output_path, out_of_core=False, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                  spill_dir=None, instrument=False, export_format=DEFAULT_EXPORT_FORMAT, **options):
+    metrics = Metrics() if instrument else None
+    with stage(metrics, 'total') as record:
+        record.update({'file1': str(path1), 'file2': str(path2), 'output': str(output_path)})
+        if out_of_core:
+            return _compare_files_out_of_core(
+                path1, path2, output_path,
+                memory_budget_mb=memory_budget_mb,
+                spill_dir=spill_dir,
+                metrics=metrics,
+                export_format=export_format,
+                **options
+            )
+        
+        marked_results = compare_workbooks(path1, path2, metrics=metrics, **options)
+        if marked_results:
+            export_results(marked_results, export_format, output=output_path, metrics=metrics)
+        return len(marked_results)
+
+# 找出两个目录中同名的Excel文件, 返回 [(原始文件, 对比文件)]
+def match_file_pairs(dir1, dir2):
+    names2 = set(os.listdir(dir2))
+    pairs = []
+    for name in sorted(os.listdir(dir1)):
+        if name.lower().endswith(EXCEL_EXTENSIONS) and name in names2:
+            pairs.append((os.path.join(dir1, name), os.path.join(dir2, name)))
+    return pairs
+
+# 在工作进程中对比一对文件
+def _compare_pair_task(path1, path2, output_path, options):
+    return compare_files(path1, path2, output_path, **options)
+
+# 批量对比多对文件, 每对文件交给一个工作进程
+# pairs: [(原始文件, 对比文件, 输出文件)]
+# 每完成一对就产出 (原始文件, 对比文件, 输出文件, sheet数量, 错误), 顺序按完成先后
+def compare_file_pairs(pairs, max_workers=None, **options):
+    workers = min(max_workers or default_worker_count(), len(pairs))
+    
+    if workers <= 1:
+        for path1, path2, output_path in pairs:
+            try:
+                yield path1, path2, output_path, compare_files(path1, path2, output_path, **options), None
+            except Exception as e:
+                yield path1, path2, output_path, 0, e
+        return
+    
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+        futures = {
+            pool.submit(_compare_pair_task, path1, path2, output_path, options): (path1, path2, output_path)
+            for path1, path2, output_path in pairs
+        }
+        
+        for future in as_completed(futures):
+            path1, path2, output_path = futures[future]
+            try:
+                sheet_count = future.result()
+            except Exception as e:
+                yield path1, path2, output_path, 0, e
+                continue
+            yield path1, path2, output_path, sheet_count, None
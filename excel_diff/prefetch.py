@@ -0,0 +1,153 @@
+# 上传后在后台预读取所有sheet
+# 文件上传后立即在后台进程中解析两个文件的每个sheet, 结果按 (文件内容哈希, 读取引擎) 保存在共享缓存中,
+# 对比时只需等待还没有读取完成的sheet, 解析时间与用户选择sheet、关键列的时间重叠
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from .parallel import _pool_context, default_worker_count
+from .reader import DEFAULT_ENGINE, read_sheet
+
+
+# 最多保留预读取结果的文件数量 (超出后淘汰最久未使用的文件)
+DEFAULT_MAX_FILES = 4
+
+# 预读取状态
+PENDING, READY, FAILED = 'pending', 'ready', 'failed'
+
+# 读取一个sheet, 返回 (数据框, 列哈希)
+# source: 文件内容 (bytes) 或文件路径; 路径按内容而不是扩展名识别文件格式 (预读取的临时文件没有扩展名)
+# 提供了快照存储时优先读取本地快照, 没有快照时解析后保存; 否则直接解析, 列哈希为None
+def load_sheet_data(source, file_hash, sheet_name, engine=DEFAULT_ENGINE, snapshot_store=None):
+    def read():
+        if isinstance(source, bytes):
+            return read_sheet(BytesIO(source), sheet_name, engine=engine)
+        with open(source, 'rb') as file:
+            return read_sheet(file, sheet_name, engine=engine)
+    if snapshot_store is not None:
+        return snapshot_store.load_or_read(file_hash, sheet_name, read)
+    return read(), None
+
+# 一个文件的所有读取任务结束 (完成或取消) 后删除它的临时副本
+def _remove_when_done(path, futures):
+    def remove(_):
+        if all(future.done() for future in futures):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    for future in futures:
+        future.add_done_callback(remove)
+
+# 预读取器 (线程安全, 一个服务进程使用一个, 在多个会话之间共享)
+# 所有文件共用一个进程池 (第一次预读取时创建), 同时读取的进程数不超过max_workers;
+# 文件内容写入临时目录, 工作进程按路径读取, 不通过进程间管道传递整个文件
+# max_workers: 读取进程数 (默认: CPU核数); max_files: 最多保留结果的文件数量
+# start_method: 工作进程的启动方式 (见 parallel._pool_context), 在多线程的进程中使用时传入 SAFE_START_METHOD
+class SheetPrefetcher:
+    def __init__(self, max_workers=None, max_files=DEFAULT_MAX_FILES, start_method=None):
+        self.max_workers = max_workers
+        self.max_files = max_files
+        self.start_method = start_method
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._work_dir = None
+    
+    # 提交一个读取任务 (调用时已持有锁)
+    # 进程池在第一次使用时创建; 工作进程异常退出使进程池不可用后重新创建
+    def _submit(self, *args):
+        if self._pool is not None:
+            try:
+                return self._pool.submit(load_sheet_data, *args)
+            except BrokenProcessPool:
+                self._pool.shutdown(wait=False)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers or default_worker_count(),
+            mp_context=_pool_context(self.start_method)
+        )
+        return self._pool.submit(load_sheet_data, *args)
+    
+    # 开始在后台读取一个文件的所有sheet, 已经提交过的文件不重复读取
+    # snapshot_store: 快照存储 (可选), 读取时优先使用快照, 没有快照时解析后保存
+    def prefetch(self, file_bytes, file_hash, sheet_names, engine=DEFAULT_ENGINE, snapshot_store=None):
+        key = (file_hash, engine)
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+                return
+            
+            path = None
+            futures = {}
+            sheet_names = list(sheet_names)
+            if sheet_names:
+                if self._work_dir is None:
+                    self._work_dir = tempfile.mkdtemp(prefix='excel_diff_prefetch_')
+                path = os.path.join(self._work_dir, f"{file_hash}_{engine}")
+                with open(path, 'wb') as file:
+                    file.write(file_bytes)
+                futures = {
+                    sheet_name: self._submit(path, file_hash, sheet_name, engine, snapshot_store)
+                    for sheet_name in sheet_names
+                }
+            self._files[key] = (path, futures)
+            
+            # 淘汰最久未使用的文件, 还没开始的读取直接取消, 正在读取的完成后再删除临时文件
+            while len(self._files) > self.max_files:
+                _, (evicted_path, evicted) = self._files.popitem(last=False)
+                for future in evicted.values():
+                    future.cancel()
+                if evicted_path is not None:
+                    _remove_when_done(evicted_path, list(evicted.values()))
+    
+    def _future(self, file_hash, sheet_name, engine):
+        with self._lock:
+            entry = self._files.get((file_hash, engine))
+            return entry[1].get(sheet_name) if entry is not None else None
+    
+    # 这个sheet是否已经提交预读取 (可能还没有完成)
+    def submitted(self, file_hash, sheet_name, engine=DEFAULT_ENGINE):
+        future = self._future(file_hash, sheet_name, engine)
+        return future is not None and not future.cancelled()
+    
+    # 预读取的结果 (数据框, 列哈希), 还没有完成时等待完成
+    # 没有预读取、已取消或读取出错时返回None (由调用方重新读取)
+    def result(self, file_hash, sheet_name, engine=DEFAULT_ENGINE):
+        future = self._future(file_hash, sheet_name, engine)
+        if future is None or future.cancelled():
+            return None
+        try:
+            return future.result()
+        except Exception:
+            return None
+    
+    # 一个文件各sheet的预读取状态 {sheet名称: PENDING / READY / FAILED}, 文件没有预读取时返回空字典
+    def status(self, file_hash, engine=DEFAULT_ENGINE):
+        with self._lock:
+            entry = self._files.get((file_hash, engine))
+            futures = dict(entry[1]) if entry is not None else {}
+        status = {}
+        for sheet_name, future in futures.items():
+            if not future.done():
+                status[sheet_name] = PENDING
+            elif future.cancelled() or future.exception() is not None:
+                status[sheet_name] = FAILED
+            else:
+                status[sheet_name] = READY
+        return status
+    
+    # 停止进程池 (还没开始的读取直接取消) 并删除临时目录
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            self._files.clear()
+            if self._work_dir is not None:
+                shutil.rmtree(self._work_dir, ignore_errors=True)
+                self._work_dir = None
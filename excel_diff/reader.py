@@ -0,0 +1,78 @@
+import pandas as pd
+
+
+# 推断列类型时读取的数据行数
+SHEET_INFO_SAMPLE_ROWS = 100
+
+# 读取引擎
+# auto: 优先使用calamine (列式读取, 速度快很多), 未安装或读取失败时退回openpyxl
+# openpyxl: pandas默认引擎 (xlsx使用openpyxl, xls使用xlrd)
+READER_ENGINES = ('auto', 'calamine', 'openpyxl')
+DEFAULT_ENGINE = 'auto'
+
+# 是否安装了calamine引擎 (python-calamine)
+def calamine_available():
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+# 转换为pandas的engine参数
+def _pandas_engine(engine):
+    if engine == 'auto':
+        return 'calamine' if calamine_available() else None
+    if engine == 'calamine':
+        return 'calamine'
+    if engine == 'openpyxl':
+        return None
+    raise ValueError(f"不支持的读取引擎: {engine}")
+
+# 使用指定引擎读取, auto模式下calamine失败时改用默认引擎重新读取
+def _read_with_fallback(source, engine, read):
+    pandas_engine = _pandas_engine(engine)
+    try:
+        return read(pandas_engine)
+    except Exception:
+        if engine != 'auto' or pandas_engine is None:
+            raise
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return read(None)
+
+# 打开工作簿 (返回 pd.ExcelFile, 使用完后需要关闭)
+# source: 文件路径或类文件对象
+def open_workbook(source, engine=DEFAULT_ENGINE):
+    return _read_with_fallback(source, engine, lambda pandas_engine: pd.ExcelFile(source, engine=pandas_engine))
+
+# 读取工作簿的sheet名称
+def read_sheet_names(source, engine=DEFAULT_ENGINE):
+    with open_workbook(source, engine) as excel_file:
+        return excel_file.sheet_names
+
+# 读取一个sheet的全部数据 (sheet_name为0时读取第一个sheet)
+def read_sheet(source, sheet_name=0, engine=DEFAULT_ENGINE):
+    return _read_with_fallback(
+        source, engine,
+        lambda pandas_engine: pd.read_excel(source, sheet_name=sheet_name, engine=pandas_engine)
+    )
+
+# 只读取sheet的表头和少量样本行, 返回列名、行数和列类型
+# 行数来自工作表记录的尺寸信息, 不需要遍历数据行
+# 固定使用默认引擎: openpyxl只读模式可以只解析前几行, calamine会读取整个sheet
+def read_sheet_info(source, sheet_name, sample_rows=SHEET_INFO_SAMPLE_ROWS):
+    with pd.ExcelFile(source) as excel_file:
+        # 先取行数 - 解析时pandas会重置只读工作表的尺寸信息
+        book = excel_file.book
+        if hasattr(book, 'sheet_by_name'):
+            # xls文件 (xlrd)
+            max_row = book.sheet_by_name(sheet_name).nrows
+        else:
+            max_row = book[sheet_name].max_row
+        sample = excel_file.parse(sheet_name, nrows=sample_rows)
+    
+    return {
+        'columns': list(sample.columns),
+        'row_count': max(max_row - 1, 0) if max_row else None,  # 不含表头
+        'dtypes': {str(col): str(dtype) for col, dtype in sample.dtypes.items()}
+    }
@@ -0,0 +1,231 @@
+# 紧凑的对比结果
+# 原始文件的行直接引用解析出的数据框 (不复制、不改写), 只额外保存:
+# 每行的状态 (分类类型), 修改行的单元格修改掩码 (按位压缩), 以及修改单元格的新值 (保留原始类型).
+# "原内容->修改后内容" 的显示文本只在展示或导出时按需生成.
+import numpy as np
+import pandas as pd
+
+from .export import column_text_length
+
+
+# 行状态 (分类编码依次为 0, 1, 2, 3)
+STATUS_CATEGORIES = ['不变', '修改', '删除', '新增']
+UNCHANGED, MODIFIED, DELETED, ADDED = range(len(STATUS_CATEGORIES))
+
+# 导出和展示时每次生成的行数
+DEFAULT_CHUNK_ROWS = 10000
+
+# 生成修改标记字符串 "原内容->修改后内容"
+def format_change(val1, val2):
+    old_val = str(val1) if not pd.isna(val1) else "空"
+    new_val = str(val2) if not pd.isna(val2) else "空"
+    return f"{old_val}->{new_val}"
+
+# sorted_values (升序) 中的每个值是否出现在 rows (升序) 中
+def _members(sorted_values, rows):
+    if not len(rows) or not len(sorted_values):
+        return np.zeros(len(sorted_values), dtype=bool)
+    positions = np.minimum(np.searchsorted(rows, sorted_values), len(rows) - 1)
+    return rows[positions] == sorted_values
+
+# 一列中包含指定文本的位置 (不区分大小写, 空值不匹配)
+def _contains(series, query):
+    text = series.astype(str).str.contains(query, case=False, regex=False).to_numpy(dtype=bool)
+    return text & series.notna().to_numpy()
+
+# 一个sheet的对比结果
+# rows1: 原始文件的数据 (位置索引), added: 新增行 (对比文件中的数据)
+# status_codes: 每行的状态编码 (原始文件的行在前, 新增行在后)
+# compare_columns: 修改掩码对应的列; modified_rows: 修改行的位置; mask_bits: 修改行的掩码 (np.packbits压缩)
+# new_values: {列名: 修改单元格的新值 (以行位置为索引)}
+# duplicate_rows: (原始文件, 对比文件) 中关键列值重复的行数 (不含每个值第一次出现的行)
+# schema: 列配对结果 (见 schema 模块), 包含删除列、新增列和改名的列
+# added_rows: 新增行在对比文件中的行位置 (与 added 的行顺序相同)
+class DiffResult:
+    def __init__(self, rows1, added, status_codes, compare_columns, modified_rows, mask_bits, new_values,
+                 duplicate_rows=(0, 0), schema=None, added_rows=None):
+        self.rows1 = rows1
+        self.added = added
+        self.status = pd.Categorical.from_codes(status_codes, categories=STATUS_CATEGORIES)
+        self.compare_columns = compare_columns
+        self.modified_rows = modified_rows
+        self.mask_bits = mask_bits
+        self.new_values = new_values
+        self.duplicate_rows = duplicate_rows
+        self.schema = schema
+        self.added_rows = added_rows
+        self._column_lengths = None
+        
+        # 输出列: 状态 + 原始文件的列 (有新增行时再加上只在对比文件中出现的列)
+        data_columns = list(rows1.columns)
+        if len(added):
+            data_columns += [col for col in added.columns if col not in data_columns]
+        self.columns = ['状态'] + [col for col in data_columns if col != '状态']
+    
+    def __len__(self):
+        return len(self.status)
+    
+    # 各状态的行数 (只包含出现的状态, 按行数从多到少)
+    def status_counts(self):
+        counts = pd.Series(self.status).value_counts()
+        return counts[counts > 0]
+    
+    # 修改行的单元格修改掩码, 形状为 (修改行数, 比较列数)
+    def changed_mask(self):
+        return np.unpackbits(self.mask_bits, axis=1, count=len(self.compare_columns)).astype(bool)
+    
+    # 修改单元格的数量
+    def changed_cell_count(self):
+        return sum(len(values) for values in self.new_values.values())
+    
+    # 区间内修改行的修改情况 {行号: {列名: 是否修改}}, 与原来的 changes_dict 格式相同
+    def changes_dict(self, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self.changes_for_rows(np.arange(start, stop))
+    
+    # 指定行 (升序的行位置数组) 中修改行的修改情况 {行号: {列名: 是否修改}}
+    def changes_for_rows(self, rows):
+        selected = _members(self.modified_rows, rows)
+        mask = np.unpackbits(self.mask_bits[selected], axis=1, count=len(self.compare_columns)).astype(bool)
+        return {
+            int(idx): dict(zip(self.compare_columns, row_mask.tolist()))
+            for idx, row_mask in zip(self.modified_rows[selected], mask)
+        }
+    
+    # 一列中修改单元格的显示文本 (以行位置为索引), rows不为None时只包含这些行
+    def formatted_changes(self, col, rows=None):
+        new_values = self.new_values[col]
+        if rows is not None:
+            new_values = new_values[_members(new_values.index.to_numpy(), rows)]
+        old_values = self.rows1[col].take(new_values.index)
+        return pd.Series(
+            [format_change(val1, val2) for val1, val2 in zip(old_values.tolist(), new_values.tolist())],
+            index=new_values.index,
+            dtype=object
+        )
+    
+    # 生成指定行 (升序的行位置数组) 的带标记数据框, 索引为行位置
+    def marked_rows(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        n1 = len(self.rows1)
+        split = np.searchsorted(rows, n1)
+        parts = []
+        
+        if split or not len(rows):
+            part1 = self.rows1.take(rows[:split])
+            for col in self.new_values:
+                changes = self.formatted_changes(col, rows[:split])
+                if len(changes):
+                    part1[col] = part1[col].astype(object)
+                    part1.loc[changes.index, col] = changes.to_numpy()
+            parts.append(part1)
+        if split < len(rows):
+            parts.append(self.added.take(rows[split:] - n1))
+        
+        frame = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+        frame.index = pd.Index(rows)
+        frame['状态'] = np.asarray(self.status[rows], dtype=object)
+        return frame.reindex(columns=self.columns)
+    
+    # 生成带标记的数据框 (与原来的 marked_df 相同: 状态列在最前, 修改单元格为 "原内容->修改后内容")
+    # start/stop: 只生成这个区间的行, 索引为行位置
+    def marked_frame(self, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        frame = self.marked_rows(np.arange(min(start, stop), stop))
+        frame.index = pd.RangeIndex(min(start, stop), stop)
+        return frame
+    
+    # 指定行 (升序的行位置数组) 的原值和新值, 返回 (原值数据框, 新值数据框), 索引为行位置, 列为输出列 (不含状态)
+    # 修改行未修改的单元格新值与原值相同; 新增行没有原值, 删除行没有新值 (为空)
+    def old_new_rows(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        data_columns = self.columns[1:]
+        n1 = len(self.rows1)
+        split = np.searchsorted(rows, n1)
+        old_parts = []
+        new_parts = []
+        
+        if split or not len(rows):
+            part1 = self.rows1.take(rows[:split]).reindex(columns=data_columns)
+            old_parts.append(part1)
+            part1 = part1.copy()
+            for col in self.new_values:
+                new_values = self.new_values[col]
+                new_values = new_values[_members(new_values.index.to_numpy(), rows[:split])]
+                if len(new_values):
+                    if part1[col].dtype != new_values.dtype:
+                        part1[col] = part1[col].astype(object)
+                    part1.loc[new_values.index, col] = new_values.to_numpy()
+            new_parts.append(part1.where(pd.Series(self.status.codes[rows[:split]] != DELETED, index=part1.index), axis=0))
+        if split < len(rows):
+            part2 = self.added.take(rows[split:] - n1).reindex(columns=data_columns)
+            old_parts.append(part2.where(pd.Series(False, index=part2.index), axis=0))
+            new_parts.append(part2)
+        
+        frames = []
+        for parts in (old_parts, new_parts):
+            frame = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+            frame.index = pd.Index(rows)
+            frames.append(frame)
+        return frames[0], frames[1]
+    
+    # 指定行 (升序的行位置数组) 中修改单元格的原值和新值
+    # 返回 [(行位置, 列名, 原值, 新值)], 按行位置和列的顺序排列
+    def cell_changes(self, rows):
+        changes = []
+        for col_pos, col in enumerate(self.compare_columns):
+            if col not in self.new_values:
+                continue
+            new_values = self.new_values[col]
+            new_values = new_values[_members(new_values.index.to_numpy(), rows)]
+            old_values = self.rows1[col].take(new_values.index)
+            changes.extend(
+                (row, col_pos, old_value, new_value)
+                for row, old_value, new_value in zip(new_values.index.tolist(), old_values.tolist(), new_values.tolist())
+            )
+        changes.sort(key=lambda change: (change[0], change[1]))
+        return [(row, self.compare_columns[col_pos], old_value, new_value) for row, col_pos, old_value, new_value in changes]
+    
+    # 按状态和关键字筛选行, 返回升序的行位置数组
+    # statuses: 保留的状态 (为None时不筛选)
+    # query: 只保留 search_columns (默认所有列) 中包含该文本的行 (不区分大小写, 修改单元格的新值也参与查找)
+    def find_rows(self, statuses=None, query=None, search_columns=None):
+        keep = np.ones(len(self), dtype=bool)
+        if statuses is not None:
+            keep &= np.isin(self.status.codes, [STATUS_CATEGORIES.index(status) for status in statuses])
+        if query:
+            n1 = len(self.rows1)
+            matched = np.zeros(len(self), dtype=bool)
+            for col in search_columns or self.columns[1:]:
+                if col in self.rows1.columns:
+                    matched[:n1] |= _contains(self.rows1[col], query)
+                if col in self.added.columns and len(self.added):
+                    matched[n1:] |= _contains(self.added[col], query)
+                if col in self.new_values:
+                    new_values = self.new_values[col]
+                    matched[new_values.index.to_numpy()[_contains(new_values, query)]] = True
+            keep &= matched
+        return np.flatnonzero(keep)
+    
+    # 依次产出 (带标记的数据块, changes_dict), 用于分块导出
+    def iter_chunks(self, chunk_rows=DEFAULT_CHUNK_ROWS):
+        for start in range(0, len(self), chunk_rows):
+            stop = min(start + chunk_rows, len(self))
+            yield self.marked_frame(start, stop), self.changes_dict(start, stop)
+    
+    # 每列显示内容的最大长度 (用于计算导出列宽), 计算一次后缓存
+    @property
+    def column_lengths(self):
+        if self._column_lengths is None:
+            lengths = {'状态': max((len(status) for status in self.status_counts().index), default=0)}
+            for col in self.columns[1:]:
+                length = 0
+                if col in self.rows1.columns:
+                    length = column_text_length(self.rows1[col])
+                if col in self.added.columns and len(self.added):
+                    length = max(length, column_text_length(self.added[col]))
+                if col in self.new_values and len(self.new_values[col]):
+                    length = max(length, int(self.formatted_changes(col).str.len().max()))
+                lengths[col] = length
+            self._column_lengths = lengths
+        return self._column_lengths
@@ -0,0 +1,125 @@
+# 单元格比较规则 (按列配置)
+# 计算修改掩码之前, 按列向量化地规范化两边的值 (空白、大小写、数字文本、日期),
+# 再用数值容差排除浮点误差, 避免 "1" 与 1、"张三 " 与 "张三"、日期与时间戳等被标记为修改
+import datetime
+import numbers
+
+import numpy as np
+import pandas as pd
+
+
+# 规则选项及默认值
+# abs_tol / rel_tol: 数值的绝对容差和相对容差, |a-b| <= max(abs_tol, rel_tol * max(|a|, |b|)) 时视为相同
+# numbers: 数字文本按数值比较 ("1" 与 1.0 相同)
+# strip: 忽略文本首尾的空白; ignore_case: 忽略文本大小写
+# dates: 日期、时间戳和日期文本统一为日期后比较 (忽略时间部分)
+DEFAULT_RULE = {
+    'abs_tol': 0.0,
+    'rel_tol': 0.0,
+    'numbers': False,
+    'strip': False,
+    'ignore_case': False,
+    'dates': False
+}
+
+# 对所有列生效的规则使用的列名
+ALL_COLUMNS = '*'
+
+# 补全规则的默认值, 检查选项名称
+def normalize_rule(rule):
+    unknown = set(rule) - set(DEFAULT_RULE)
+    if unknown:
+        raise ValueError(f"不支持的比较规则选项: {', '.join(sorted(unknown))}")
+    rule = {**DEFAULT_RULE, **rule}
+    if rule['abs_tol'] < 0 or rule['rel_tol'] < 0:
+        raise ValueError("容差不能为负数")
+    return rule
+
+# 规则是否会改变比较结果 (全部为默认值时按原样比较)
+def rule_is_active(rule):
+    return rule is not None and normalize_rule(rule) != DEFAULT_RULE
+
+# 一列使用的规则: 列自己的规则优先, 否则使用对所有列生效的规则, 都没有时返回None
+def column_rule(rules, col):
+    if not rules:
+        return None
+    rule = rules.get(col, rules.get(ALL_COLUMNS))
+    return normalize_rule(rule) if rule_is_active(rule) else None
+
+# 规则的可哈希形式 (用于缓存键)
+def rules_key(rules):
+    return tuple(sorted((str(col), tuple(sorted(normalize_rule(rule).items()))) for col, rule in (rules or {}).items()))
+
+# 对象列中的文本 (非文本的位置为NaN), 没有文本时返回None
+def _text(series):
+    try:
+        return series.str.slice(0)
+    except AttributeError:
+        # 对象列中没有文本时不能使用 .str
+        return None
+
+# 文本的空白和大小写规范化, 非文本值不变
+def _normalize_text(series, rule):
+    text = _text(series)
+    if text is None:
+        return series
+    if rule['strip']:
+        text = text.str.strip()
+    if rule['ignore_case']:
+        text = text.str.lower()
+    return series.where(text.isna(), text)
+
+# 日期规范化: 日期、时间戳和可以解析的日期文本统一为当天零点的时间戳 (对象类型), 其他值不变
+def _normalize_dates(series):
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return series.dt.normalize().astype(object)
+    if series.dtype != object:
+        return series
+    candidates = series.map(lambda value: isinstance(value, (str, datetime.date, np.datetime64))).to_numpy(dtype=bool)
+    if not candidates.any():
+        return series
+    dates = pd.to_datetime(series[candidates], errors='coerce', format='mixed').dt.normalize()
+    parsed = dates.notna()
+    series = series.copy()
+    series[dates.index[parsed]] = dates[parsed].astype(object)
+    return series
+
+# 数字文本规范化: 可以解析为数值的文本转换为浮点数, 其他值不变
+def _normalize_numbers(series):
+    text = _text(series)
+    if text is None:
+        return series
+    values = pd.to_numeric(text.str.strip(), errors='coerce')
+    return series.where(values.isna(), values)
+
+# 一列中的数值 (浮点数数组), 不是数值的位置为NaN
+def _as_numbers(values):
+    series = pd.Series(values)
+    if series.dtype.kind in 'iufb':
+        return series.to_numpy(dtype=float)
+    if series.dtype != object:
+        return np.full(len(series), np.nan)
+    is_number = series.map(lambda value: isinstance(value, numbers.Number)).to_numpy(dtype=bool)
+    return pd.to_numeric(series.where(is_number), errors='coerce').to_numpy(dtype=float)
+
+# 按规则规范化一列的值 (numpy数组), 返回规范化后的数组
+def normalize_values(values, rule):
+    series = pd.Series(values)
+    if series.dtype == object:
+        if rule['strip'] or rule['ignore_case']:
+            series = _normalize_text(series, rule)
+        if rule['numbers']:
+            series = _normalize_numbers(series)
+    if rule['dates']:
+        series = _normalize_dates(series)
+    return series.to_numpy()
+
+# 两边都是数值且在容差范围内的位置
+def within_tolerance(values1, values2, rule):
+    if not rule['abs_tol'] and not rule['rel_tol']:
+        return np.zeros(len(values1), dtype=bool)
+    numbers1 = _as_numbers(values1)
+    numbers2 = _as_numbers(values2)
+    with np.errstate(invalid='ignore'):
+        limit = np.maximum(rule['abs_tol'], rule['rel_tol'] * np.maximum(np.abs(numbers1), np.abs(numbers2)))
+        return np.abs(numbers1 - numbers2) <= limit
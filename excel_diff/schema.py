@@ -0,0 +1,82 @@
+# 列结构对齐
+# 比较单元格之前先配对两个sheet的列: 先使用指定的列名映射 (原始文件列名 -> 对比文件列名), 再按列名配对,
+# 可选地按规范化后的表头配对 (全角/半角、首尾和连续空白、大小写). 配对的列只参与一次比较,
+# 改名的列不会因为名称不同被当作删除加新增, 没有配对的列报告为删除列或新增列
+import re
+import unicodedata
+
+
+# 规范化表头: 全角字符转为半角, 去掉首尾空白, 连续空白合并为一个空格, 忽略大小写
+def normalize_header(name):
+    text = unicodedata.normalize('NFKC', str(name))
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+# 列对齐结果
+# pairs: [(原始文件列名, 对比文件列名)], 按原始文件中的列顺序
+# removed: 只在原始文件中的列; added: 只在对比文件中的列 (都按各自文件中的列顺序)
+class SchemaAlignment:
+    def __init__(self, pairs, removed, added):
+        self.pairs = pairs
+        self.removed = removed
+        self.added = added
+    
+    # 名称不同的配对列 {原始文件列名: 对比文件列名}
+    @property
+    def renamed(self):
+        return {col1: col2 for col1, col2 in self.pairs if col1 != col2}
+    
+    # 两个sheet的列是否有差异 (删除、新增或改名)
+    @property
+    def changed(self):
+        return bool(self.removed or self.added or self.renamed)
+    
+    # 对比文件列名的改名方式: 配对的列改用原始文件的列名,
+    # 新增列与原始文件的列同名时 (该列配对给了别的列) 加上 "(对比)" 后缀, 避免列名重复
+    def rename_map(self, columns1):
+        mapping = {col2: col1 for col1, col2 in self.pairs if col1 != col2}
+        names1 = set(columns1)
+        for col in self.added:
+            if col in names1:
+                mapping[col] = f"{col}(对比)"
+        return mapping
+
+# 配对两个sheet的列, 返回 SchemaAlignment
+# mapping: {原始文件列名: 对比文件列名}, 优先使用 (两边不存在的列忽略)
+# normalize_headers: 名称不同的列再按规范化后的表头配对 (只配对规范化后两边都唯一的表头)
+def align_columns(columns1, columns2, mapping=None, normalize_headers=False):
+    columns1 = list(columns1)
+    columns2 = list(columns2)
+    matched = {}
+    available = set(columns2)
+    
+    # 指定的映射
+    for col1, col2 in (mapping or {}).items():
+        if col1 in columns1 and col1 not in matched and col2 in available:
+            matched[col1] = col2
+            available.discard(col2)
+    
+    # 同名列
+    for col1 in columns1:
+        if col1 not in matched and col1 in available:
+            matched[col1] = col1
+            available.discard(col1)
+    
+    # 规范化后同名的列
+    if normalize_headers:
+        def unique_headers(columns):
+            headers = {}
+            for col in columns:
+                headers.setdefault(normalize_header(col), []).append(col)
+            return {header: cols[0] for header, cols in headers.items() if len(cols) == 1}
+        headers1 = unique_headers([col for col in columns1 if col not in matched])
+        headers2 = unique_headers([col for col in columns2 if col in available])
+        for header, col1 in headers1.items():
+            if header in headers2:
+                matched[col1] = headers2[header]
+                available.discard(headers2[header])
+    
+    return SchemaAlignment(
+        pairs=[(col1, matched[col1]) for col1 in columns1 if col1 in matched],
+        removed=[col for col in columns1 if col not in matched],
+        added=[col for col in columns2 if col in available]
+    )
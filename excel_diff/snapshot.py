@@ -0,0 +1,252 @@
+# 已解析sheet的本地快照
+# 每个sheet解析后保存为Arrow IPC文件 (列式存储, 读取时内存映射), 同时保存每列的行哈希,
+# 之后再次对比同一个文件时直接读出快照, 不需要重新解析Excel. 快照按文件内容哈希区分,
+# 超过保留天数或总大小上限时删除最久未使用的快照.
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from .fingerprint import column_hashes
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+
+# 默认快照目录
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'excel_diff', 'snapshots')
+
+# 默认的快照总大小上限 (MB) 和保留天数
+DEFAULT_MAX_SIZE_MB = 2048
+DEFAULT_MAX_AGE_DAYS = 30
+
+# 快照文件的元数据键: 原始列名和逐个单元格编码保存的列位置 (都是JSON)
+# 旧版本用pickle保存的快照没有这两个键, 读取时视为没有快照 (重新解析后覆盖)
+_COLUMNS_KEY = b'excel_diff.columns.json'
+_ENCODED_KEY = b'excel_diff.encoded.json'
+
+# 是否可以使用快照 (需要pyarrow)
+def snapshots_available():
+    return pa is not None
+
+# 计算文件内容的哈希 (与页面缓存使用的哈希相同)
+# source: bytes、文件路径或类文件对象 (读完后回到开头)
+def content_hash(source):
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif hasattr(source, 'read'):
+        source.seek(0)
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+        source.seek(0)
+    else:
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+# 把单个值 (列名或混合类型列中的单元格) 编码为带类型标记的JSON值 [类型, 值], 读取快照时不需要执行任意代码
+# Excel解析结果中不会出现的类型抛出TypeError (不保存快照)
+def _encode_value(value):
+    if value is None:
+        return ['none', None]
+    if isinstance(value, str):
+        return ['str', value]
+    if isinstance(value, (bool, np.bool_)):
+        return ['bool', bool(value)]
+    if isinstance(value, (int, np.integer)):
+        return ['int', int(value)]
+    if isinstance(value, (float, np.floating)):
+        return ['float', float(value)]
+    if value is pd.NaT:
+        return ['nat', None]
+    if isinstance(value, pd.Timestamp):
+        return ['timestamp', value.isoformat()]
+    if isinstance(value, datetime.datetime):
+        return ['datetime', value.isoformat()]
+    if isinstance(value, datetime.date):
+        return ['date', value.isoformat()]
+    if isinstance(value, datetime.time):
+        return ['time', value.isoformat()]
+    raise TypeError(f"快照不支持的值类型: {type(value).__name__}")
+
+_DECODERS = {
+    'none': lambda value: None,
+    'str': str,
+    'bool': bool,
+    'int': int,
+    'float': float,
+    'nat': lambda value: pd.NaT,
+    'timestamp': pd.Timestamp,
+    'datetime': datetime.datetime.fromisoformat,
+    'date': datetime.date.fromisoformat,
+    'time': datetime.time.fromisoformat
+}
+
+def _decode_value(encoded):
+    kind, value = encoded
+    return _DECODERS[kind](value)
+
+# 把一列转换为Arrow数组, 返回 (数组, 是否逐个单元格编码)
+# Arrow无法保存的列 (如数字和文本混在一列、超出int64范围的整数) 逐个单元格编码为JSON文本;
+# 文本以外的对象列 (如整数和小数混在一列、对象类型的日期列) Arrow会转换类型, 读回后类型和值都不变时才直接保存
+def _to_arrow(series):
+    try:
+        array = pa.Array.from_pandas(series)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError):
+        array = None
+    if array is not None and (series.dtype != object or pd.api.types.infer_dtype(series, skipna=True) == 'string'):
+        return array, False
+    
+    values = [json.dumps(_encode_value(value)) for value in series]
+    if array is not None:
+        restored = _from_arrow(array, False)
+        if restored.dtype == object and [json.dumps(_encode_value(value)) for value in restored] == values:
+            return array, False
+    return pa.array(values, type=pa.large_string()), True
+
+# 把Arrow数组转换回与Excel解析结果相同的列
+def _from_arrow(array, encoded):
+    if encoded:
+        return pd.Series([_decode_value(json.loads(value)) for value in array.to_pylist()], dtype=object)
+    series = array.to_pandas()
+    if series.dtype == object:
+        # Arrow中的空值读出为None, 解析Excel时空单元格是NaN
+        values = series.to_numpy()
+        values[pd.isna(values)] = np.nan
+        series = pd.Series(values, dtype=object)
+    return series
+
+# 解析一个sheet, 返回 (数据框, {列名: 列哈希})
+# 提供了快照存储时优先读取快照, 没有快照时解析后保存; 否则直接解析, 列哈希为None
+def parse_sheet(excel_file, sheet_name, snapshot_store=None, file_hash=None):
+    if snapshot_store is None:
+        return excel_file.parse(sheet_name), None
+    return snapshot_store.load_or_read(file_hash, sheet_name, lambda: excel_file.parse(sheet_name))
+
+# 本地快照存储
+# root: 快照目录; max_size_mb / max_age_days: 总大小上限和保留天数 (为None时不限制)
+class SnapshotStore:
+    def __init__(self, root=DEFAULT_SNAPSHOT_DIR, max_size_mb=DEFAULT_MAX_SIZE_MB, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        if not snapshots_available():
+            raise ImportError("快照存储需要安装pyarrow")
+        self.root = root
+        self.max_size_mb = max_size_mb
+        self.max_age_days = max_age_days
+    
+    # 快照文件路径 - sheet名称可能包含文件名不允许的字符, 使用名称的哈希
+    def _path(self, file_hash, sheet_name):
+        name = hashlib.blake2b(str(sheet_name).encode('utf-8'), digest_size=8).hexdigest()
+        return os.path.join(self.root, file_hash, f"{name}.arrow")
+    
+    # 读取快照, 返回 (数据框, {列名: 列哈希}), 没有快照时返回None
+    def load(self, file_hash, sheet_name):
+        path = self._path(file_hash, sheet_name)
+        try:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        
+        metadata = table.schema.metadata or {}
+        if _COLUMNS_KEY not in metadata or _ENCODED_KEY not in metadata:
+            return None
+        columns = [_decode_value(label) for label in json.loads(metadata[_COLUMNS_KEY])]
+        encoded = set(json.loads(metadata[_ENCODED_KEY]))
+        df = pd.DataFrame({
+            i: _from_arrow(table.column(f"c{i}").combine_chunks(), i in encoded)
+            for i in range(len(columns))
+        })
+        df.columns = columns
+        key_hashes = {
+            col: table.column(f"h{i}").to_numpy()
+            for i, col in enumerate(columns)
+        }
+        
+        # 更新访问时间, 清理时按最久未使用的顺序删除
+        os.utime(path)
+        return df, key_hashes
+    
+    # 保存一个sheet的快照, 返回 {列名: 列哈希}
+    # 列名或单元格中有无法编码的值时不保存快照, 只返回列哈希
+    def save(self, file_hash, sheet_name, df):
+        key_hashes = {col: column_hashes(df.iloc[:, i]) for i, col in enumerate(df.columns)}
+        arrays = {}
+        encoded = []
+        try:
+            columns = json.dumps([_encode_value(col) for col in df.columns])
+            for i, col in enumerate(df.columns):
+                arrays[f"c{i}"], is_encoded = _to_arrow(df.iloc[:, i])
+                if is_encoded:
+                    encoded.append(i)
+                arrays[f"h{i}"] = pa.array(key_hashes[col])
+        except TypeError:
+            return key_hashes
+        table = pa.table(arrays, metadata={
+            _COLUMNS_KEY: columns,
+            _ENCODED_KEY: json.dumps(encoded)
+        })
+        
+        # 先写入临时文件再改名, 避免并发读取到不完整的快照
+        path = self._path(file_hash, sheet_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f, pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        
+        self.prune()
+        return key_hashes
+    
+    # 读取快照, 没有时用 read() 解析并保存, 返回 (数据框, {列名: 列哈希})
+    def load_or_read(self, file_hash, sheet_name, read):
+        snapshot = self.load(file_hash, sheet_name)
+        if snapshot is not None:
+            return snapshot
+        df = read()
+        return df, self.save(file_hash, sheet_name, df)
+    
+    # 删除过期的快照, 然后按最久未使用的顺序删除直到总大小不超过上限
+    def prune(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.arrow'):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            expired = self.max_age_days is not None and now - mtime > self.max_age_days * 86400
+            oversized = self.max_size_mb is not None and total > self.max_size_mb * 1024 * 1024
+            if not expired and not oversized:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # 其他进程正在读取 (内存映射) 的快照稍后再删除
+                continue
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
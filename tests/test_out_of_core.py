@@ -0,0 +1,27 @@
+# 分块对比与整表对比的结果应该一致
+import numpy as np
+import pandas as pd
+
+from excel_diff.compare import diff_frames
+from excel_diff.out_of_core import compare_sheet_out_of_core
+
+
+# 关键列中有空单元格时, 各数据块中的关键列类型不同 (float64 / int64), 同一个键仍然应该配对
+def test_empty_key_cell_with_multiple_chunks(tmp_path):
+    rows = 3000
+    df1 = pd.DataFrame({'ID': np.arange(rows, dtype=float), '金额': np.arange(rows)})
+    df2 = df1.copy()
+    df1.loc[10, 'ID'] = np.nan
+    df2.loc[2500, 'ID'] = np.nan
+    df2.loc[5, '金额'] = -1
+    path1 = tmp_path / 'a.xlsx'
+    path2 = tmp_path / 'b.xlsx'
+    df1.to_excel(path1, index=False)
+    df2.to_excel(path2, index=False)
+    
+    expected = diff_frames(pd.read_excel(path1), pd.read_excel(path2), ['ID']).status_counts().to_dict()
+    # 1MB的内存预算使每块只有1000行, 小于sheet的行数
+    with compare_sheet_out_of_core(path1, path2, 'Sheet1', ['ID'], memory_budget_mb=1) as result:
+        assert result.status_counts == expected
+        assert sum(len(chunk) for chunk, _ in result.iter_chunks()) == rows + 1
+    assert expected == {'不变': 2997, '修改': 2, '删除': 1, '新增': 1}
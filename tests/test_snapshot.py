@@ -0,0 +1,33 @@
+# 快照读回的数据框应该与保存前完全相同 (包括列类型)
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from excel_diff.snapshot import SnapshotStore, snapshots_available
+
+
+@pytest.mark.skipif(not snapshots_available(), reason="需要pyarrow")
+def test_round_trip_keeps_dtypes(tmp_path):
+    df = pd.DataFrame({
+        '整数': [1, 2, 3],
+        '小数': [1.5, np.nan, 3.0],
+        '文本': ['a', np.nan, 'c'],
+        '日期': pd.to_datetime(['2024-01-01', None, '2024-01-03']),
+        '超出int64': pd.Series([2 ** 63, -1, 2], dtype=object),
+        '超出uint64': pd.Series([2 ** 64, 1, np.nan], dtype=object),
+        '整数和小数': pd.Series([1, 2.5, np.nan], dtype=object),
+        '对象日期': pd.Series([datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 2), np.nan], dtype=object),
+        '数字和文本': pd.Series([1, 'x', np.nan], dtype=object),
+        '布尔': pd.Series([True, False, np.nan], dtype=object),
+        1: ['列名', '是', '整数'],
+    })
+    store = SnapshotStore(str(tmp_path), max_size_mb=None, max_age_days=None)
+    saved_hashes = store.save('file', 'Sheet1', df)
+    
+    loaded, key_hashes = store.load('file', 'Sheet1')
+    pd.testing.assert_frame_equal(loaded, df, check_dtype=True)
+    for i, col in enumerate(df.columns):
+        assert type(loaded.iloc[0, i]) is type(df.iloc[0, i])
+        np.testing.assert_array_equal(key_hashes[col], saved_hashes[col])